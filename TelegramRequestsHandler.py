@@ -1,18 +1,56 @@
+import json
 import logging
+import math
+import os
 import pprint
-from typing import Any
+from typing import Any, Awaitable, Dict, Optional
 from aiogram import Bot, Dispatcher, types
-from aiogram.filters import Command
-from aiogram.types import ReplyKeyboardMarkup
-import re
-from config import TELEGRAM_TOKEN1, SUPPLY_WB_API_KEY
-from services import WildberriesApiService
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.filters import Command, CommandObject
+from aiogram.types import FSInputFile, ReplyKeyboardMarkup
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
+import time
+from datetime import date, datetime
+from config import TELEGRAM_TOKEN1, DELAY_BETWEEN_WAREHOUSE_COEFFICIENTS_CHECK_SEC
+from config import TELEGRAM_USE_WEBHOOK, TELEGRAM_WEBHOOK_BASE_URL, TELEGRAM_WEBHOOK_PATH, TELEGRAM_WEBHOOK_HOST
+from config import TELEGRAM_WEBHOOK_PORT, TELEGRAM_WEBHOOK_SECRET, TELEGRAM_API_SERVER_URL
+from config import BOOKING_SUPPLY_ID, BOOKING_TARGET_DATES, HISTORY_REPORT_DAYS, MONITOR_SHARDS
+from modules.markdown_module import iter_code_block_messages
+from modules.metrics_module import WB_REQUESTS, WB_RATE_LIMITED, WB_REQUEST_ERRORS, WB_REQUEST_DURATION
+from modules.metrics_module import POLL_CYCLE_DURATION, SLOT_ALERT_LATENCY, Histogram
+from modules.metrics_module import TELEGRAM_QUEUE_DEPTH, MONITORED_CHATS, ACTIVE_POLLERS, ACTIVE_REPORTS
+from modules.table_export_module import TableWriter, EXPORT_FORMAT_CSV, EXPORT_FORMAT_XLSX, xlsx_available
+from services.WildberriesApiRegistry import WildberriesApiRegistry
+from services.WildberriesApiService import WildberriesApiService
+from services.CoefficientsHistory import CoefficientsHistory
+from services.CoefficientsPollingService import CoefficientsPollingService
+from services.NmReportService import NmReportJob, NmReportService
+from services.ShardedCoefficientsMonitor import ShardedCoefficientsMonitor
+from services.SlotBookingService import SlotBookingService
+from services.SlotOpeningPredictor import SlotOpeningPredictor
+from services.StateStore import StateStore
+from services.SubscriptionRules import SubscriptionRule, parse_rule_args
+from services.TelegramMessageQueue import TelegramMessageQueue, TELEGRAM_MAX_MESSAGE_LENGTH
+from services.WildberriesApiErrors import WildberriesApiError, WildberriesForbiddenError, WildberriesCircuitOpenError
+from services.CoefficientsChangeTracker import SlotEvent, SLOT_APPEARED, SLOT_CHANGED, SLOT_DISAPPEARED
+from services.WildberriesModels import AcceptanceCoefficient
 import asyncio
+
+# Тексты уведомлений пишутся в отдельный логгер: он прореживается (config.LOG_SAMPLE_EVERY)
+alerts_logger = logging.getLogger('telegram.alerts')
+
 book_slot_command = "bookslot"
-from slot_browser_booker import book_slot_via_browser
+cancel_booking_command = "cancel_booking"
+auto_book_command = "auto_book"
 
 activate_monitoring_command = "activate_monitoring"
 get_acceptance_coefficients = "get_acceptance_coefficients"
+stop_monitoring_command = "stop_monitoring"
+set_filter_command = "set_filter"
+my_filter_command = "my_filter"
+slot_history_command = "slot_history"
 check_target_warehouse_with_low_coefficients = "check_target_warehouse_with_low_coefficients"
 check_hidden_products_command = "check_hidden_products"
 start_command = "start"
@@ -21,6 +59,132 @@ getting_keyword_statistics = "getting_keyword_statistics"
 get_sales_funnel = "get_sales_funnel"
 create_report = "create_report"
 get_adverts = "get_adverts"
+seller_command = "seller"
+stats_command = "stats"
+
+# Если карточек воронки продаж больше, они отправляются файлом, а не сообщениями
+SALES_FUNNEL_DOCUMENT_THRESHOLD = 20
+# Сколько карточек записывать в файл за один переход в рабочий поток
+SALES_FUNNEL_WRITE_BATCH = 200
+EXPORTS_DIR = 'data/exports'
+
+SALES_FUNNEL_KEY_TRANSLATION = {
+    "brandNames": "Бренды",
+    "objectIDs": "ID предметов",
+    "tagIDs": "ID ярлыков",
+    "nmIDs": "Артикулы Wildberries",
+    "timezone": "Временная зона",
+    "period": "Период",
+    "orderBy": "Сортировка",
+    "page": "Страница",
+    "openCardCount": "Переходы в карточку товара",
+    "addToCart": "Добавления в корзину",
+    "orders": "Количество заказов",
+    "avgRubPrice": "Средняя цена (₽)",
+    "ordersSumRub": "Сумма заказов (₽)",
+    "stockMpQty": "Остатки на маркетплейсе (шт.)",
+    "stockWbQty": "Остатки на складе (шт.)",
+    "cancelSumRub": "Сумма возвратов (₽)",
+    "cancelCount": "Количество возвратов",
+    "buyoutCount": "Количество выкупов",
+    "buyoutSumRub": "Сумма выкупов (₽)",
+    "brandName": "Название бренда",
+    "nmID": "Артикул",
+    "vendorCode": "Артикул поставщика",
+}
+
+
+def translate_sales_funnel_keys(data):
+    if isinstance(data, dict):
+        return {SALES_FUNNEL_KEY_TRANSLATION.get(k, k): translate_sales_funnel_keys(v) for k, v in data.items()}
+    elif isinstance(data, list):
+        return [translate_sales_funnel_keys(item) for item in data]
+    else:
+        return data
+
+
+def format_coefficient_message(info: AcceptanceCoefficient) -> str:
+    # Форматируем дату для лучшей читаемости
+    date_start = info.date_start.replace('T', ' ').replace('Z', '')
+    return (
+        f"Склад: {info.warehouse_name}\n"
+        f"ID: {info.warehouse_id}, "
+        f"Коэффициент: {info.coefficient:g}, "
+        f"Дата начала: {date_start}, "
+        f"Тип поставки: {info.box_type_name}\n"
+        "Дополнительная информация: https://seller.wildberries.ru/supplies-management/all-supplies"
+    )
+
+
+def format_slot_event_message(event: SlotEvent) -> str:
+    if event.kind == SLOT_CHANGED:
+        title = f"🔄 Коэффициент изменился: {event.previous_coefficient:g} → {event.info.coefficient:g}"
+    elif event.kind == SLOT_DISAPPEARED:
+        title = "❌ Слот больше не подходит под условия"
+    else:
+        title = "✅ Появился слот"
+    return f"{title}\n{format_coefficient_message(event.info)}"
+
+
+def format_opening_hours(warehouse_name: str, hours: list) -> str:
+    if not hours:
+        return f"{warehouse_name}: подходящие слоты за период не открывались"
+    total = sum(count for _, count in hours)
+    top = ", ".join(f"{hour:02d}:00–{(hour + 1) % 24:02d}:00 ({count})" for hour, count in hours[:3])
+    return f"{warehouse_name}: открытий слотов — {total}, чаще всего в {top}"
+
+
+def format_latency(histogram: Histogram, **labels) -> str:
+    count = histogram.count(**labels)
+    if not count:
+        return "нет данных"
+    # Квантили оцениваются по корзинам гистограммы — это верхние границы
+    return (f"{count} шт., p50 ≤ {histogram.quantile(0.5, **labels):g} с, "
+            f"p95 ≤ {histogram.quantile(0.95, **labels):g} с")
+
+
+def format_stats() -> str:
+    lines = [
+        "📊 Статистика с момента запуска",
+        f"Мониторинг: чатов {MONITORED_CHATS.value():g}, опросов {ACTIVE_POLLERS.value():g}",
+        f"Очередь Telegram: {TELEGRAM_QUEUE_DEPTH.value():g} сообщ.",
+        f"Отчёты в работе: {ACTIVE_REPORTS.value():g}",
+        f"Обнаружение → доставка уведомления: {format_latency(SLOT_ALERT_LATENCY)}",
+    ]
+    for (mode,) in sorted(POLL_CYCLE_DURATION.label_values()):
+        lines.append(f"Цикл опроса ({mode}): {format_latency(POLL_CYCLE_DURATION, mode=mode)}")
+
+    lines.append("API WB:")
+    requests = {}
+    for endpoint, status in WB_REQUESTS.label_values():
+        requests[endpoint] = requests.get(endpoint, 0) + WB_REQUESTS.value(endpoint=endpoint, status=status)
+    errors = {}
+    for endpoint, reason in WB_REQUEST_ERRORS.label_values():
+        errors[endpoint] = errors.get(endpoint, 0) + WB_REQUEST_ERRORS.value(endpoint=endpoint, reason=reason)
+    endpoints = sorted(set(requests) | set(errors))
+    for endpoint in endpoints:
+        rate_limited = WB_RATE_LIMITED.value(endpoint=endpoint)
+        lines.append(f"• {endpoint}: запросов {requests.get(endpoint, 0):g}, 429 — {rate_limited:g}, "
+                     f"ошибок {errors.get(endpoint, 0):g}; {format_latency(WB_REQUEST_DURATION, endpoint=endpoint)}")
+    if not endpoints:
+        lines.append("• запросов ещё не было")
+    return "\n".join(lines)
+
+
+def format_api_error(error: WildberriesApiError) -> str:
+    if isinstance(error, WildberriesForbiddenError) and all(
+            (error.title, error.detail, error.request_id, error.origin)):
+        return (f"Доступ запрещен. Заголовок ошибки: {error.title}, Детали ошибки: {error.detail}, "
+                f"Уникальный ID запроса: {error.request_id}, ID внутреннего сервиса WB: {error.origin}")
+    if isinstance(error, WildberriesCircuitOpenError):
+        return f"Сервис WB временно недоступен, повторите через {math.ceil(error.retry_in)} сек."
+    return f"Ошибка при получении данных: {error}"
+
+
+def format_api_response(response: Any) -> str:
+    if not isinstance(response, str):
+        response = json.dumps(response, ensure_ascii=False, indent=2)
+    return response[:TELEGRAM_MAX_MESSAGE_LENGTH] or "Пустой ответ"
 
 
 class TelegramRequestsHandler:
@@ -28,17 +192,44 @@ class TelegramRequestsHandler:
     Класс, отвечающий за ответы телеграмм бота на комманды пользователя
     """
 
-    def __init__(self, wildberries_api_service: WildberriesApiService):
-        self.wildberries_api_service = wildberries_api_service
+    def __init__(self, api_registry: WildberriesApiRegistry):
+        self.api_registry = api_registry
+        # Общие для всех кабинетов данные (склады, коэффициенты) запрашиваются через один сервис
+        self.wildberries_api_service = api_registry.shared
 
-        self.bot = Bot(token=TELEGRAM_TOKEN1)
+        self.bot = self.__create_bot()
         self.dp = Dispatcher()
-        self.active_monitoring_tasks = {}
+        self.message_queue = TelegramMessageQueue(self.bot.send_message)
+        self.state_store = StateStore()
+        self.chat_rules: Dict[int, SubscriptionRule] = {}
+        self.coefficients_history = CoefficientsHistory()
+        if MONITOR_SHARDS:
+            # Все склады WB опрашиваются воркерами, чаты получают общий поток изменений
+            self.coefficients_polling_service = ShardedCoefficientsMonitor(api_registry,
+                                                                           history=self.coefficients_history)
+        else:
+            self.coefficients_polling_service = CoefficientsPollingService(self.wildberries_api_service,
+                                                                           state_store=self.state_store,
+                                                                           history=self.coefficients_history,
+                                                                           predictor=SlotOpeningPredictor(
+                                                                               self.coefficients_history))
+        self.slot_booking_service = SlotBookingService()
+        self.nm_report_service = NmReportService()
+
+        # Показатели, которые дешевле вычислить при чтении метрик, чем обновлять при каждом изменении
+        TELEGRAM_QUEUE_DEPTH.set_function(self.message_queue.pending_count)
+        MONITORED_CHATS.set_function(self.coefficients_polling_service.subscriber_count)
+        ACTIVE_POLLERS.set_function(self.coefficients_polling_service.poller_count)
+        ACTIVE_REPORTS.set_function(lambda: len(self.nm_report_service.active_jobs()))
 
         keyboard_buttons = [
             [
                 types.KeyboardButton(text="/" + activate_monitoring_command),
                 types.KeyboardButton(text="/" + get_acceptance_coefficients),
+                types.KeyboardButton(text="/" + stop_monitoring_command),
+                types.KeyboardButton(text="/" + set_filter_command),
+                types.KeyboardButton(text="/" + my_filter_command),
+                types.KeyboardButton(text="/" + slot_history_command),
                 types.KeyboardButton(text="/" + check_target_warehouse_with_low_coefficients),
                 types.KeyboardButton(text="/" + check_hidden_products_command),
                 types.KeyboardButton(text="/" + getting_product_search_queries_command),
@@ -46,7 +237,11 @@ class TelegramRequestsHandler:
                 types.KeyboardButton(text="/" + get_sales_funnel),
                 types.KeyboardButton(text="/" + create_report),
                 types.KeyboardButton(text="/" + get_adverts),
-                types.KeyboardButton(text="/" + book_slot_command)
+                types.KeyboardButton(text="/" + seller_command),
+                types.KeyboardButton(text="/" + stats_command),
+                types.KeyboardButton(text="/" + book_slot_command),
+                types.KeyboardButton(text="/" + cancel_booking_command),
+                types.KeyboardButton(text="/" + auto_book_command)
             ],
         ]
         self.reply_keyboard = ReplyKeyboardMarkup(keyboard=keyboard_buttons, resize_keyboard=True)
@@ -54,6 +249,10 @@ class TelegramRequestsHandler:
         self.dp.message.register(self.__handle_start, (Command(start_command)))
         self.dp.message.register(self.__handle_activate_monitoring, (Command(activate_monitoring_command)))
         self.dp.message.register(self.__handle_get_acceptance_coefficients, (Command(get_acceptance_coefficients)))
+        self.dp.message.register(self.__handle_stop_monitoring, (Command(stop_monitoring_command)))
+        self.dp.message.register(self.__handle_set_filter, (Command(set_filter_command)))
+        self.dp.message.register(self.__handle_my_filter, (Command(my_filter_command)))
+        self.dp.message.register(self.__handle_slot_history, (Command(slot_history_command)))
         self.dp.message.register(self.__handle_activate_monitoring, (Command(check_target_warehouse_with_low_coefficients)))
         self.dp.message.register(self.__handle_check_hidden_products, (Command(check_hidden_products_command)))
         self.dp.message.register(self.__handle_getting_product_search_queries, (Command(getting_product_search_queries_command)))
@@ -61,10 +260,79 @@ class TelegramRequestsHandler:
         self.dp.message.register(self.__handler_get_sales_funnel, (Command(get_sales_funnel)))
         self.dp.message.register(self.__handler_create_report, (Command(create_report)))
         self.dp.message.register(self.__handler_get_adverts, (Command(get_adverts)))
+        self.dp.message.register(self.__handle_seller, (Command(seller_command)))
+        self.dp.message.register(self.__handle_stats, (Command(stats_command)))
         self.dp.message.register(self.__handle_book_slot, (Command(book_slot_command)))
+        self.dp.message.register(self.__handle_cancel_booking, (Command(cancel_booking_command)))
+        self.dp.message.register(self.__handle_auto_book, (Command(auto_book_command)))
 
     async def start_handling(self):
-        await self.dp.start_polling(self.bot, handle_signals=False)
+        try:
+            await self.__restore_chat_sellers()
+            await self.__restore_subscriptions()
+            if TELEGRAM_USE_WEBHOOK:
+                await self.__run_webhook()
+            else:
+                # Вебхук, оставшийся с прошлого запуска, мешает getUpdates
+                await self.bot.delete_webhook()
+                await self.dp.start_polling(self.bot, handle_signals=False)
+        finally:
+            await self.coefficients_polling_service.close()
+            await self.slot_booking_service.close()
+            await self.nm_report_service.close()
+            await self.message_queue.close()
+            await self.state_store.close()
+            await self.coefficients_history.close()
+            await self.bot.session.close()
+
+    @staticmethod
+    def __create_bot() -> Bot:
+        if TELEGRAM_API_SERVER_URL:
+            session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_SERVER_URL))
+            return Bot(token=TELEGRAM_TOKEN1, session=session)
+        return Bot(token=TELEGRAM_TOKEN1)
+
+    async def __run_webhook(self):
+        """
+        Приём обновлений через вебхук: Telegram сам присылает их POST-запросами,
+        каждое обновление обрабатывается отдельной задачей, ответ Telegram отдаётся сразу
+        """
+        app = web.Application()
+        SimpleRequestHandler(dispatcher=self.dp, bot=self.bot, handle_in_background=True,
+                             secret_token=TELEGRAM_WEBHOOK_SECRET).register(app, path=TELEGRAM_WEBHOOK_PATH)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, TELEGRAM_WEBHOOK_HOST, TELEGRAM_WEBHOOK_PORT).start()
+            await self.bot.set_webhook(f"{TELEGRAM_WEBHOOK_BASE_URL.rstrip('/')}{TELEGRAM_WEBHOOK_PATH}",
+                                       secret_token=TELEGRAM_WEBHOOK_SECRET,
+                                       allowed_updates=self.dp.resolve_used_update_types())
+            logging.info(f"Вебхук Telegram слушает {TELEGRAM_WEBHOOK_HOST}:{TELEGRAM_WEBHOOK_PORT}{TELEGRAM_WEBHOOK_PATH}")
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+
+    async def __restore_chat_sellers(self):
+        """Возвращает чатам кабинеты, выбранные до перезапуска"""
+        try:
+            self.api_registry.restore_selections(await self.state_store.load_chat_sellers())
+        except Exception as e:
+            logging.exception(f"Не удалось загрузить выбранные кабинеты: {e}")
+
+    async def __restore_subscriptions(self):
+        """Возобновляет мониторинг чатов, подписанных до перезапуска"""
+        try:
+            subscriptions = await self.state_store.load_subscriptions()
+        except Exception as e:
+            logging.exception(f"Не удалось загрузить подписки: {e}")
+            return
+        for subscription in subscriptions:
+            rule = SubscriptionRule.from_filters(subscription.chat_id, subscription.warehouse_ids,
+                                                 subscription.filters)
+            self.chat_rules[subscription.chat_id] = rule
+            self.coefficients_polling_service.subscribe(rule, self.__notify_coefficient, synced=True)
+        if subscriptions:
+            logging.info(f"Восстановлен мониторинг для чатов: {len(subscriptions)}")
 
     async def __handle_start(self, message: types.Message):
         logging.warning(message.chat.id)
@@ -72,168 +340,339 @@ class TelegramRequestsHandler:
 
     async def __handle_activate_monitoring(self, message: types.Message):
         await message.answer("Отслеживание складов: ")
-        response_message = await self.wildberries_api_service.check_target_warehouse_with_low_coefficients()
-        await message.answer(response_message, reply_markup=self.reply_keyboard)
+        try:
+            rule = self.chat_rules.get(message.chat.id) or SubscriptionRule.default(message.chat.id)
+            low_coefficient_info = await self.wildberries_api_service.check_target_warehouse_with_low_coefficients(rule)
+        except WildberriesApiError as e:
+            logging.error(f"Ошибка при получении данных: {e}")
+            await message.answer(format_api_error(e), reply_markup=self.reply_keyboard)
+            return
+
+        if low_coefficient_info:
+            response_message = "\n\n".join(format_coefficient_message(info) for info in low_coefficient_info)
+        else:
+            response_message = "Подходящих слотов не найдено."
+        await message.answer(response_message[:TELEGRAM_MAX_MESSAGE_LENGTH], reply_markup=self.reply_keyboard)
+
+    async def __answer_api_call(self, message: types.Message, request: Awaitable):
+        """Отвечает результатом запроса к WB; ошибки API форматируются здесь, а не в сервисе"""
+        try:
+            response = await request
+        except WildberriesApiError as e:
+            logging.error(f"Ошибка при получении данных: {e}")
+            await message.answer(format_api_error(e), reply_markup=self.reply_keyboard)
+            return
+        await message.answer(format_api_response(response), reply_markup=self.reply_keyboard)
 
     async def __handle_get_acceptance_coefficients(self, message: types.Message):
         chat_id = message.chat.id
-
-        # Останавливаем предыдущий мониторинг, если был
-        if chat_id in self.active_monitoring_tasks:
-            try:
-                self.active_monitoring_tasks[chat_id].cancel()
-                await asyncio.sleep(1)  # Даем задаче время на завершение
-            except:
-                pass
-            del self.active_monitoring_tasks[chat_id]
-
-        # Обновленное сообщение с информацией о двух складах
+        rule = self.chat_rules.get(chat_id) or SubscriptionRule.default(chat_id)
+        self.__subscribe(rule)
         await message.answer(
-            "✅ Запущен мониторинг складов:\n"
-            "• Тула (ID 206348)\n"
-            "• Подольск (ID 158311)\n\n"
-            "• Будут приходить уведомления при коэффициенте ≤ 3 на любом из складов\n"
-            "• Только для поставок типа 'Короба'\n"
-            "• Обновление каждые 12 секунд"
+            "✅ Запущен мониторинг складов по правилу:\n"
+            f"{rule.describe()}\n\n"
+            "• Уведомления только об изменениях: слот появился, пропал или сменился коэффициент\n"
+            f"• Обновление примерно каждые {DELAY_BETWEEN_WAREHOUSE_COEFFICIENTS_CHECK_SEC} секунд, "
+            "чаще — когда слоты вот-вот откроются\n"
+            f"• Изменить правило: /{set_filter_command}"
         )
 
-        # ID складов для мониторинга (оба склада)
-        TARGET_WAREHOUSE_IDS = [206348, 158311]
-
-        # Запускаем мониторинг
-        task = asyncio.create_task(
-            self.wildberries_api_service.run_periodic_coefficients_check(
-                bot=self.bot,
-                chat_id=chat_id,
-                warehouse_ids=TARGET_WAREHOUSE_IDS
-            )
-        )
-        self.active_monitoring_tasks[chat_id] = task
-
-        # Добавляем обработчик завершения задачи
-        def cleanup_callback(fut):
-            try:
-                if chat_id in self.active_monitoring_tasks:
-                    del self.active_monitoring_tasks[chat_id]
-            except:
-                pass
+    async def __handle_set_filter(self, message: types.Message, command: CommandObject):
+        chat_id = message.chat.id
+        args = (command.args or "").strip()
+        if not args:
+            await message.answer(
+                f"Использование: /{set_filter_command} warehouses=206348,158311 coef=0-3 box=2 "
+                "dates=2025-06-13..2025-06-20 unload=да\n"
+                "Любой параметр можно опустить; box=* — любые типы поставки; unload=да|нет|*; "
+                "coef=-1-3 — включая недоступные (-1); "
+                f"/{set_filter_command} reset — правило по умолчанию")
+            return
+
+        base = self.chat_rules.get(chat_id) or SubscriptionRule.default(chat_id)
+        try:
+            rule = SubscriptionRule.default(chat_id) if args == "reset" else parse_rule_args(chat_id, args, base)
+        except ValueError as e:
+            await message.answer(f"❌ {e}")
+            return
 
-        task.add_done_callback(cleanup_callback)
+        # Новое правило сразу применяется к мониторингу
+        self.__subscribe(rule)
+        await message.answer(f"✅ Правило мониторинга обновлено:\n{rule.describe()}")
 
-        # Добавляем обработчик завершения задачи
-        def cleanup_callback(fut):
-            try:
-                if chat_id in self.active_monitoring_tasks:
-                    del self.active_monitoring_tasks[chat_id]
-            except:
-                pass
-
-        task.add_done_callback(cleanup_callback)
+    async def __handle_my_filter(self, message: types.Message):
+        chat_id = message.chat.id
+        rule = self.chat_rules.get(chat_id) or SubscriptionRule.default(chat_id)
+        status = "включён" if self.coefficients_polling_service.is_subscribed(chat_id) else "выключен"
+        await message.answer(f"Мониторинг {status}. Правило:\n{rule.describe()}")
 
+    async def __handle_slot_history(self, message: types.Message):
+        rule = self.chat_rules.get(message.chat.id) or SubscriptionRule.default(message.chat.id)
+        since = int(time.time()) - HISTORY_REPORT_DAYS * 24 * 60 * 60
+        try:
+            warehouses_by_id = await self.wildberries_api_service.get_warehouses_by_id()
+        except WildberriesApiError:
+            warehouses_by_id = {}
+
+        lines = [f"История открытия слотов за {HISTORY_REPORT_DAYS} дн. "
+                 f"(коэффициент до {rule.max_coefficient:g}, время местное):"]
+        for warehouse_id in sorted(rule.warehouse_ids):
+            hours = await self.coefficients_history.opening_hours(warehouse_id, rule.max_coefficient, since)
+            warehouse = warehouses_by_id.get(warehouse_id)
+            warehouse_name = warehouse.name if warehouse is not None else str(warehouse_id)
+            lines.append(format_opening_hours(warehouse_name, hours))
+        await message.answer("\n".join(lines))
+
+    def __subscribe(self, rule: SubscriptionRule):
+        # Подписка заменяет предыдущий мониторинг чата, если он был.
+        # Опрос API общий для всех чатов с тем же набором складов
+        self.chat_rules[rule.chat_id] = rule
+        self.coefficients_polling_service.subscribe(rule, self.__notify_coefficient)
+        self.state_store.save_subscription(rule.chat_id, rule.warehouse_ids, rule.to_filters())
+
+    async def __handle_stop_monitoring(self, message: types.Message):
+        chat_id = message.chat.id
+        self.slot_booking_service.disarm_auto_booking(chat_id)
+        if self.coefficients_polling_service.unsubscribe(chat_id):
+            self.state_store.delete_subscription(chat_id)
+            await message.answer("🛑 Мониторинг складов остановлен.")
+        else:
+            await message.answer("Мониторинг не был запущен.")
+
+    async def __notify_coefficient(self, chat_id: int, event: SlotEvent):
+        message = format_slot_event_message(event)
+        if event.kind == SLOT_APPEARED:
+            # Быстрый путь: бронирование запускается до отправки уведомления
+            supply_id = self.__start_auto_booking(chat_id, event)
+            if supply_id:
+                message += f"\n⚡ Запущено автобронирование поставки {supply_id}"
+        self.message_queue.enqueue(chat_id, message, detected_at=event.detected_at)
+        alerts_logger.info(f"Поставлено в очередь сообщение: {message}", extra={
+            'chat_id': chat_id, 'event': event.kind, 'warehouse_id': event.info.warehouse_id,
+            'since_detected_ms': round((time.monotonic() - event.detected_at) * 1000, 1)})
+
+    async def __seller_service(self, message: types.Message) -> Optional[WildberriesApiService]:
+        """Кабинет продавца чата; если чату не доступен ни один кабинет — отвечает отказом и возвращает None"""
+        service = self.api_registry.for_chat(message.chat.id)
+        if service is None:
+            await message.answer("⛔ Этот чат не закреплён ни за одним кабинетом продавца. "
+                                 "Обратитесь к администратору бота.")
+        return service
 
     async def __handle_check_hidden_products(self, message: types.Message):
+        service = await self.__seller_service(message)
+        if service is None:
+            return
         await message.answer("Ваши скрытые карточки: ")
-        response_message = await self.wildberries_api_service.get_hidden_products()
-        await message.answer(response_message, reply_markup=self.reply_keyboard)
+        await self.__answer_api_call(message, service.get_hidden_products())
 
     async def __handle_getting_product_search_queries(self, message: types.Message):
+        service = await self.__seller_service(message)
+        if service is None:
+            return
         await message.answer("Поисковые запросы: ")
-        response_message = await self.wildberries_api_service.getting_product_search_queries()
-        await message.answer(response_message, reply_markup=self.reply_keyboard)
+        await self.__answer_api_call(message, service.getting_product_search_queries())
 
     async def __handle_check_get_keyword_stats(self, message: types.Message):
+        service = await self.__seller_service(message)
+        if service is None:
+            return
         await message.answer("Статистика по ключевым фразам: ")
-        response_message = await self.wildberries_api_service.get_keyword_stats()
-        await message.answer(response_message, reply_markup=self.reply_keyboard)
+        await self.__answer_api_call(message, service.get_keyword_stats())
 
-    async def __handler_get_sales_funnel(self, message: Any):
+    async def __handler_get_sales_funnel(self, message: types.Message, command: CommandObject):
+        # /get_sales_funnel [артикулы через запятую] [начало конец в формате ГГГГ-ММ-ДД] [csv|xlsx]
+        args = (command.args or "").split()
+        export_format = args.pop() if args and args[-1] in (EXPORT_FORMAT_CSV, EXPORT_FORMAT_XLSX) else None
+        try:
+            nm_ids = [int(nm_id) for nm_id in args[0].split(",")] if args and args[0] != "*" else []
+            begin = datetime.strptime(args[1], "%Y-%m-%d") if len(args) > 1 else None
+            end = datetime.strptime(args[2], "%Y-%m-%d").replace(hour=23, minute=59, second=59) \
+                if len(args) > 2 else None
+        except ValueError:
+            await message.answer(f"Использование: /{get_sales_funnel} [артикулы через запятую или *] "
+                                 "[начало ГГГГ-ММ-ДД] [конец ГГГГ-ММ-ДД] [csv|xlsx]")
+            return
+        if export_format == EXPORT_FORMAT_XLSX and not xlsx_available():
+            await message.answer("Выгрузка в XLSX недоступна (не установлен openpyxl), пришлю CSV.")
+            export_format = EXPORT_FORMAT_CSV
+
+        service = await self.__seller_service(message)
+        if service is None:
+            return
         await message.answer("Получаю воронку продаж... Пожалуйста, подождите.")
 
+        cards = service.iter_sales_funnel(nm_ids, begin, end)
         try:
-            response_message = await self.wildberries_api_service.get_sales_funnel()
-
-            if response_message is None:
-                await message.answer("Данные по воронке продаж не найдены.")
-                return
-
-            key_translation = {
-                "brandNames": "Бренды",
-                "objectIDs": "ID предметов",
-                "tagIDs": "ID ярлыков",
-                "nmIDs": "Артикулы Wildberries",
-                "timezone": "Временная зона",
-                "period": "Период",
-                "orderBy": "Сортировка",
-                "page": "Страница",
-                "openCardCount": "Переходы в карточку товара",
-                "addToCart": "Добавления в корзину",
-                "orders": "Количество заказов",
-                "avgRubPrice": "Средняя цена (₽)",
-                "ordersSumRub": "Сумма заказов (₽)",
-                "stockMpQty": "Остатки на маркетплейсе (шт.)",
-                "stockWbQty": "Остатки на складе (шт.)",
-                "cancelSumRub": "Сумма возвратов (₽)",
-                "cancelCount": "Количество возвратов",
-                "buyoutCount": "Количество выкупов",
-                "buyoutSumRub": "Сумма выкупов (₽)",
-                "brandName": "Название бренда",
-                "nmID": "Артикул",
-                "vendorCode": "Артикул поставщика",
-            }
-
-            def translate_keys(data):
-                if isinstance(data, dict):
-                    return {key_translation.get(k, k): translate_keys(v) for k, v in data.items()}
-                elif isinstance(data, list):
-                    return [translate_keys(item) for item in data]
-                else:
-                    return data
-
-            def escape_markdown_v2(text):
-                """
-                Экранирует специальные символы для Telegram MarkdownV2.
-                """
-                return re.sub(r'([_*\[\]()~`>#+\-=|{}.!])', r'\\\1', text)
-
-            translated_data = translate_keys(response_message)
-            details = f"```\n{pprint.pformat(translated_data, width=80)}\n```"
-
-            # Экранирование специальных символов
-            details = escape_markdown_v2(details)
-
-            # Отправка длинного сообщения частями
-            if len(details) > 4000:
-                chunks = [details[i:i + 4000] for i in range(0, len(details), 4000)]
-                for chunk in chunks:
-                    await message.answer(chunk, parse_mode="MarkdownV2")
+            head = []
+            if export_format is None:
+                # Первые карточки придерживаем: если их много, вместо десятков сообщений пришлём файл
+                async for card in cards:
+                    head.append(card)
+                    if len(head) > SALES_FUNNEL_DOCUMENT_THRESHOLD:
+                        export_format = EXPORT_FORMAT_CSV
+                        break
+
+            if export_format is None:
+                if not head:
+                    await message.answer("Данные по воронке продаж не найдены.")
+                    return
+                blocks = (pprint.pformat(translate_sales_funnel_keys(card), width=80) for card in head)
+                for text in iter_code_block_messages(blocks, TELEGRAM_MAX_MESSAGE_LENGTH):
+                    await message.answer(text, parse_mode="MarkdownV2")
+                await message.answer(f"Всего карточек: {len(head)}")
             else:
-                await message.answer(details, parse_mode="MarkdownV2")
+                await self.__send_sales_funnel_document(message, head, cards, export_format)
 
+        except WildberriesApiError as e:
+            logging.error(f"Ошибка при получении воронки продаж: {e}")
+            await message.answer(format_api_error(e))
         except Exception as e:
             await message.answer(f"Произошла ошибка: {str(e)}")
+        finally:
+            await cards.aclose()
 
-    async def __handler_create_report(self, message: types.Message):
-        await message.answer("Создание отчета: ")
-        response_message = await self.wildberries_api_service.create_report()
-        await message.answer(response_message, reply_markup=self.reply_keyboard)
+    async def __send_sales_funnel_document(self, message: types.Message, head: list, cards, export_format: str):
+        path = os.path.join(EXPORTS_DIR, f"sales_funnel_{message.chat.id}_{int(time.time())}.{export_format}")
+        try:
+            # Карточки пишутся в файл по мере загрузки страниц; запись на диск и сохранение XLSX —
+            # в рабочем потоке, пачками, чтобы не останавливать цикл событий
+            writer = await asyncio.to_thread(TableWriter, path, export_format)
+            try:
+                batch = [translate_sales_funnel_keys(card) for card in head]
+                async for card in cards:
+                    batch.append(translate_sales_funnel_keys(card))
+                    if len(batch) >= SALES_FUNNEL_WRITE_BATCH:
+                        await asyncio.to_thread(writer.write_many, batch)
+                        batch = []
+                await asyncio.to_thread(writer.write_many, batch)
+            finally:
+                await asyncio.to_thread(writer.close)
+            if writer.rows == 0:
+                await message.answer("Данные по воронке продаж не найдены.")
+                return
+            await message.answer_document(FSInputFile(path), caption=f"Воронка продаж, карточек: {writer.rows}")
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+    async def __handler_create_report(self, message: types.Message, command: CommandObject):
+        chat_id = message.chat.id
+        # /create_report [артикулы через запятую или *] [начало ГГГГ-ММ-ДД] [конец ГГГГ-ММ-ДД]
+        args = (command.args or "").split()
+        try:
+            nm_ids = [int(nm_id) for nm_id in args[0].split(",")] if args and args[0] != "*" else []
+            start_date = date.fromisoformat(args[1]) if len(args) > 1 else None
+            end_date = date.fromisoformat(args[2]) if len(args) > 2 else None
+        except ValueError:
+            await message.answer(f"Использование: /{create_report} [артикулы через запятую или *] "
+                                 "[начало ГГГГ-ММ-ДД] [конец ГГГГ-ММ-ДД]")
+            return
+
+        async def on_ready(job: NmReportJob):
+            summary = job.summary
+            await self.bot.send_document(chat_id, FSInputFile(job.path), caption=(
+                f"📊 Отчёт {job.report_id} готов\n"
+                f"Строк: {summary.rows}, карточек: {len(summary.nm_ids)}\n"
+                f"Переходы в карточку: {summary.open_card_count}\n"
+                f"Заказы: {summary.orders_count} на {summary.orders_sum_rub:.2f} ₽\n"
+                f"Выкупы: {summary.buyouts_count} на {summary.buyouts_sum_rub:.2f} ₽"))
+
+        async def on_error(job: NmReportJob, error: Exception):
+            text = format_api_error(error) if isinstance(error, WildberriesApiError) else str(error)
+            self.message_queue.enqueue(chat_id, f"❌ Отчёт {job.report_id or ''} не получен: {text}")
+
+        service = await self.__seller_service(message)
+        if service is None:
+            return
+        self.nm_report_service.start(service, nm_ids, start_date, end_date, on_ready, on_error)
+        await message.answer("🔄 Отчёт заказан. Пришлю файл, когда WB его сформирует — обычно это несколько минут.")
 
     async def __handler_get_adverts(self, message: types.Message):
+        service = await self.__seller_service(message)
+        if service is None:
+            return
         await message.answer("Кампании: ")
-        response_message = await self.wildberries_api_service.get_adverts()
-        await message.answer(response_message, reply_markup=self.reply_keyboard)
+        await self.__answer_api_call(message, service.get_adverts())
 
-    async def __handle_book_slot(self, message: types.Message):
-        await message.answer("🔄 Запускаю попытки брони слота...")
+    async def __handle_stats(self, message: types.Message):
+        await message.answer(format_stats())
 
-        async def try_loop():
-            while True:
-                success = book_slot_via_browser("cookies.txt")
-                if success:
-                    await message.answer("✅ Слот успешно забронирован!")
-                    break
-                await asyncio.sleep(10)  # интервал между попытками
-
-        asyncio.create_task(try_loop())
+    async def __handle_seller(self, message: types.Message, command: CommandObject):
+        chat_id = message.chat.id
+        name = (command.args or "").strip()
+        service = await self.__seller_service(message)
+        if service is None:
+            return
+        allowed = self.api_registry.allowed_names(chat_id)
+        if name:
+            if not self.api_registry.select(chat_id, name):
+                await message.answer(f"❌ Кабинет «{name}» не найден или недоступен. Доступны: {', '.join(allowed)}")
+                return
+            # Выбор переживает перезапуск бота
+            self.state_store.save_chat_seller(chat_id, name)
+            service = self.api_registry.for_chat(chat_id)
+        await message.answer(f"Кабинет продавца: {service.seller.name}\n"
+                             f"Доступны: {', '.join(allowed)}\n"
+                             f"Сменить: /{seller_command} <имя>")
+
+    async def __handle_book_slot(self, message: types.Message, command: CommandObject):
+        chat_id = message.chat.id
+        # /bookslot [ID поставки] [дни месяца или даты ГГГГ-ММ-ДД через запятую]
+        args = (command.args or "").split()
+        supply_id = args[0] if args else BOOKING_SUPPLY_ID
+        target_dates = args[1].split(",") if len(args) > 1 else BOOKING_TARGET_DATES
+
+        async def on_result(text: str):
+            self.message_queue.enqueue(chat_id, text)
+
+        if not self.slot_booking_service.start(supply_id, target_dates, on_result):
+            await message.answer(f"⏳ Бронирование поставки {supply_id} уже выполняется. "
+                                 f"Отменить: /{cancel_booking_command} {supply_id}")
+            return
+        await message.answer(f"🔄 Запускаю попытки брони слота для поставки {supply_id} "
+                             f"на даты: {', '.join(target_dates)}")
+
+    def __start_auto_booking(self, chat_id: int, event: SlotEvent):
+        supply_id = self.slot_booking_service.auto_booking_supply(chat_id)
+        if not supply_id:
+            return None
+
+        async def on_result(text: str):
+            self.message_queue.enqueue(chat_id, text)
+
+        # Полная дата: в календаре выбирается день именно этого месяца
+        slot_date = event.info.date_start[:10]
+        if self.slot_booking_service.start(supply_id, [slot_date], on_result, detected_at=event.detected_at, max_attempts=1):
+            return supply_id
+        return None
+
+    async def __handle_auto_book(self, message: types.Message, command: CommandObject):
+        chat_id = message.chat.id
+        # /auto_book <ID поставки> — включить, /auto_book off — выключить
+        arg = (command.args or "").strip()
+        if arg.lower() == "off":
+            supply_id = self.slot_booking_service.disarm_auto_booking(chat_id)
+            await message.answer(f"Автобронирование поставки {supply_id} выключено." if supply_id
+                                 else "Автобронирование не было включено.")
+            return
+
+        if not self.coefficients_polling_service.is_subscribed(chat_id):
+            await message.answer(f"Сначала запустите мониторинг: /{get_acceptance_coefficients}")
+            return
+
+        supply_id = arg or BOOKING_SUPPLY_ID
+        self.slot_booking_service.arm_auto_booking(chat_id, supply_id)
+        await message.answer(f"⚡ Автобронирование поставки {supply_id} включено: при появлении подходящего "
+                             f"слота бронь запустится сразу. Выключить: /{auto_book_command} off")
+
+    async def __handle_cancel_booking(self, message: types.Message, command: CommandObject):
+        supply_id = (command.args or "").strip() or None
+        cancelled = self.slot_booking_service.cancel(supply_id)
+        if cancelled:
+            await message.answer(f"🛑 Бронирование отменено: {', '.join(cancelled)}")
+        else:
+            await message.answer("Нет активных бронирований.")
 
 #####################СЛОВАРЬ
 '''key_translation = {
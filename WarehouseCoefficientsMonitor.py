@@ -1,8 +1,12 @@
 import asyncio
 import logging
 
-from config import DELAY_BETWEEN_WAREHOUSE_COEFFICIENTS_CHECK_SEC
 from services import TelegramBotService, WildberriesApiService
+from services.PollingScheduler import AdaptivePollingScheduler
+from services.SubscriptionRules import CompiledMatcher, SubscriptionRule
+from services.WildberriesApiErrors import WildberriesApiError
+from services.WildberriesApiService import ACCEPTANCE_COEFFICIENTS_URL
+from services.CoefficientsChangeTracker import CoefficientsChangeTracker, SLOT_DISAPPEARED
 
 
 class WarehouseCoefficientsMonitor:
@@ -13,47 +17,64 @@ class WarehouseCoefficientsMonitor:
     def __init__(self, telegram_bot_service: TelegramBotService, wildberries_api_service: WildberriesApiService):
         self.telegram_bot_service = telegram_bot_service
         self.wildberries_api_service = wildberries_api_service
+        # Отдельное состояние для каждого источника, чтобы уведомлять только об изменениях
+        self.acceptance_coefficients_tracker = CoefficientsChangeTracker()
+        self.low_coefficients_tracker = CoefficientsChangeTracker()
+        self.scheduler = AdaptivePollingScheduler()
 
-    async def start_monitoring(self):
-        TARGET_WAREHOUSE_ID = 206348
+    async def start_monitoring(self, rule: SubscriptionRule = None):
+        # Правило фильтрации по умолчанию берётся из config.py
+        rule = rule or SubscriptionRule.default()
+        matcher = CompiledMatcher([rule])
         logging.info("Начало главного цикла программы")
+
         while True:
             # Получаем коэффициенты приёмки
-            acceptance_coefficients_info = await self.wildberries_api_service.get_acceptance_coefficients()
+            try:
+                acceptance_coefficients_info = await self.wildberries_api_service.get_acceptance_coefficients(
+                    sorted(rule.warehouse_ids))
+            except WildberriesApiError as e:
+                logging.error(f"Ошибка при получении коэффициентов: {e}")
+                acceptance_coefficients_info = []
 
             if acceptance_coefficients_info:
-                for info in acceptance_coefficients_info:
-                    # Фильтруем по условиям
-                    if (info['warehouse_id'] == TARGET_WAREHOUSE_ID and
-                            info['coefficient'] <= 3 and
-                            info['box_type_name'] == "Короба"):
-                        message = (
-                            f"Склад: {info['warehouse_name']}\n"
-                            f"Коэффициент приёмки: {info['coefficient']}, "
-                            f"Тип поставки: {info['box_type_name']}\n"
-                            "Дополнительная информация: https://seller.wildberries.ru/supplies-management/all-supplies"
-                        )
-                        logging.info(message)
-                        await self.telegram_bot_service.send_message(message)
+                changes = self.acceptance_coefficients_tracker.update(acceptance_coefficients_info)
+                for event in matcher.events(changes).get(rule.chat_id, ()):
+                    if event.kind == SLOT_DISAPPEARED:
+                        continue
+                    info = event.info
+                    message = (
+                        f"Склад: {info.warehouse_name}\n"
+                        f"Коэффициент приёмки: {info.coefficient:g}, "
+                        f"Тип поставки: {info.box_type_name}\n"
+                        "Дополнительная информация: https://seller.wildberries.ru/supplies-management/all-supplies"
+                    )
+                    logging.info(message)
+                    await self.telegram_bot_service.send_message(message)
 
             # Получаем информацию о складах с низким коэффициентом
-            low_coefficient_info = await self.wildberries_api_service.check_target_warehouse_with_low_coefficients()
+            try:
+                low_coefficient_info = await self.wildberries_api_service.check_target_warehouse_with_low_coefficients(rule)
+            except WildberriesApiError as e:
+                logging.error(f"Ошибка при проверке складов: {e}")
+                low_coefficient_info = []
 
             if low_coefficient_info:
-                for info in low_coefficient_info:
-                    # Фильтруем по условиям
-                    if (info['warehouse_id'] == TARGET_WAREHOUSE_ID and
-                            info['coefficient'] <= 3 and
-                            info['box_type_name'] == "Короба"):
-                        message = (
-                            f"Склад: {info['warehouse_name']}\n"
-                            f"ID: {info['warehouse_id']}, "
-                            f"Коэффициент: {info['coefficient']}, "
-                            f"Дата начала: {info['date_start']}, "
-                            f"Тип поставки: {info['box_type_name']}\n"
-                            "Дополнительная информация: https://seller.wildberries.ru/supplies-management/all-supplies"
-                        )
-                        logging.info(message)
-                        await self.telegram_bot_service.send_message(message)
-
-            await asyncio.sleep(DELAY_BETWEEN_WAREHOUSE_COEFFICIENTS_CHECK_SEC)
+                changes = self.low_coefficients_tracker.update(low_coefficient_info)
+                for event in matcher.events(changes).get(rule.chat_id, ()):
+                    if event.kind == SLOT_DISAPPEARED:
+                        continue
+                    info = event.info
+                    message = (
+                        f"Склад: {info.warehouse_name}\n"
+                        f"ID: {info.warehouse_id}, "
+                        f"Коэффициент: {info.coefficient:g}, "
+                        f"Дата начала: {info.date_start}, "
+                        f"Тип поставки: {info.box_type_name}\n"
+                        "Дополнительная информация: https://seller.wildberries.ru/supplies-management/all-supplies"
+                    )
+                    logging.info(message)
+                    await self.telegram_bot_service.send_message(message)
+
+            rate_limit = self.wildberries_api_service.rate_limit_state(ACCEPTANCE_COEFFICIENTS_URL)
+            await asyncio.sleep(self.scheduler.next_delay(rate_limit))
@@ -20,6 +20,149 @@ SELLER_ID = 132681
 #Для раздела продвижение
 PROMOTION_WB_API_KEY = 'YOUR_TOKEN'
 
+# Кабинеты продавцов, обслуживаемые одним ботом. Первый кабинет также используется
+# для общих данных WB (склады, коэффициенты приёмки). chat_ids — чаты, работающие с кабинетом по умолчанию
+SELLERS = [
+    {
+        'name': 'main',
+        'seller_id': SELLER_ID,
+        'supply_api_key': SUPPLY_WB_API_KEY,
+        'analytics_api_key': ANALYTICS_WB_API_KEY,
+        'promotion_api_key': PROMOTION_WB_API_KEY,
+        'chat_ids': [],
+    },
+]
+# Чаты администраторов: могут переключаться на любой кабинет командой /seller.
+# Остальные чаты работают только с кабинетами, в chat_ids которых они указаны
+# (если кабинет один — с ним работают все чаты)
+ADMIN_CHAT_IDS = []
+
+# Журнал: в файл пишутся ошибки (по умолчанию в JSON, по строке на запись), в stdout — всё от INFO
+LOG_FILE_PATH = 'bot_errors.log'
+LOG_FILE_LEVEL = 'ERROR'
+LOG_FILE_MAX_BYTES = 10 * 1024 * 1024
+LOG_FILE_BACKUP_COUNT = 5
+LOG_FILE_JSON = True
+# Частые записи логгеров горячих путей: сохраняется каждая N-я запись уровня INFO (предупреждения — все)
+LOG_SAMPLE_EVERY = {
+    'wb.http': 20,
+    'telegram.alerts': 10,
+}
+# Журнал событий горячих путей: записи этих логгеров от INFO в JSON с полями request_id, latency_ms и др.
+# Ротация как у LOG_FILE_PATH; None — не писать
+LOG_EVENTS_PATH = 'bot_events.log'
+
 # Задержки
 AFTER_ERROR_RESTART_DELAY_SEC = 15
-DELAY_BETWEEN_WAREHOUSE_COEFFICIENTS_CHECK_SEC = 12
+DELAY_BETWEEN_WAREHOUSE_COEFFICIENTS_CHECK_SEC = 12  # базовый интервал опроса
+
+# HTTP-соединения с API Wildberries
+HTTP_CONNECTION_LIMIT_PER_HOST = 10
+HTTP_CONNECTION_LIMITS_BY_HOST = {
+    'supplies-api.wildberries.ru': 10,
+    'seller-analytics-api.wildberries.ru': 5,
+    'advert-api.wildberries.ru': 5,
+}
+HTTP_DNS_CACHE_TTL_SEC = 300
+HTTP_KEEPALIVE_TIMEOUT_SEC = 60
+HTTP_CONNECT_TIMEOUT_SEC = 5
+HTTP_READ_TIMEOUT_SEC = 20
+HTTP_TOTAL_TIMEOUT_SEC = 30
+
+# Лимиты отправки сообщений в Telegram
+TELEGRAM_GLOBAL_RATE_PER_SEC = 30
+TELEGRAM_CHAT_RATE_PER_SEC = 1
+TELEGRAM_SEND_MAX_ATTEMPTS = 3
+
+# Приём обновлений Telegram: long polling (по умолчанию) или вебхук
+TELEGRAM_USE_WEBHOOK = False
+TELEGRAM_WEBHOOK_BASE_URL = 'https://example.com'  # публичный HTTPS-адрес, по которому Telegram достучится до бота
+TELEGRAM_WEBHOOK_PATH = '/telegram/webhook'
+TELEGRAM_WEBHOOK_HOST = '0.0.0.0'
+TELEGRAM_WEBHOOK_PORT = 8080
+TELEGRAM_WEBHOOK_SECRET = 'YOUR_SECRET'  # проверяется в заголовке X-Telegram-Bot-Api-Secret-Token
+# Адрес Bot API; None — официальный сервер. Для локальной проверки можно указать фейковый сервер
+TELEGRAM_API_SERVER_URL = None
+
+# Метрики в формате Prometheus: http://METRICS_HOST:METRICS_PORT/metrics
+METRICS_ENABLED = True
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9100
+
+# Адаптивный опрос коэффициентов
+MIN_WAREHOUSE_COEFFICIENTS_CHECK_SEC = 10  # не чаще лимита токена: 60 / ACCEPTANCE_COEFFICIENTS_REQUESTS_PER_MINUTE
+MAX_WAREHOUSE_COEFFICIENTS_CHECK_SEC = 300
+POLLING_JITTER_RATIO = 0.1
+# Слот считается «близким к открытию», если коэффициент не выше порога на ближайшие дни
+HOT_SLOT_MAX_COEFFICIENT = 5
+HOT_SLOT_DAYS_AHEAD = 3
+
+# Объединение запросов коэффициентов приёмки: склады, запрошенные за окно, уходят одним запросом
+ACCEPTANCE_COEFFICIENTS_BATCH_WINDOW_SEC = 0.05
+WB_MAX_URL_LENGTH = 2000  # длиннее URL могут отвергать прокси и балансировщики
+
+# Шардированный мониторинг всех складов: склады делятся между процессами-воркерами,
+# каждый опрашивает свою часть со своей долей лимита токена. 0 — опрос по подпискам в основном процессе
+MONITOR_SHARDS = 0
+MONITOR_WAREHOUSE_IDS = None  # None — все склады WB
+MONITOR_WAREHOUSES_PER_REQUEST = 50
+# Лимит WB на коэффициенты приёмки — на токен; воркеры с одним токеном делят его поровну
+ACCEPTANCE_COEFFICIENTS_REQUESTS_PER_MINUTE = 6
+MONITOR_WORKER_CHECK_SEC = 30  # как часто проверять, что воркеры живы
+
+# Кэш справочных данных WB (список складов и т.п.)
+WAREHOUSES_CACHE_TTL_SEC = 6 * 60 * 60
+REFERENCE_CACHE_PATH = 'cache/reference_data.json'
+
+# Повторы запросов к API WB и предохранители хостов
+WB_REQUEST_MAX_RETRIES = 3
+WB_RETRY_BASE_DELAY_SEC = 1
+WB_RETRY_MAX_DELAY_SEC = 30
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = 5
+CIRCUIT_BREAKER_RECOVERY_SEC = 60
+
+# Бронирование слотов через браузер
+BOOKING_SUPPLY_ID = "39434885"
+BOOKING_TARGET_DATES = ["13", "14", "15"]  # Дни месяца или даты ГГГГ-ММ-ДД
+CHROME_PROFILE_PATH = "C:/Users/Acer/AppData/Local/Google/Chrome/User Data"
+BOOKING_RETRY_DELAY_SEC = 10
+
+# Хранилище подписок и состояния мониторинга
+STATE_DB_PATH = 'data/bot_state.sqlite3'
+STATE_FLUSH_INTERVAL_SEC = 5
+
+# История коэффициентов приёмки (колоночные файлы по складам)
+HISTORY_DIR = 'data/history'
+HISTORY_FLUSH_INTERVAL_SEC = 30
+HISTORY_REPORT_DAYS = 30
+
+# Прогноз открытия слотов по истории: опрос сгущается в часы, когда слоты обычно открываются
+PREDICTION_WINDOW_DAYS = 8 * 7
+PREDICTION_REFIT_INTERVAL_SEC = 60 * 60
+PREDICTION_MIN_OBSERVED_WEEKS = 3  # сколько раз должен наблюдаться час недели, чтобы доверять прогнозу
+PREDICTION_HIGH_PROBABILITY = 0.3
+PREDICTION_LOW_PROBABILITY = 0.05
+PREDICTION_IDLE_INTERVAL_FACTOR = 5  # во сколько раз реже опрашивать в «холодные» часы
+
+# Воронка продаж (nm-report/detail): лимит WB — 3 запроса в минуту
+SALES_FUNNEL_REQUESTS_PER_MINUTE = 3
+SALES_FUNNEL_BURST = 3
+SALES_FUNNEL_CONCURRENCY = 3  # сколько страниц запрашивать одновременно (после первой, если она не последняя)
+SALES_FUNNEL_NM_IDS_PER_REQUEST = 1000
+SALES_FUNNEL_DEFAULT_DAYS = 7
+
+# Отчёты nm-report/downloads: лимит WB — 3 запроса в минуту на все методы отчётов
+REPORTS_REQUESTS_PER_MINUTE = 3
+REPORT_DOWNLOAD_CHUNK_SIZE = 64 * 1024
+REPORT_POLL_INITIAL_DELAY_SEC = 20
+REPORT_POLL_MAX_DELAY_SEC = 120
+REPORT_READY_TIMEOUT_SEC = 30 * 60
+REPORTS_DIR = 'data/reports'
+
+# Кэш ответов API WB: одинаковые одновременные запросы объединяются, ответ живёт указанное время (сек.)
+RESPONSE_CACHE_TTL_SEC = {
+    'hidden_products': 5 * 60,
+    'adverts': 60,
+    'keyword_stats': 5 * 60,
+    'product_search_queries': 5 * 60,
+}
@@ -1,21 +1,35 @@
 import logging
 import asyncio
 
-from config import AFTER_ERROR_RESTART_DELAY_SEC
+from config import AFTER_ERROR_RESTART_DELAY_SEC, METRICS_ENABLED, METRICS_HOST, METRICS_PORT
 from modules.logger_module import initialize_logger
+from modules.metrics_module import start_metrics_server
 from TelegramRequestsHandler import TelegramRequestsHandler
 from WarehouseCoefficientsMonitor import WarehouseCoefficientsMonitor
 from services.TelegramBotService import TelegramBotService
-from services.WildberriesApiService import WildberriesApiService
+from services.WildberriesApiRegistry import WildberriesApiRegistry
 
 
 
 async def run_all_services():
-    api_service = WildberriesApiService()
-    telegram_handler = TelegramRequestsHandler(api_service)
-
-    # Запускаем только обработчик Telegram
-    await telegram_handler.start_handling()
+    # По сервису с отдельными токенами, пулами соединений и лимитами на каждый кабинет продавца
+    api_registry = WildberriesApiRegistry()
+    telegram_handler = TelegramRequestsHandler(api_registry)
+    metrics_runner = None
+    if METRICS_ENABLED:
+        try:
+            metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+        except OSError as e:
+            # Без метрик бот продолжает работать
+            logging.error(f"Не удалось запустить сервер метрик на {METRICS_HOST}:{METRICS_PORT}: {e}")
+
+    try:
+        # Запускаем только обработчик Telegram
+        await telegram_handler.start_handling()
+    finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await api_registry.close()
 
 
 
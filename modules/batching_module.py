@@ -0,0 +1,89 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Set
+
+
+class RequestBatcher:
+    """
+    Объединяет ключи, запрошенные разными вызывающими в течение короткого окна, в общие запросы.
+    fetch получает пачку ключей и возвращает словарь «ключ -> результат»; каждый вызывающий
+    получает результаты только своих ключей. Одинаковые ключи из разных вызовов запрашиваются один раз.
+    Пачка ограничена суммарной «стоимостью» ключей (например, длиной параметра в URL)
+    """
+
+    def __init__(self, fetch: Callable[[List[Hashable]], Awaitable[Dict[Hashable, Any]]], window_sec: float,
+                 max_batch_cost: float, key_cost: Callable[[Hashable], float] = lambda key: 1):
+        self.fetch = fetch
+        self.window_sec = window_sec
+        self.max_batch_cost = max_batch_cost
+        self.key_cost = key_cost
+        self.__pending: Dict[Hashable, asyncio.Future] = {}
+        self.__flusher: Optional[asyncio.Task] = None
+        # Окна, чьи запросы ещё выполняются (в том числе после того, как __flusher сброшен)
+        self.__flushes: Set[asyncio.Task] = set()
+
+    async def get(self, keys: Iterable[Hashable]) -> Dict[Hashable, Any]:
+        loop = asyncio.get_running_loop()
+        futures = {}
+        for key in keys:
+            future = self.__pending.get(key)
+            if future is None:
+                future = self.__pending[key] = loop.create_future()
+            futures[key] = future
+        if self.__pending and self.__flusher is None:
+            self.__flusher = asyncio.create_task(self.__flush_after_window())
+            self.__flushes.add(self.__flusher)
+            self.__flusher.add_done_callback(self.__flushes.discard)
+        # shield: отмена одного вызывающего не должна отменять результат для остальных
+        results = await asyncio.gather(*(asyncio.shield(future) for future in futures.values()))
+        return dict(zip(futures, results))
+
+    async def close(self):
+        """Отменяет ожидающие и выполняющиеся пачки — до закрытия сессий, через которые они идут"""
+        flushes = list(self.__flushes)
+        for task in flushes:
+            task.cancel()
+        await asyncio.gather(*flushes, return_exceptions=True)
+        # Ключи окна, прерванного до отправки запросов
+        pending, self.__pending = self.__pending, {}
+        self.__flusher = None
+        for future in pending.values():
+            future.cancel()
+
+    def split(self, keys: Iterable[Hashable]) -> List[List[Hashable]]:
+        """Делит ключи на наименьшее число пачек, не превышающих max_batch_cost (ключи по возрастанию)"""
+        batches = []
+        batch, cost = [], 0
+        for key in sorted(keys):
+            key_cost = self.key_cost(key)
+            if batch and cost + key_cost > self.max_batch_cost:
+                batches.append(batch)
+                batch, cost = [], 0
+            batch.append(key)
+            cost += key_cost
+        if batch:
+            batches.append(batch)
+        return batches
+
+    async def __flush_after_window(self):
+        await asyncio.sleep(self.window_sec)
+        # Ключи, запрошенные после этого момента, попадут уже в следующее окно
+        pending, self.__pending = self.__pending, {}
+        self.__flusher = None
+        await asyncio.gather(*(self.__run_batch({key: pending[key] for key in batch})
+                               for batch in self.split(pending)))
+
+    async def __run_batch(self, batch: Dict[Hashable, asyncio.Future]):
+        try:
+            results = await self.fetch(list(batch))
+        except asyncio.CancelledError:
+            for future in batch.values():
+                future.cancel()
+            raise
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for key, future in batch.items():
+            if not future.done():
+                future.set_result(results.get(key))
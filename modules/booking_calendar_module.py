@@ -0,0 +1,34 @@
+from datetime import date
+
+# Основы названий месяцев: подходят и к «Октябрь 2026», и к «октября»
+_MONTH_STEMS = ('январ', 'феврал', 'март', 'апрел', 'ма', 'июн', 'июл', 'август',
+                'сентябр', 'октябр', 'ноябр', 'декабр')
+_UPPER = 'АБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯ'
+_LOWER = 'абвгдеёжзийклмнопрстуфхцчшщъыьэюя'
+
+
+def _month_heading(stems) -> str:
+    """Условие XPath: в элементе есть текст с названием одного из месяцев (без учёта регистра)"""
+    text = f"translate(normalize-space(text()), '{_UPPER}', '{_LOWER}')"
+    # «ма» короче остальных основ, поэтому для мая проверяется начало слова: «май», «мая»
+    conditions = [f"starts-with({text}, 'май') or starts-with({text}, 'мая')" if stem == 'ма'
+                  else f"contains({text}, '{stem}')" for stem in stems]
+    return f".//*[{' or '.join(conditions)}]"
+
+
+def calendar_day_xpath(target: str) -> str:
+    """
+    XPath доступной кнопки дня в календаре бронирования.
+    target — день месяца («2») или дата ГГГГ-ММ-ДД. День сравнивается целиком, а не подстрокой
+    («2» не совпадает с «12» и «22»). Для полной даты кнопка должна лежать в блоке нужного месяца:
+    ближайший к ней предок с заголовком месяца должен называть именно этот месяц
+    """
+    if len(target) == 10:
+        target_date = date.fromisoformat(target)
+        day = str(target_date.day)
+        own_month = _month_heading([_MONTH_STEMS[target_date.month - 1]])
+        month_condition = f" and ancestor::*[{_month_heading(_MONTH_STEMS)}][1][{own_month}]"
+    else:
+        day = str(int(target))
+        month_condition = ""
+    return f"//button[normalize-space(text())='{day}' and not(@disabled){month_condition}]"
@@ -0,0 +1,86 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+
+class AsyncTtlCache:
+    """
+    Асинхронный кэш с временем жизни записей.
+    Одновременные запросы одного ключа объединяются в одну загрузку (single-flight).
+    При указании persist_path записи сохраняются на диск и переживают перезапуск.
+    Значение None не кэшируется — так загрузчик сообщает о неудаче
+    """
+
+    def __init__(self, default_ttl_sec: float, persist_path: Optional[str] = None):
+        self.default_ttl_sec = default_ttl_sec
+        self.persist_path = persist_path
+        # Время истечения хранится как time.time(), чтобы оно имело смысл и после перезапуска
+        self.__entries: Dict[str, Tuple[float, Any]] = {}
+        self.__in_flight: Dict[str, asyncio.Task] = {}
+        self.__loaded_from_disk = persist_path is None
+
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[Any]], ttl_sec: Optional[float] = None):
+        if not self.__loaded_from_disk:
+            await self.__load_from_disk()
+
+        entry = self.__entries.get(key)
+        if entry is not None and entry[0] > time.time():
+            return entry[1]
+
+        task = self.__in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self.__load(key, loader, ttl_sec or self.default_ttl_sec))
+            self.__in_flight[key] = task
+        # shield: отмена одного ожидающего не должна отменять загрузку для остальных
+        return await asyncio.shield(task)
+
+    def invalidate(self, key: str):
+        self.__entries.pop(key, None)
+
+    async def __load(self, key: str, loader: Callable[[], Awaitable[Any]], ttl_sec: float):
+        try:
+            value = await loader()
+            if value is not None:
+                self.__entries[key] = (time.time() + ttl_sec, value)
+                if self.persist_path:
+                    await self.__save_to_disk()
+            return value
+        finally:
+            self.__in_flight.pop(key, None)
+
+    async def __load_from_disk(self):
+        self.__loaded_from_disk = True
+        try:
+            entries = await asyncio.to_thread(self.__read_file)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Не удалось прочитать кэш {self.persist_path}: {e}")
+            return
+        now = time.time()
+        for key, (expires_at, value) in entries.items():
+            if expires_at > now:
+                self.__entries.setdefault(key, (expires_at, value))
+
+    def __read_file(self) -> dict:
+        if not os.path.exists(self.persist_path):
+            return {}
+        with open(self.persist_path, encoding='utf-8') as file:
+            return json.load(file)
+
+    async def __save_to_disk(self):
+        snapshot = dict(self.__entries)
+        try:
+            await asyncio.to_thread(self.__write_file, snapshot)
+        except (OSError, TypeError) as e:
+            logging.warning(f"Не удалось сохранить кэш {self.persist_path}: {e}")
+
+    def __write_file(self, entries: dict):
+        directory = os.path.dirname(self.persist_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.persist_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(entries, file, ensure_ascii=False)
+        os.replace(temp_path, self.persist_path)
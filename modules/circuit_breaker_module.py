@@ -0,0 +1,53 @@
+import time
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Предохранитель для одного хоста: после failure_threshold ошибок подряд
+    запросы не отправляются recovery_timeout_sec секунд, затем пропускается
+    один пробный запрос, по итогам которого хост снова считается доступным или нет
+    """
+
+    def __init__(self, failure_threshold: int, recovery_timeout_sec: float):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout_sec = recovery_timeout_sec
+        self.state = CIRCUIT_CLOSED
+        self.__failures = 0
+        self.__opened_at = 0.0
+
+    def allow_request(self) -> bool:
+        if self.state == CIRCUIT_CLOSED:
+            return True
+        if self.state == CIRCUIT_OPEN and self.retry_in() <= 0:
+            # Пропускаем один пробный запрос, остальные ждут его результата
+            self.state = CIRCUIT_HALF_OPEN
+            return True
+        return False
+
+    def retry_in(self) -> float:
+        """Через сколько секунд будет разрешён пробный запрос"""
+        if self.state != CIRCUIT_OPEN:
+            return 0.0
+        return max(0.0, self.__opened_at + self.recovery_timeout_sec - time.monotonic())
+
+    def record_success(self):
+        self.state = CIRCUIT_CLOSED
+        self.__failures = 0
+
+    def release_probe(self):
+        """
+        Пробный запрос завершился без ответа хоста (отменён или упал внутри бота) —
+        о хосте ничего не известно, поэтому следующий запрос снова станет пробным
+        """
+        if self.state == CIRCUIT_HALF_OPEN:
+            self.state = CIRCUIT_OPEN
+
+    def record_failure(self):
+        self.__failures += 1
+        if self.state == CIRCUIT_HALF_OPEN or self.__failures >= self.failure_threshold:
+            self.state = CIRCUIT_OPEN
+            self.__opened_at = time.monotonic()
@@ -0,0 +1,14 @@
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # orjson быстрее, но необязателен: без него работает стандартный json
+    orjson = None
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    """Разбирает JSON прямо из байтов ответа, без промежуточной строки"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
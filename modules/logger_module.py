@@ -1,26 +1,145 @@
+import atexit
+import copy
+import itertools
+import json
 import logging
+import queue
 import sys
-from logging.handlers import RotatingFileHandler
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Optional
 
+from config import LOG_FILE_PATH, LOG_FILE_LEVEL, LOG_FILE_MAX_BYTES, LOG_FILE_BACKUP_COUNT, LOG_FILE_JSON
+from config import LOG_SAMPLE_EVERY, LOG_EVENTS_PATH
 
-def initialize_logger():
+# Поля, которые есть у любой записи; всё остальное пришло через extra=... и попадает в JSON как есть
+_STANDARD_RECORD_FIELDS = set(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON: время, уровень, логгер, процесс, сообщение и поля из extra"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'process': record.processName,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _RecordQueueHandler(QueueHandler):
     """
-    Инициализация и настройка логгера
+    Кладёт запись в очередь, не склеивая трассировку исключения с сообщением (как делает QueueHandler):
+    трассировка передаётся текстом в exc_text, чтобы JSON-журнал хранил её отдельным полем
     """
 
-    logging.basicConfig(
-        format="{asctime} - {levelname} - {message}",
-        style="{",
-        datefmt="%Y-%m-%d %H:%M",
-        level=logging.INFO,
-        handlers=[
-            RotatingFileHandler("bot_errors.log", maxBytes=200000, backupCount=10),
-            logging.StreamHandler(sys.stdout)
-        ]
-    )
-
-    file_handler = logging.getLogger().handlers[0]
-    file_handler.setLevel(logging.ERROR)
-
-    stream_handler = logging.getLogger().handlers[1]
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает каждую every-ю запись уровня INFO и ниже; предупреждения и ошибки — всегда"""
+
+    def __init__(self, every: int):
+        super().__init__()
+        self.every = every
+        self.__counter = itertools.count()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or next(self.__counter) % self.every == 0
+
+
+class _LoggerNamesFilter(logging.Filter):
+    """Пропускает записи только перечисленных логгеров (и их дочерних)"""
+
+    def __init__(self, names):
+        super().__init__()
+        self.names = tuple(names)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return any(record.name == name or record.name.startswith(name + '.') for name in self.names)
+
+
+class _ForwardHandler(logging.Handler):
+    """Передаёт записи, присланные другими процессами, обработчикам корневого логгера этого процесса"""
+
+    def emit(self, record: logging.LogRecord):
+        for handler in logging.getLogger().handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+def initialize_logger(log_queue=None) -> Optional[QueueListener]:
+    """
+    Инициализация и настройка логгера.
+    Корневой логгер только кладёт записи в очередь, а в файл и stdout их пишет фоновый поток,
+    поэтому логирование не блокирует цикл событий. log_queue — очередь основного процесса
+    (multiprocessing), через которую пишут дочерние процессы; у них своего вывода нет
+    """
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    # Частые записи горячих путей (статусы запросов, уведомления) прореживаются ещё до постановки в очередь
+    for logger_name, every in LOG_SAMPLE_EVERY.items():
+        logging.getLogger(logger_name).addFilter(SamplingFilter(every))
+
+    if log_queue is not None:
+        root.addHandler(_RecordQueueHandler(log_queue))
+        return None
+
+    text_formatter = logging.Formatter("{asctime} - {levelname} - {message}", datefmt="%Y-%m-%d %H:%M", style="{")
+    file_handler = RotatingFileHandler(LOG_FILE_PATH, maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUP_COUNT,
+                                       encoding='utf-8')
+    file_handler.setLevel(LOG_FILE_LEVEL)
+    file_handler.setFormatter(JsonFormatter() if LOG_FILE_JSON else text_formatter)
+
+    # Консоль Windows по умолчанию в cp1251 — кириллица и эмодзи в ней искажаются или роняют запись
+    if hasattr(sys.stdout, 'reconfigure'):
+        sys.stdout.reconfigure(encoding='utf-8', errors='backslashreplace')
+    stream_handler = logging.StreamHandler(sys.stdout)
     stream_handler.setLevel(logging.INFO)
+    stream_handler.setFormatter(text_formatter)
+    handlers = [file_handler, stream_handler]
+
+    # Структурированные записи горячих путей имеют уровень INFO — в журнал ошибок они не попадают,
+    # поэтому пишутся отдельным JSON-журналом
+    if LOG_EVENTS_PATH and LOG_SAMPLE_EVERY:
+        events_handler = RotatingFileHandler(LOG_EVENTS_PATH, maxBytes=LOG_FILE_MAX_BYTES,
+                                             backupCount=LOG_FILE_BACKUP_COUNT, encoding='utf-8')
+        events_handler.setLevel(logging.INFO)
+        events_handler.addFilter(_LoggerNamesFilter(LOG_SAMPLE_EVERY))
+        events_handler.setFormatter(JsonFormatter())
+        handlers.append(events_handler)
+
+    records = queue.SimpleQueue()
+    root.addHandler(_RecordQueueHandler(records))
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    # При выходе дописываем всё, что осталось в очереди
+    atexit.register(listener.stop)
+    return listener
+
+
+def start_log_forwarding(log_queue) -> QueueListener:
+    """Пишет в журнал этого процесса записи, присланные дочерними процессами через log_queue"""
+    listener = QueueListener(log_queue, _ForwardHandler())
+    listener.start()
+    return listener
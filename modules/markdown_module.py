@@ -0,0 +1,69 @@
+from typing import Iterable, Iterator
+
+_CODE_FENCE_OPEN = "```\n"
+_CODE_FENCE_CLOSE = "\n```"
+
+
+def escape_code_block(text: str) -> str:
+    """Экранирование для блока кода MarkdownV2: внутри ``` экранируются только ` и \\"""
+    return text.replace("\\", "\\\\").replace("`", "\\`")
+
+
+def _split_escaped(text: str, limit: int) -> Iterator[str]:
+    """
+    Делит экранированный текст на куски не длиннее limit: по строкам,
+    а слишком длинные строки — так, чтобы не разорвать пару «\\ + символ»
+    """
+    piece = []
+    length = 0
+    for line in text.splitlines(keepends=True):
+        while len(line) > limit:
+            cut = limit
+            # Нечётное число обратных слешей перед разрезом — разрываем escape-последовательность
+            backslashes = len(line[:cut]) - len(line[:cut].rstrip("\\"))
+            if backslashes % 2:
+                cut -= 1
+            if piece:
+                yield "".join(piece)
+                piece, length = [], 0
+            yield line[:cut]
+            line = line[cut:]
+        if length + len(line) > limit:
+            yield "".join(piece)
+            piece, length = [], 0
+        piece.append(line)
+        length += len(line)
+    if piece:
+        yield "".join(piece)
+
+
+def iter_code_block_messages(blocks: Iterable[str], limit: int) -> Iterator[str]:
+    """
+    Собирает текстовые блоки (например, по одной записи) в сообщения MarkdownV2 с блоком кода,
+    каждое не длиннее limit символов. Блоки обрабатываются по одному, каждое сообщение
+    закрывает свой блок кода, поэтому Telegram не получит незакрытый ``` или разорванное экранирование
+    """
+    # Каждая часть уже заканчивается переводом строки (или продолжает разрезанную строку),
+    # поэтому части склеиваются без разделителя; последний перевод строки заменяет собой начало закрывающего ```
+    body_limit = limit - len(_CODE_FENCE_OPEN) - len(_CODE_FENCE_CLOSE)
+    current = []
+    length = 0
+    for block in blocks:
+        escaped = escape_code_block(block)
+        if not escaped.endswith("\n"):
+            escaped += "\n"
+        for piece in _split_escaped(escaped, body_limit):
+            if current and length + len(piece) > body_limit:
+                yield _code_block_message(current)
+                current, length = [], 0
+            current.append(piece)
+            length += len(piece)
+    if current:
+        yield _code_block_message(current)
+
+
+def _code_block_message(pieces: list) -> str:
+    body = "".join(pieces)
+    if body.endswith("\n"):
+        body = body[:-1]
+    return _CODE_FENCE_OPEN + body + _CODE_FENCE_CLOSE
@@ -0,0 +1,228 @@
+import bisect
+import logging
+import math
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+# Границы корзин гистограмм задержек, секунды
+LATENCY_BUCKETS_SEC = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape_label_value(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric(ABC):
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Метрика {self.name} ожидает метки {self.labelnames}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.type_name}"
+        yield from self._render_samples()
+
+    @abstractmethod
+    def _render_samples(self) -> Iterator[str]:
+        """Строки со значениями метрики в текстовом формате Prometheus"""
+
+
+class Counter(_Metric):
+    """Монотонно растущий счётчик с метками"""
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.__values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.__values[key] = self.__values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self.__values.get(self._key(labels), 0)
+
+    def label_values(self) -> List[Tuple[str, ...]]:
+        return list(self.__values)
+
+    def _render_samples(self) -> Iterator[str]:
+        for key, value in self.__values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(_Metric):
+    """
+    Текущее значение без меток. Значение можно задавать явно или функцией,
+    которая вызывается при каждом чтении (например, длина очереди)
+    """
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self.__value = 0.0
+        self.__function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self.__value = value
+
+    def set_function(self, function: Optional[Callable[[], float]]):
+        self.__function = function
+
+    def value(self) -> float:
+        if self.__function is not None:
+            try:
+                return float(self.__function())
+            except Exception as e:
+                logging.warning(f"Не удалось вычислить метрику {self.name}: {e}")
+                return math.nan
+        return self.__value
+
+    def _render_samples(self) -> Iterator[str]:
+        yield f"{self.name} {_format_value(self.value())}"
+
+
+class _HistogramValues:
+    __slots__ = ('buckets', 'sum', 'count')
+
+    def __init__(self, size: int):
+        self.buckets = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(_Metric):
+    """Гистограмма наблюдений (задержек) с фиксированными корзинами и метками"""
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS_SEC):
+        super().__init__(name, documentation, labelnames)
+        self.bounds = tuple(sorted(buckets)) + (math.inf,)
+        self.__values: Dict[Tuple[str, ...], _HistogramValues] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        values = self.__values.get(key)
+        if values is None:
+            values = self.__values[key] = _HistogramValues(len(self.bounds))
+        # Корзины хранятся без накопления, суммы считаются при выводе
+        values.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        values.sum += value
+        values.count += 1
+
+    def count(self, **labels) -> int:
+        values = self.__values.get(self._key(labels))
+        return values.count if values else 0
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        """Оценка квантиля сверху: граница корзины, в которую он попадает. None — наблюдений нет"""
+        values = self.__values.get(self._key(labels))
+        if not values or not values.count:
+            return None
+        rank = q * values.count
+        seen = 0
+        for bound, count in zip(self.bounds, values.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return math.inf
+
+    def label_values(self) -> List[Tuple[str, ...]]:
+        return list(self.__values)
+
+    def _render_samples(self) -> Iterator[str]:
+        for key, values in self.__values.items():
+            cumulative = 0
+            for bound, count in zip(self.bounds, values.buckets):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(values.sum)}"
+            yield f"{self.name}_count{labels} {values.count}"
+
+
+class MetricsRegistry:
+    """Набор метрик процесса, выводимый в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self.__metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self.__metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self.__metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self.__metrics.values() for line in metric.render()) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# Метрики бота
+WB_REQUEST_DURATION = REGISTRY.register(Histogram(
+    "wb_request_duration_seconds", "Длительность запроса к API WB (одна попытка)", ("endpoint",)))
+WB_REQUESTS = REGISTRY.register(Counter(
+    "wb_requests_total", "Запросы к API WB по кодам ответа (error — ответа нет)", ("endpoint", "status")))
+WB_RATE_LIMITED = REGISTRY.register(Counter(
+    "wb_rate_limited_total", "Ответы 429 от API WB", ("endpoint",)))
+WB_REQUEST_ERRORS = REGISTRY.register(Counter(
+    "wb_request_errors_total", "Неудачные попытки запросов к API WB", ("endpoint", "reason")))
+POLL_CYCLE_DURATION = REGISTRY.register(Histogram(
+    "coefficients_poll_cycle_seconds", "Длительность одного цикла опроса коэффициентов", ("mode",)))
+SLOT_ALERT_LATENCY = REGISTRY.register(Histogram(
+    "slot_alert_latency_seconds", "От обнаружения изменения слота до доставки уведомления в Telegram"))
+TELEGRAM_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "telegram_queue_pending_messages", "Сообщения, ожидающие отправки в Telegram"))
+MONITORED_CHATS = REGISTRY.register(Gauge(
+    "monitored_chats", "Чаты с включённым мониторингом слотов"))
+ACTIVE_POLLERS = REGISTRY.register(Gauge(
+    "coefficients_active_pollers", "Активные опросы коэффициентов (задачи или процессы-шарды)"))
+ACTIVE_REPORTS = REGISTRY.register(Gauge(
+    "nm_reports_in_progress", "Отчёты по карточкам, ожидающие готовности или скачивания"))
+
+
+async def start_metrics_server(host: str, port: int, registry: MetricsRegistry = REGISTRY) -> web.AppRunner:
+    """Запускает HTTP-сервер с единственным адресом /metrics; остановка — runner.cleanup()"""
+
+    async def handle_metrics(_: web.Request) -> web.Response:
+        return web.Response(body=registry.render().encode("utf-8"),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError:
+        await runner.cleanup()
+        raise
+    logging.info(f"Метрики доступны по адресу http://{host}:{port}/metrics")
+    return runner
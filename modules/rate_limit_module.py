@@ -0,0 +1,96 @@
+import asyncio
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    Асинхронный ограничитель частоты: не более rate операций в секунду,
+    с возможностью кратковременного всплеска до capacity операций
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.__tokens = self.capacity
+        self.__updated_at = time.monotonic()
+        self.__blocked_until = 0.0
+        self.__lock = asyncio.Lock()
+
+    def __refill(self, now: float):
+        self.__tokens = min(self.capacity, self.__tokens + (now - self.__updated_at) * self.rate)
+        self.__updated_at = now
+
+    async def acquire(self, tokens: float = 1.0):
+        """Ждёт, пока не накопится нужное количество токенов, и забирает их"""
+        async with self.__lock:
+            while True:
+                now = time.monotonic()
+                if now < self.__blocked_until:
+                    await asyncio.sleep(self.__blocked_until - now)
+                    continue
+                self.__refill(now)
+                if self.__tokens >= tokens:
+                    self.__tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.__tokens) / self.rate)
+
+    def block_for(self, seconds: float):
+        """Запрещает выдачу токенов на указанное время (например, по Retry-After)"""
+        self.__blocked_until = max(self.__blocked_until, time.monotonic() + seconds)
+
+
+def _header_float(headers, name: str) -> Optional[float]:
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class RateLimitState:
+    """
+    Состояние лимитов одного хоста API по заголовкам последнего ответа:
+    X-Ratelimit-Remaining/Reset/Retry (Wildberries) и Retry-After
+    """
+
+    def __init__(self):
+        self.limit: Optional[float] = None
+        self.remaining: Optional[float] = None
+        self.reset_at = 0.0
+        self.retry_at = 0.0
+        self.consecutive_failures = 0
+        self.last_status: Optional[int] = None
+
+    def record_response(self, status: int, headers):
+        now = time.monotonic()
+        self.last_status = status
+        self.limit = _header_float(headers, 'X-Ratelimit-Limit')
+        self.remaining = _header_float(headers, 'X-Ratelimit-Remaining')
+        reset = _header_float(headers, 'X-Ratelimit-Reset')
+        self.reset_at = now + reset if reset is not None else 0.0
+
+        if status == 429 or status >= 500:
+            self.consecutive_failures += 1
+            retry = _header_float(headers, 'X-Ratelimit-Retry')
+            if retry is None:
+                retry = _header_float(headers, 'Retry-After')
+            self.retry_at = now + retry if retry is not None else 0.0
+        else:
+            self.consecutive_failures = 0
+            self.retry_at = 0.0
+
+    def record_failure(self):
+        """Ошибка соединения или таймаут — ответа с заголовками нет"""
+        self.last_status = None
+        self.consecutive_failures += 1
+
+    def seconds_until_allowed(self) -> float:
+        """Сколько секунд хост просит не присылать запросы"""
+        now = time.monotonic()
+        wait = max(0.0, self.retry_at - now)
+        if self.remaining is not None and self.remaining <= 0:
+            wait = max(wait, self.reset_at - now)
+        return wait
@@ -0,0 +1,100 @@
+import csv
+import json
+import os
+from typing import Any, Dict, Iterable, List, Optional
+
+try:
+    from openpyxl import Workbook
+except ImportError:  # Выгрузка в XLSX необязательна, без openpyxl доступен только CSV
+    Workbook = None
+
+EXPORT_FORMAT_CSV = "csv"
+EXPORT_FORMAT_XLSX = "xlsx"
+
+
+def xlsx_available() -> bool:
+    return Workbook is not None
+
+
+def flatten_record(record: Dict[str, Any], prefix: str = "") -> Dict[str, Any]:
+    """Разворачивает вложенные словари в плоскую строку таблицы: {'a': {'b': 1}} -> {'a.b': 1}"""
+    flat = {}
+    for key, value in record.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten_record(value, f"{name}."))
+        elif isinstance(value, list):
+            flat[name] = json.dumps(value, ensure_ascii=False)
+        else:
+            flat[name] = value
+    return flat
+
+
+class TableWriter:
+    """
+    Построчная запись записей в CSV или XLSX: в памяти не накапливается вся таблица.
+    Столбцы определяются по первой записи, лишние поля следующих записей отбрасываются.
+    Все методы работают с диском синхронно — из цикла asyncio их вызывают через asyncio.to_thread
+    """
+
+    def __init__(self, path: str, export_format: str = EXPORT_FORMAT_CSV):
+        if export_format == EXPORT_FORMAT_XLSX and not xlsx_available():
+            raise RuntimeError("Для выгрузки в XLSX нужен пакет openpyxl")
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.export_format = export_format
+        self.rows = 0
+        self.__columns: Optional[List[str]] = None
+        self.__file = None
+        self.__csv_writer = None
+        self.__workbook = None
+        self.__sheet = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, record: Dict[str, Any]):
+        flat = flatten_record(record)
+        if self.__columns is None:
+            self.__columns = list(flat)
+            self.__open()
+        values = [flat.get(column) for column in self.__columns]
+        if self.__csv_writer is not None:
+            self.__csv_writer.writerow(values)
+        else:
+            self.__sheet.append(values)
+        self.rows += 1
+
+    def write_many(self, records: Iterable[Dict[str, Any]]):
+        """Пачка записей за один вызов — чтобы не переходить в рабочий поток ради каждой строки"""
+        for record in records:
+            self.write(record)
+
+    def close(self):
+        if self.__columns is None:
+            # Пустая выгрузка — создаём файл только с пустой таблицей
+            self.__columns = []
+            self.__open()
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+        if self.__workbook is not None:
+            self.__workbook.save(self.path)
+            self.__workbook = None
+
+    def __open(self):
+        if self.export_format == EXPORT_FORMAT_XLSX:
+            # write_only: строки сразу сбрасываются во временный файл, а не держатся в памяти
+            self.__workbook = Workbook(write_only=True)
+            self.__sheet = self.__workbook.create_sheet()
+            self.__sheet.append(self.__columns)
+        else:
+            # utf-8-sig и «;» — чтобы файл без настроек открывался в русском Excel
+            self.__file = open(self.path, "w", encoding="utf-8-sig", newline="")
+            self.__csv_writer = csv.writer(self.__file, delimiter=";")
+            self.__csv_writer.writerow(self.__columns)
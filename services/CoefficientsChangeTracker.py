@@ -0,0 +1,160 @@
+import time
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Set
+
+from services.WildberriesModels import AcceptanceCoefficient
+
+SLOT_APPEARED = "appeared"
+SLOT_CHANGED = "changed"
+SLOT_DISAPPEARED = "disappeared"
+
+_DAYS_FACTOR = 1_000_000
+_BOX_TYPES_FACTOR = 256
+
+
+def pack_slot_key(warehouse_id: int, date_start: str, box_type_id: Optional[int]) -> int:
+    """Упаковывает (склад, дата, тип коробов) в одно целое число"""
+    day = date.fromisoformat(date_start[:10]).toordinal()
+    return (warehouse_id * _DAYS_FACTOR + day) * _BOX_TYPES_FACTOR + (box_type_id or 0)
+
+
+def unpack_slot_key(key: int):
+    """Обратное преобразование к pack_slot_key: (warehouse_id, date, box_type_id)"""
+    rest, box_type_id = divmod(key, _BOX_TYPES_FACTOR)
+    warehouse_id, day = divmod(rest, _DAYS_FACTOR)
+    return warehouse_id, date.fromordinal(day), box_type_id
+
+
+class SlotChange:
+    """
+    Изменение одного слота между двумя опросами.
+    previous — состояние слота до опроса (None, если слота не было), current — после (None, если слот пропал)
+    """
+    __slots__ = ('previous', 'current')
+
+    def __init__(self, previous: Optional[AcceptanceCoefficient], current: Optional[AcceptanceCoefficient]):
+        self.previous = previous
+        self.current = current
+
+
+class SlotEvent:
+    """
+    Событие для конкретного подписчика: слот появился, пропал или у него изменился коэффициент.
+    detected_at — момент обнаружения по time.monotonic(), для замера задержек
+    """
+    __slots__ = ('kind', 'info', 'previous_coefficient', 'detected_at')
+
+    def __init__(self, kind: str, info: AcceptanceCoefficient, previous_coefficient: Optional[float] = None,
+                 detected_at: Optional[float] = None):
+        self.kind = kind
+        self.info = info
+        self.previous_coefficient = previous_coefficient
+        self.detected_at = detected_at if detected_at is not None else time.monotonic()
+
+
+def slot_event_for(change: SlotChange, was_matching: bool, is_matching: bool,
+                   detected_at: float) -> Optional[SlotEvent]:
+    """Событие для подписчика, если слот подходил под его фильтр до опроса (was) и/или после (is)"""
+    if is_matching and not was_matching:
+        return SlotEvent(SLOT_APPEARED, change.current, detected_at=detected_at)
+    if was_matching and not is_matching:
+        return SlotEvent(SLOT_DISAPPEARED, change.current or change.previous,
+                         change.previous.coefficient, detected_at)
+    if is_matching and change.previous.coefficient != change.current.coefficient:
+        return SlotEvent(SLOT_CHANGED, change.current, change.previous.coefficient, detected_at)
+    return None
+
+
+class CoefficientsChangeTracker:
+    """
+    Класс, хранящий последнее известное состояние слотов приёмки и вычисляющий,
+    что изменилось с прошлого опроса. Состояние хранится компактно: упакованный
+    ключ слота -> коэффициент, плюс множество слотов, где разрешена разгрузка
+    """
+
+    def __init__(self):
+        self.__coefficients: Dict[int, float] = {}
+        self.__unload_allowed: Set[int] = set()
+        self.__warehouse_names: Dict[int, str] = {}
+        self.__box_type_names: Dict[int, str] = {}
+
+    def __len__(self):
+        return len(self.__coefficients)
+
+    def update(self, rows: Iterable[AcceptanceCoefficient]) -> List[SlotChange]:
+        """Применяет результат опроса и возвращает только изменившиеся слоты"""
+        changes = []
+        seen = set()
+        for row in rows:
+            try:
+                key = pack_slot_key(row.warehouse_id, row.date_start, row.box_type_id)
+            except (TypeError, ValueError):
+                continue
+            coefficient = row.coefficient
+            allow_unload = row.allow_unload
+            seen.add(key)
+            self.__remember_names(row)
+
+            # Копия прежнего состояния строится только для изменившихся слотов, неизменные не аллоцируют ничего
+            previous_coefficient = self.__coefficients.get(key)
+            previous_allow_unload = key in self.__unload_allowed
+            if previous_coefficient is None:
+                changes.append(SlotChange(None, row))
+            elif previous_coefficient != coefficient or previous_allow_unload != allow_unload:
+                previous = row.replace(coefficient=previous_coefficient, allow_unload=previous_allow_unload)
+                changes.append(SlotChange(previous, row))
+
+            self.__coefficients[key] = coefficient
+            if allow_unload:
+                self.__unload_allowed.add(key)
+            else:
+                self.__unload_allowed.discard(key)
+
+        for key in [key for key in self.__coefficients if key not in seen]:
+            changes.append(SlotChange(self.__info(key), None))
+            del self.__coefficients[key]
+            self.__unload_allowed.discard(key)
+
+        return changes
+
+    def restore(self, rows: Iterable[tuple]):
+        """Восстанавливает состояние из строк (slot_key, coefficient, allow_unload, warehouse_name, box_type_name)"""
+        for slot_key, coefficient, allow_unload, warehouse_name, box_type_name in rows:
+            warehouse_id, _, box_type_id = unpack_slot_key(slot_key)
+            self.__coefficients[slot_key] = coefficient
+            if allow_unload:
+                self.__unload_allowed.add(slot_key)
+            if warehouse_name is not None:
+                self.__warehouse_names[warehouse_id] = warehouse_name
+            if box_type_name is not None:
+                self.__box_type_names[box_type_id] = box_type_name
+
+    def has_open_slots(self, max_coefficient: float, days_ahead: int) -> bool:
+        """Есть ли доступные слоты с коэффициентом не выше max_coefficient на ближайшие days_ahead дней"""
+        last_day = date.today().toordinal() + days_ahead
+        for key, coefficient in self.__coefficients.items():
+            if 0 <= coefficient <= max_coefficient and (key // _BOX_TYPES_FACTOR) % _DAYS_FACTOR <= last_day:
+                return True
+        return False
+
+    def snapshot(self) -> List[SlotChange]:
+        """Текущее состояние в виде изменений «с нуля» — для новых подписчиков"""
+        return [SlotChange(None, self.__info(key)) for key in self.__coefficients]
+
+    def __remember_names(self, row: AcceptanceCoefficient):
+        if row.warehouse_name:
+            self.__warehouse_names[row.warehouse_id] = row.warehouse_name
+        if row.box_type_name:
+            self.__box_type_names[row.box_type_id or 0] = row.box_type_name
+
+    def __info(self, key: int) -> AcceptanceCoefficient:
+        warehouse_id, day, box_type_id = unpack_slot_key(key)
+        return AcceptanceCoefficient(
+            warehouse_id,
+            self.__warehouse_names.get(warehouse_id, ''),
+            self.__coefficients[key],
+            f"{day.isoformat()}T00:00:00Z",
+            box_type_id,
+            self.__box_type_names.get(box_type_id, 'Не указан'),
+            key in self.__unload_allowed,
+        )
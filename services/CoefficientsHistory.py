@@ -0,0 +1,248 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config import HISTORY_DIR, HISTORY_FLUSH_INTERVAL_SEC
+
+# Колонка -> код типа array. Коэффициент NaN означает, что слот пропал из ответа
+_COLUMNS = (('ts', 'I'), ('slot', 'I'), ('coefficient', 'f'), ('allow_unload', 'B'))
+_BOX_TYPES_FACTOR = 256
+
+
+class _Columns:
+    """
+    Колонки истории одного склада. Каждая строка — изменение одного слота:
+    время (unix, секунды), слот (день по ordinal * 256 + boxTypeID), коэффициент и разрешение разгрузки.
+    Строка занимает 13 байт, строки упорядочены по времени
+    """
+    __slots__ = tuple(name for name, _ in _COLUMNS)
+
+    def __init__(self):
+        for name, typecode in _COLUMNS:
+            setattr(self, name, array(typecode))
+
+    def __len__(self):
+        return len(self.ts)
+
+    def append(self, ts: int, slot: int, coefficient: float, allow_unload: bool):
+        self.ts.append(ts)
+        self.slot.append(slot)
+        self.coefficient.append(coefficient)
+        self.allow_unload.append(allow_unload)
+
+    def extend(self, other: '_Columns'):
+        for name, _ in _COLUMNS:
+            getattr(self, name).extend(getattr(other, name))
+
+    def append_to_disk(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        for name, _ in _COLUMNS:
+            with open(os.path.join(directory, name), 'ab') as file:
+                getattr(self, name).tofile(file)
+
+    @classmethod
+    def read_from_disk(cls, directory: str) -> '_Columns':
+        columns = cls()
+        for name, _ in _COLUMNS:
+            path = os.path.join(directory, name)
+            if not os.path.exists(path):
+                continue
+            column = getattr(columns, name)
+            with open(path, 'rb') as file:
+                data = file.read()
+            column.frombytes(data[:len(data) - len(data) % column.itemsize])
+        # После аварийного завершения колонки могут оказаться разной длины — отбрасываем неполные строки
+        rows = min(len(getattr(columns, name)) for name, _ in _COLUMNS)
+        for name, _ in _COLUMNS:
+            del getattr(columns, name)[rows:]
+        return columns
+
+
+class HistoryRecord:
+    """Одно изменение слота из истории. coefficient is None — слот пропал"""
+    __slots__ = ('ts', 'warehouse_id', 'date', 'box_type_id', 'coefficient', 'allow_unload')
+
+    def __init__(self, ts: int, warehouse_id: int, slot: int, coefficient: float, allow_unload: int):
+        self.ts = ts
+        self.warehouse_id = warehouse_id
+        day, self.box_type_id = divmod(slot, _BOX_TYPES_FACTOR)
+        self.date = date.fromordinal(day)
+        self.coefficient = None if math.isnan(coefficient) else coefficient
+        self.allow_unload = bool(allow_unload)
+
+
+class _Openings:
+    """
+    Открытия слотов одного склада при заданном пороге коэффициента: номера строк истории и их время.
+    Дополняется по мере роста истории, поэтому каждая строка просматривается один раз
+    """
+    __slots__ = ('max_coefficient', 'processed', 'available', 'rows', 'ts')
+
+    def __init__(self, max_coefficient: float):
+        self.max_coefficient = max_coefficient
+        self.processed = 0
+        self.available: Dict[int, bool] = {}
+        self.rows = array('I')
+        self.ts = array('I')
+
+    def update(self, columns: _Columns):
+        for i in range(self.processed, len(columns)):
+            slot = columns.slot[i]
+            coefficient = columns.coefficient[i]
+            is_available = 0 <= coefficient <= self.max_coefficient  # NaN сюда не проходит
+            if is_available and not self.available.get(slot):
+                self.rows.append(i)
+                self.ts.append(columns.ts[i])
+            self.available[slot] = is_available
+        self.processed = len(columns)
+
+
+class CoefficientsHistory:
+    """
+    Класс, хранящий историю коэффициентов приёмки на диске в колоночном виде:
+    по каталогу на склад, по файлу на колонку, только дозапись.
+    Хранятся не все опросы, а изменения слотов (дельты): неизменные слоты места не занимают,
+    а состояние на любой момент восстанавливается проигрыванием изменений.
+    Запись отложенная, как в StateStore: изменения копятся в памяти и сбрасываются в фоновом потоке.
+    Один склад может опрашиваться несколькими опросами (пересекающиеся наборы складов) —
+    изменение, уже записанное одним из них, повторно не пишется
+    """
+
+    def __init__(self, history_dir: str = HISTORY_DIR, flush_interval_sec: float = HISTORY_FLUSH_INTERVAL_SEC):
+        self.history_dir = history_dir
+        self.flush_interval_sec = flush_interval_sec
+        self.__pending: Dict[int, _Columns] = {}
+        self.__loaded: Dict[int, _Columns] = {}
+        # Склад -> слот -> последнее записанное состояние (коэффициент, разгрузка); None — слот пропал
+        self.__last_states: Dict[int, Dict[int, Optional[Tuple[float, bool]]]] = {}
+        self.__openings: Dict[Tuple[int, float], _Openings] = {}
+        self.__lock = asyncio.Lock()
+        self.__flusher: Optional[asyncio.Task] = None
+
+    def record(self, changes: Iterable, ts: Optional[int] = None):
+        """Добавляет в историю изменения слотов (SlotChange из CoefficientsChangeTracker)"""
+        ts = int(time.time()) if ts is None else ts
+        recorded = False
+        for change in changes:
+            info = change.current or change.previous
+            try:
+                warehouse_id = int(info.warehouse_id)
+                day = date.fromisoformat(info.date_start[:10]).toordinal()
+            except (TypeError, ValueError):
+                continue
+            slot = day * _BOX_TYPES_FACTOR + (info.box_type_id or 0)
+            coefficient = math.nan if change.current is None else change.current.coefficient
+            allow_unload = bool(change.current and change.current.allow_unload)
+            state = None if change.current is None else (coefficient, allow_unload)
+            last_states = self.__last_states.setdefault(warehouse_id, {})
+            if slot in last_states and last_states[slot] == state:
+                continue
+            last_states[slot] = state
+            self.__pending.setdefault(warehouse_id, _Columns()).append(ts, slot, coefficient, allow_unload)
+            # Уже загруженную историю дополняем сразу, чтобы запросы видели свежие данные
+            if warehouse_id in self.__loaded:
+                self.__loaded[warehouse_id].append(ts, slot, coefficient, allow_unload)
+            recorded = True
+        if recorded:
+            self.__schedule_flush()
+
+    async def records(self, warehouse_id: int, since: Optional[int] = None,
+                      until: Optional[int] = None) -> List[HistoryRecord]:
+        """Изменения слотов склада за период [since, until) по unix-времени"""
+        columns = await self.__columns(warehouse_id)
+        start, end = self.__bounds(columns, since, until)
+        return [HistoryRecord(columns.ts[i], warehouse_id, columns.slot[i], columns.coefficient[i],
+                              columns.allow_unload[i])
+                for i in range(start, end)]
+
+    async def column_arrays(self, warehouse_id: int, since: Optional[int] = None) -> Tuple[array, array, array]:
+        """Копии колонок (время, слот, коэффициент) за период — для векторных расчётов"""
+        columns = await self.__columns(warehouse_id)
+        start, end = self.__bounds(columns, since, None)
+        return columns.ts[start:end], columns.slot[start:end], columns.coefficient[start:end]
+
+    async def openings(self, warehouse_id: int, max_coefficient: float, since: Optional[int] = None,
+                       until: Optional[int] = None) -> List[HistoryRecord]:
+        """
+        Моменты, когда слоты склада становились доступными: коэффициент переходил
+        в диапазон 0..max_coefficient из недоступного состояния или слот появлялся сразу доступным
+        """
+        columns = await self.__columns(warehouse_id)
+        openings = self.__openings.get((warehouse_id, max_coefficient))
+        if openings is None:
+            openings = self.__openings[(warehouse_id, max_coefficient)] = _Openings(max_coefficient)
+        # Досматриваются только строки, добавленные с прошлого запроса
+        openings.update(columns)
+        start = bisect_left(openings.ts, since) if since is not None else 0
+        end = bisect_left(openings.ts, until) if until is not None else len(openings.ts)
+        return [HistoryRecord(columns.ts[i], warehouse_id, columns.slot[i], columns.coefficient[i],
+                              columns.allow_unload[i])
+                for i in openings.rows[start:end]]
+
+    async def opening_hours(self, warehouse_id: int, max_coefficient: float,
+                            since: Optional[int] = None) -> List[Tuple[int, int]]:
+        """Часы суток (местное время), в которые чаще всего открывались слоты: [(час, количество)] по убыванию"""
+        openings = await self.openings(warehouse_id, max_coefficient, since)
+        hours = Counter(time.localtime(opening.ts).tm_hour for opening in openings)
+        return hours.most_common()
+
+    async def close(self):
+        """Останавливает фоновую запись и сбрасывает всё накопленное"""
+        if self.__flusher is not None:
+            self.__flusher.cancel()
+            await asyncio.gather(self.__flusher, return_exceptions=True)
+            self.__flusher = None
+        await self.flush()
+
+    async def flush(self):
+        async with self.__lock:
+            pending, self.__pending = self.__pending, {}
+            if not pending:
+                return
+            try:
+                await asyncio.to_thread(self.__write, pending)
+            except OSError as e:
+                logging.error(f"Не удалось сохранить историю коэффициентов в {self.history_dir}: {e}")
+
+    def __write(self, pending: Dict[int, _Columns]):
+        for warehouse_id, columns in pending.items():
+            columns.append_to_disk(self.__directory(warehouse_id))
+
+    async def __columns(self, warehouse_id: int) -> _Columns:
+        columns = self.__loaded.get(warehouse_id)
+        if columns is None:
+            # Блокировка не даёт прочитать файл посреди дозаписи
+            async with self.__lock:
+                columns = self.__loaded.get(warehouse_id)
+                if columns is None:
+                    columns = await asyncio.to_thread(_Columns.read_from_disk, self.__directory(warehouse_id))
+                    if warehouse_id in self.__pending:
+                        columns.extend(self.__pending[warehouse_id])
+                    self.__loaded[warehouse_id] = columns
+        return columns
+
+    @staticmethod
+    def __bounds(columns: _Columns, since: Optional[int], until: Optional[int]) -> Tuple[int, int]:
+        # Строки отсортированы по времени — границы периода ищутся бинарным поиском
+        start = bisect_left(columns.ts, since) if since is not None else 0
+        end = bisect_left(columns.ts, until) if until is not None else len(columns)
+        return start, end
+
+    def __directory(self, warehouse_id: int) -> str:
+        return os.path.join(self.history_dir, str(warehouse_id))
+
+    def __schedule_flush(self):
+        if self.__flusher is None or self.__flusher.done():
+            self.__flusher = asyncio.create_task(self.__delayed_flush())
+
+    async def __delayed_flush(self):
+        await asyncio.sleep(self.flush_interval_sec)
+        await self.flush()
+
@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, FrozenSet, Optional
+
+from config import HOT_SLOT_MAX_COEFFICIENT, HOT_SLOT_DAYS_AHEAD
+from modules.metrics_module import POLL_CYCLE_DURATION
+from services.CoefficientsChangeTracker import CoefficientsChangeTracker, SlotEvent
+from services.CoefficientsHistory import CoefficientsHistory
+from services.PollingScheduler import AdaptivePollingScheduler
+from services.SlotOpeningPredictor import SlotOpeningPredictor
+from services.StateStore import StateStore
+from services.SubscriptionRules import CompiledMatcher, SubscriptionRule
+from services.WildberriesApiErrors import WildberriesApiError
+from services.WildberriesApiService import WildberriesApiService, ACCEPTANCE_COEFFICIENTS_URL
+
+
+class CoefficientsSubscriber:
+    """
+    Подписчик на коэффициенты приёмки: чат со своим правилом и способом доставки уведомлений.
+    Пока synced == False, подписчик ещё не получил текущее состояние слотов
+    """
+
+    def __init__(self, rule: SubscriptionRule, notify: Callable[[int, SlotEvent], Awaitable[None]]):
+        self.chat_id = rule.chat_id
+        self.rule = rule
+        self.notify = notify
+        self.synced = False
+
+
+class CoefficientsPollingService:
+    """
+    Класс, отвечающий за опрос коэффициентов приёмки: один опрос на каждый
+    набор складов, результат рассылается всем подписанным на этот набор чатам.
+    Подписчики получают только изменения: появление, исчезновение слота или смену коэффициента
+    """
+
+    def __init__(self, wildberries_api_service: WildberriesApiService,
+                 scheduler: AdaptivePollingScheduler = None, state_store: StateStore = None,
+                 history: CoefficientsHistory = None, predictor: SlotOpeningPredictor = None):
+        self.wildberries_api_service = wildberries_api_service
+        self.scheduler = scheduler or AdaptivePollingScheduler()
+        self.state_store = state_store
+        self.history = history
+        self.predictor = predictor
+        self.__subscribers: Dict[FrozenSet[int], Dict[int, CoefficientsSubscriber]] = {}
+        self.__pollers: Dict[FrozenSet[int], asyncio.Task] = {}
+        self.__trackers: Dict[FrozenSet[int], CoefficientsChangeTracker] = {}
+        self.__matchers: Dict[FrozenSet[int], CompiledMatcher] = {}
+        self.__chat_warehouses: Dict[int, FrozenSet[int]] = {}
+
+    def subscribe(self, rule: SubscriptionRule, notify: Callable[[int, SlotEvent], Awaitable[None]],
+                  synced: bool = False):
+        """
+        Подписывает чат на склады из его правила, заменяя предыдущую подписку.
+        synced=True — чат уже видел сохранённое состояние слотов (восстановление после перезапуска)
+        """
+        chat_id = rule.chat_id
+        self.unsubscribe(chat_id)
+
+        warehouses_key = rule.warehouse_ids
+        subscriber = CoefficientsSubscriber(rule, notify)
+        subscriber.synced = synced
+        self.__subscribers.setdefault(warehouses_key, {})[chat_id] = subscriber
+        self.__chat_warehouses[chat_id] = warehouses_key
+        self.__compile(warehouses_key)
+
+        if warehouses_key not in self.__pollers:
+            self.__trackers[warehouses_key] = CoefficientsChangeTracker()
+            self.__pollers[warehouses_key] = asyncio.create_task(self.__poll(warehouses_key))
+            logging.info(f"Запущен опрос складов {sorted(warehouses_key)}")
+
+    def unsubscribe(self, chat_id: int) -> bool:
+        """Отписывает чат; опрос набора складов останавливается, когда подписчиков не осталось"""
+        warehouses_key = self.__chat_warehouses.pop(chat_id, None)
+        if warehouses_key is None:
+            return False
+
+        subscribers = self.__subscribers.get(warehouses_key, {})
+        subscribers.pop(chat_id, None)
+        if subscribers:
+            self.__compile(warehouses_key)
+        else:
+            self.__subscribers.pop(warehouses_key, None)
+            self.__matchers.pop(warehouses_key, None)
+            self.__trackers.pop(warehouses_key, None)
+            if self.state_store:
+                self.state_store.delete_slot_state(warehouses_key)
+            poller = self.__pollers.pop(warehouses_key, None)
+            if poller:
+                poller.cancel()
+                logging.info(f"Остановлен опрос складов {sorted(warehouses_key)}")
+        return True
+
+    def is_subscribed(self, chat_id: int) -> bool:
+        return chat_id in self.__chat_warehouses
+
+    def subscriber_count(self) -> int:
+        return len(self.__chat_warehouses)
+
+    def poller_count(self) -> int:
+        return len(self.__pollers)
+
+    def __compile(self, warehouses_key: FrozenSet[int]):
+        subscribers = self.__subscribers.get(warehouses_key, {}).values()
+        self.__matchers[warehouses_key] = CompiledMatcher(subscriber.rule for subscriber in subscribers)
+
+    async def close(self):
+        """Останавливает все опросы"""
+        pollers = list(self.__pollers.values())
+        self.__pollers.clear()
+        self.__subscribers.clear()
+        self.__trackers.clear()
+        self.__matchers.clear()
+        self.__chat_warehouses.clear()
+        for poller in pollers:
+            poller.cancel()
+        await asyncio.gather(*pollers, return_exceptions=True)
+
+    async def __poll(self, warehouses_key: FrozenSet[int]):
+        warehouse_ids = sorted(warehouses_key)
+        tracker = self.__trackers[warehouses_key]
+        rate_limit = self.wildberries_api_service.rate_limit_state(ACCEPTANCE_COEFFICIENTS_URL)
+        if self.state_store:
+            # Состояние с прошлого запуска: после перезапуска не повторяем уже отправленные уведомления
+            try:
+                tracker.restore(await self.state_store.load_slot_state(warehouses_key))
+            except Exception as e:
+                logging.error(f"Не удалось загрузить состояние складов {warehouse_ids}: {e}")
+        while True:
+            hot = False
+            cycle_started = time.monotonic()
+            try:
+                coefficients = await self.wildberries_api_service.get_acceptance_coefficients(warehouse_ids)
+                # Пустой ответ не считаем исчезновением всех слотов
+                if coefficients:
+                    changes = tracker.update(coefficients)
+                    if changes and self.state_store:
+                        self.state_store.save_slot_changes(warehouses_key, changes)
+                    if changes and self.history:
+                        self.history.record(changes)
+                    # Слоты только что менялись или вот-вот откроются — опрашиваем чаще
+                    hot = bool(changes) or tracker.has_open_slots(HOT_SLOT_MAX_COEFFICIENT, HOT_SLOT_DAYS_AHEAD)
+                    await self.__fan_out(warehouses_key, tracker, changes)
+            except asyncio.CancelledError:
+                raise
+            except WildberriesApiError as e:
+                # Состояние лимитов и отказов хоста уже учтено транспортом
+                logging.error(f"Ошибка при опросе складов {warehouse_ids}: {e}")
+            except Exception as e:
+                logging.exception(f"Ошибка в периодической проверке: {str(e)}")
+                rate_limit.record_failure()
+            POLL_CYCLE_DURATION.observe(time.monotonic() - cycle_started, mode="subscriptions")
+            opening_probability = await self.__opening_probability(warehouse_ids)
+            # Все опросы идут через один токен, поэтому чем их больше, тем реже каждый
+            await asyncio.sleep(self.scheduler.next_delay(rate_limit, hot, opening_probability,
+                                                          active_pollers=len(self.__pollers)))
+
+    async def __opening_probability(self, warehouse_ids: list) -> Optional[float]:
+        if self.predictor is None:
+            return None
+        try:
+            await self.predictor.maybe_refit(warehouse_ids)
+        except Exception as e:
+            logging.error(f"Не удалось обновить прогноз открытия слотов {warehouse_ids}: {e}")
+        return self.predictor.probability(warehouse_ids)
+
+    async def __fan_out(self, warehouses_key: FrozenSet[int], tracker: CoefficientsChangeTracker, changes: list):
+        subscribers = self.__subscribers.get(warehouses_key, {})
+        # Все правила проверяются за один проход по изменениям
+        events = self.__matchers[warehouses_key].events(changes) if changes else {}
+
+        # Новым подписчикам один раз отдаём текущее состояние целиком
+        fresh = [subscriber for subscriber in subscribers.values() if not subscriber.synced]
+        if fresh:
+            snapshot_events = CompiledMatcher(subscriber.rule for subscriber in fresh).events(tracker.snapshot())
+            for subscriber in fresh:
+                subscriber.synced = True
+                events[subscriber.chat_id] = snapshot_events.get(subscriber.chat_id, [])
+
+        deliveries = [self.__deliver(subscribers[chat_id], chat_events)
+                      for chat_id, chat_events in events.items() if chat_events and chat_id in subscribers]
+        # Чаты обслуживаются параллельно, чтобы медленная отправка в один не задерживала остальные
+        await asyncio.gather(*deliveries)
+
+    @staticmethod
+    async def __deliver(subscriber: CoefficientsSubscriber, events: list):
+        for event in events:
+            try:
+                await subscriber.notify(subscriber.chat_id, event)
+            except Exception as e:
+                logging.error(f"Не удалось отправить уведомление в чат {subscriber.chat_id}: {e}")
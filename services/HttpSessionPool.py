@@ -0,0 +1,54 @@
+import logging
+from typing import Dict
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from config import HTTP_CONNECTION_LIMIT_PER_HOST, HTTP_CONNECTION_LIMITS_BY_HOST
+from config import HTTP_DNS_CACHE_TTL_SEC, HTTP_KEEPALIVE_TIMEOUT_SEC
+from config import HTTP_CONNECT_TIMEOUT_SEC, HTTP_READ_TIMEOUT_SEC, HTTP_TOTAL_TIMEOUT_SEC
+
+
+class HttpSessionPool:
+    """
+    Класс, хранящий долгоживущие aiohttp-сессии: по одной на каждый хост API.
+    Соединения переиспользуются (keep-alive), DNS-ответы кэшируются
+    """
+
+    def __init__(self):
+        self.__sessions: Dict[str, aiohttp.ClientSession] = {}
+
+    def get_session(self, url: str) -> aiohttp.ClientSession:
+        """Возвращает сессию для хоста из url, создавая её при первом обращении"""
+        host = urlsplit(url).netloc
+        session = self.__sessions.get(host)
+        if session is None or session.closed:
+            session = self.__create_session(host)
+            self.__sessions[host] = session
+        return session
+
+    @staticmethod
+    def __create_session(host: str) -> aiohttp.ClientSession:
+        limit = HTTP_CONNECTION_LIMITS_BY_HOST.get(host, HTTP_CONNECTION_LIMIT_PER_HOST)
+        connector = aiohttp.TCPConnector(
+            limit=limit,
+            limit_per_host=limit,
+            ttl_dns_cache=HTTP_DNS_CACHE_TTL_SEC,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT_SEC,
+        )
+        logging.info(f"Создана HTTP-сессия для {host} (лимит соединений: {limit})")
+        # Явные таймауты: медленный ответ WB не должен подвешивать задачи бота
+        timeout = aiohttp.ClientTimeout(
+            total=HTTP_TOTAL_TIMEOUT_SEC,
+            sock_connect=HTTP_CONNECT_TIMEOUT_SEC,
+            sock_read=HTTP_READ_TIMEOUT_SEC,
+        )
+        return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    async def close(self):
+        """Закрывает все открытые сессии"""
+        sessions = list(self.__sessions.values())
+        self.__sessions.clear()
+        for session in sessions:
+            if not session.closed:
+                await session.close()
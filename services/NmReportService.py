@@ -0,0 +1,193 @@
+import asyncio
+import csv
+import io
+import logging
+import os
+import random
+import time
+import zipfile
+from datetime import date
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional
+
+from config import REPORT_POLL_INITIAL_DELAY_SEC, REPORT_POLL_MAX_DELAY_SEC, REPORT_READY_TIMEOUT_SEC, REPORTS_DIR
+from services.WildberriesApiErrors import WildberriesApiError
+from services.WildberriesApiService import WildberriesApiService
+
+_INT_COLUMNS = ('nmID', 'openCardCount', 'addToCartCount', 'ordersCount', 'buyoutsCount', 'cancelCount')
+_FLOAT_COLUMNS = ('ordersSumRub', 'buyoutsSumRub', 'cancelSumRub', 'addToCartConversion',
+                  'cartToOrderConversion', 'buyoutPercent')
+
+
+def _to_int(value: Optional[str]) -> int:
+    return int(float(value)) if value else 0
+
+
+def _to_float(value: Optional[str]) -> float:
+    return float(value.replace(',', '.')) if value else 0.0
+
+
+class NmReportRow:
+    """Строка отчёта DETAIL_HISTORY_REPORT: показатели одной карточки за один день"""
+    __slots__ = ('dt',) + _INT_COLUMNS + _FLOAT_COLUMNS
+
+    def __init__(self, row: Dict[str, str]):
+        dt = row.get('dt')
+        self.dt = date.fromisoformat(dt[:10]) if dt else None
+        for column in _INT_COLUMNS:
+            setattr(self, column, _to_int(row.get(column)))
+        for column in _FLOAT_COLUMNS:
+            setattr(self, column, _to_float(row.get(column)))
+
+
+def iter_report_rows(path: str) -> Iterator[NmReportRow]:
+    """
+    Построчно читает отчёт из ZIP-архива (или CSV-файла) без распаковки на диск и без загрузки в память.
+    Некорректные строки пропускаются
+    """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for name in archive.namelist():
+                if name.lower().endswith('.csv'):
+                    with archive.open(name) as raw:
+                        yield from _iter_csv_rows(io.TextIOWrapper(raw, encoding='utf-8-sig', newline=''))
+    else:
+        with open(path, encoding='utf-8-sig', newline='') as file:
+            yield from _iter_csv_rows(file)
+
+
+def _iter_csv_rows(file) -> Iterator[NmReportRow]:
+    for row in csv.DictReader(file):
+        try:
+            yield NmReportRow(row)
+        except ValueError as e:
+            logging.warning(f"Пропущена строка отчёта {row}: {e}")
+
+
+class NmReportSummary:
+    """Итоги отчёта, подсчитанные за один проход по строкам"""
+    __slots__ = ('rows', 'nm_ids', 'open_card_count', 'orders_count', 'orders_sum_rub',
+                 'buyouts_count', 'buyouts_sum_rub')
+
+    def __init__(self):
+        self.rows = 0
+        self.nm_ids = set()
+        self.open_card_count = 0
+        self.orders_count = 0
+        self.orders_sum_rub = 0.0
+        self.buyouts_count = 0
+        self.buyouts_sum_rub = 0.0
+
+    def add(self, row: NmReportRow):
+        self.rows += 1
+        self.nm_ids.add(row.nmID)
+        self.open_card_count += row.openCardCount
+        self.orders_count += row.ordersCount
+        self.orders_sum_rub += row.ordersSumRub
+        self.buyouts_count += row.buyoutsCount
+        self.buyouts_sum_rub += row.buyoutsSumRub
+
+
+def summarize_report(path: str) -> NmReportSummary:
+    summary = NmReportSummary()
+    for row in iter_report_rows(path):
+        summary.add(row)
+    return summary
+
+
+class NmReportJob:
+    """
+    Заказанный отчёт по карточкам: от создания до скачанного файла
+    """
+
+    def __init__(self, wildberries_api_service: WildberriesApiService, nm_ids: List[int],
+                 start_date: Optional[date], end_date: Optional[date],
+                 on_ready: Callable[['NmReportJob'], Awaitable[None]],
+                 on_error: Callable[['NmReportJob', Exception], Awaitable[None]]):
+        self.wildberries_api_service = wildberries_api_service
+        self.nm_ids = nm_ids
+        self.start_date = start_date
+        self.end_date = end_date
+        self.on_ready = on_ready
+        self.on_error = on_error
+        self.report_id: Optional[str] = None
+        self.status: Optional[str] = None
+        self.path: Optional[str] = None
+        self.summary: Optional[NmReportSummary] = None
+        self.task = None
+
+
+class NmReportService:
+    """
+    Класс, ведущий отчёты nm-report/downloads: заказ, ожидание готовности с нарастающей паузой,
+    потоковое скачивание архива на диск и разбор строк в фоновом потоке. Архив удаляется после on_ready.
+    Отчёты выполняются параллельно, в том числе для разных кабинетов;
+    лимиты WB соблюдает WildberriesApiService кабинета
+    """
+
+    def __init__(self, reports_dir: str = REPORTS_DIR):
+        self.reports_dir = reports_dir
+        self.__jobs: Dict[int, NmReportJob] = {}
+
+    def start(self, wildberries_api_service: WildberriesApiService, nm_ids: List[int],
+              start_date: Optional[date], end_date: Optional[date],
+              on_ready: Callable[[NmReportJob], Awaitable[None]],
+              on_error: Callable[[NmReportJob, Exception], Awaitable[None]]) -> NmReportJob:
+        job = NmReportJob(wildberries_api_service, nm_ids, start_date, end_date, on_ready, on_error)
+        job.task = asyncio.create_task(self.__run(job))
+        self.__jobs[id(job)] = job
+        return job
+
+    def active_jobs(self) -> List[NmReportJob]:
+        return list(self.__jobs.values())
+
+    async def close(self):
+        """Прерывает все незавершённые отчёты"""
+        tasks = [job.task for job in self.__jobs.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def __run(self, job: NmReportJob):
+        try:
+            job.report_id = await job.wildberries_api_service.create_report(job.nm_ids, job.start_date, job.end_date)
+            logging.info(f"Заказан отчёт {job.report_id}")
+            await self.__wait_until_ready(job)
+
+            job.path = os.path.join(self.reports_dir, f"{job.report_id}.zip")
+            size = await job.wildberries_api_service.download_report(job.report_id, job.path)
+            logging.info(f"Отчёт {job.report_id} скачан: {size} байт")
+
+            job.summary = await asyncio.to_thread(summarize_report, job.path)
+            await job.on_ready(job)
+        except asyncio.CancelledError:
+            raise
+        except (WildberriesApiError, OSError, zipfile.BadZipFile, TimeoutError) as e:
+            logging.error(f"Ошибка отчёта {job.report_id}: {e}")
+            await job.on_error(job, e)
+        except Exception as e:
+            logging.exception(f"Ошибка отчёта {job.report_id}: {e}")
+            await job.on_error(job, e)
+        finally:
+            self.__jobs.pop(id(job), None)
+            # Архив нужен только для отправки: после неё (или ошибки) он удаляется, чтобы не копились файлы
+            if job.path and os.path.exists(job.path):
+                try:
+                    os.remove(job.path)
+                except OSError as e:
+                    logging.warning(f"Не удалось удалить файл отчёта {job.path}: {e}")
+
+    async def __wait_until_ready(self, job: NmReportJob):
+        delay = REPORT_POLL_INITIAL_DELAY_SEC
+        deadline = time.monotonic() + REPORT_READY_TIMEOUT_SEC
+        while True:
+            await asyncio.sleep(random.uniform(delay / 2, delay))
+            report = await job.wildberries_api_service.get_report_status(job.report_id)
+            job.status = report.get('status') if report else None
+            if job.status == 'SUCCESS':
+                return
+            if job.status == 'FAILED':
+                raise WildberriesApiError(f"WB не смог сформировать отчёт {job.report_id}")
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"Отчёт {job.report_id} не готов за {REPORT_READY_TIMEOUT_SEC} сек.")
+            # Отчёт ещё в очереди или формируется — проверяем всё реже
+            delay = min(delay * 2, REPORT_POLL_MAX_DELAY_SEC)
@@ -0,0 +1,57 @@
+import random
+from typing import Optional
+
+from config import DELAY_BETWEEN_WAREHOUSE_COEFFICIENTS_CHECK_SEC, MIN_WAREHOUSE_COEFFICIENTS_CHECK_SEC
+from config import MAX_WAREHOUSE_COEFFICIENTS_CHECK_SEC, POLLING_JITTER_RATIO
+from config import PREDICTION_HIGH_PROBABILITY, PREDICTION_LOW_PROBABILITY, PREDICTION_IDLE_INTERVAL_FACTOR
+from config import ACCEPTANCE_COEFFICIENTS_REQUESTS_PER_MINUTE
+from modules.rate_limit_module import RateLimitState
+
+
+class AdaptivePollingScheduler:
+    """
+    Класс, вычисляющий паузу до следующего опроса: учитывает заголовки лимитов WB,
+    экспоненциально отступает со случайным разбросом при 429/5xx и опрашивает
+    чаще, когда слоты вот-вот откроются или когда по прогнозу сейчас «горячий» час.
+    Опросы одного токена делят его лимит, поэтому пауза не короче 60 / лимит * число опросов
+    """
+
+    def __init__(self, base_interval_sec: float = DELAY_BETWEEN_WAREHOUSE_COEFFICIENTS_CHECK_SEC,
+                 min_interval_sec: float = MIN_WAREHOUSE_COEFFICIENTS_CHECK_SEC,
+                 max_interval_sec: float = MAX_WAREHOUSE_COEFFICIENTS_CHECK_SEC,
+                 requests_per_minute: float = ACCEPTANCE_COEFFICIENTS_REQUESTS_PER_MINUTE):
+        self.base_interval_sec = base_interval_sec
+        self.min_interval_sec = min_interval_sec
+        self.max_interval_sec = max_interval_sec
+        self.requests_per_minute = requests_per_minute
+
+    def min_interval(self, active_pollers: int = 1) -> float:
+        """Минимальная пауза, при которой active_pollers опросов вместе укладываются в лимит токена"""
+        return max(self.min_interval_sec, 60 / self.requests_per_minute * max(active_pollers, 1))
+
+    def next_delay(self, rate_limit: RateLimitState, hot: bool = False,
+                   opening_probability: Optional[float] = None, active_pollers: int = 1) -> float:
+        """
+        opening_probability — прогноз открытия слота в текущий час (None — прогноза нет);
+        active_pollers — сколько опросов делят лимит токена
+        """
+        min_interval = self.min_interval(active_pollers)
+        if rate_limit.consecutive_failures:
+            # Экспоненциальный отступ с «полным» разбросом, чтобы опросы не шли в ногу
+            backoff = min(self.max_interval_sec,
+                          self.base_interval_sec * 2 ** (rate_limit.consecutive_failures - 1))
+            delay = random.uniform(backoff / 2, backoff)
+        else:
+            if hot or (opening_probability is not None and opening_probability >= PREDICTION_HIGH_PROBABILITY):
+                delay = min_interval
+            elif opening_probability is not None and opening_probability <= PREDICTION_LOW_PROBABILITY:
+                # Сэкономленные запросы остаются в лимите на «горячие» часы
+                delay = self.base_interval_sec * PREDICTION_IDLE_INTERVAL_FACTOR
+            else:
+                delay = self.base_interval_sec
+            delay *= random.uniform(1 - POLLING_JITTER_RATIO, 1 + POLLING_JITTER_RATIO)
+
+        # Лимит токена важнее верхней границы паузы
+        delay = max(min(delay, self.max_interval_sec), min_interval)
+        # Если WB сообщил, когда можно повторить запрос, раньше этого не стучимся
+        return max(delay, rate_limit.seconds_until_allowed())
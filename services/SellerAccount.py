@@ -0,0 +1,33 @@
+from typing import Iterable, List, Optional
+
+from config import SELLERS
+
+
+class SellerAccount:
+    """
+    Кабинет продавца WB: токены разделов API и чаты, работающие с ним по умолчанию
+    """
+    __slots__ = ('name', 'seller_id', 'supply_api_key', 'analytics_api_key', 'promotion_api_key', 'chat_ids')
+
+    def __init__(self, name: str, seller_id: Optional[int], supply_api_key: str, analytics_api_key: str,
+                 promotion_api_key: str, chat_ids: Iterable[int] = ()):
+        self.name = name
+        self.seller_id = seller_id
+        self.supply_api_key = supply_api_key
+        self.analytics_api_key = analytics_api_key
+        self.promotion_api_key = promotion_api_key
+        self.chat_ids = frozenset(int(chat_id) for chat_id in chat_ids if chat_id)
+
+    @classmethod
+    def from_config(cls, settings: dict) -> 'SellerAccount':
+        return cls(settings['name'], settings.get('seller_id'), settings['supply_api_key'],
+                   settings['analytics_api_key'], settings['promotion_api_key'], settings.get('chat_ids', ()))
+
+
+def load_seller_accounts() -> List[SellerAccount]:
+    """Кабинеты из config.SELLERS; имена должны быть уникальными"""
+    accounts = [SellerAccount.from_config(settings) for settings in SELLERS]
+    names = [account.name for account in accounts]
+    if not accounts or len(set(names)) != len(names):
+        raise ValueError(f"В config.SELLERS должен быть хотя бы один кабинет с уникальным именем: {names}")
+    return accounts
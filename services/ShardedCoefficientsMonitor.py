@@ -0,0 +1,370 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from config import MONITOR_SHARDS, MONITOR_WAREHOUSE_IDS, MONITOR_WAREHOUSES_PER_REQUEST, MONITOR_WORKER_CHECK_SEC
+from config import ACCEPTANCE_COEFFICIENTS_REQUESTS_PER_MINUTE, AFTER_ERROR_RESTART_DELAY_SEC
+from modules.logger_module import initialize_logger, start_log_forwarding
+from modules.metrics_module import POLL_CYCLE_DURATION
+from modules.rate_limit_module import TokenBucket
+from services.CoefficientsChangeTracker import CoefficientsChangeTracker, SlotChange, SlotEvent, pack_slot_key
+from services.CoefficientsHistory import CoefficientsHistory
+from services.CoefficientsPollingService import CoefficientsSubscriber
+from services.PollingScheduler import AdaptivePollingScheduler
+from services.SellerAccount import SellerAccount
+from services.SubscriptionRules import CompiledMatcher, SubscriptionRule
+from services.WildberriesApiErrors import WildberriesApiError
+from services.WildberriesApiRegistry import WildberriesApiRegistry
+from services.WildberriesApiService import WildberriesApiService, ACCEPTANCE_COEFFICIENTS_URL
+from services.WildberriesModels import AcceptanceCoefficient
+
+# Сообщения воркеров координатору: (вид, номер шарда, данные)
+SHARD_CHANGES = "changes"  # данные — (склады пачки при первом опросе или None, изменения слотов)
+SHARD_CYCLE = "cycle"  # данные — длительность полного круга опроса, сек.
+# Как часто воркер проверяет сигнал остановки во время ожиданий, сек.
+SHARD_STOP_CHECK_SEC = 0.5
+
+
+class MonitorShard:
+    """
+    Часть мониторинга, выполняемая одним процессом: его склады, кабинет, чей токен он использует,
+    и доля лимита запросов этого токена
+    """
+    __slots__ = ('index', 'warehouse_ids', 'seller', 'requests_per_minute')
+
+    def __init__(self, index: int, warehouse_ids: List[int], seller: SellerAccount, requests_per_minute: float):
+        self.index = index
+        self.warehouse_ids = warehouse_ids
+        self.seller = seller
+        self.requests_per_minute = requests_per_minute
+
+
+def plan_shards(warehouse_ids: List[int], sellers: List[SellerAccount], shards: int,
+                requests_per_minute: float = ACCEPTANCE_COEFFICIENTS_REQUESTS_PER_MINUTE) -> List[MonitorShard]:
+    """
+    Делит склады между шардами поровну, а кабинеты — по кругу. Лимит WB действует на токен,
+    поэтому шарды одного кабинета делят его лимит между собой, а шарды разных кабинетов не мешают друг другу
+    """
+    slices = [sorted(set(warehouse_ids))[index::shards] for index in range(shards)]
+    plan = [MonitorShard(index, warehouses, sellers[index % len(sellers)], 0)
+            for index, warehouses in enumerate(slices) if warehouses]
+    for shard in plan:
+        sharing = sum(1 for other in plan if other.seller.name == shard.seller.name)
+        shard.requests_per_minute = requests_per_minute / sharing
+    return plan
+
+
+def run_shard_worker(shard: MonitorShard, changes_queue, stop_event, log_queue):
+    """Точка входа процесса-воркера; журнал пишет основной процесс, записи приходят через log_queue"""
+    initialize_logger(log_queue)
+    try:
+        asyncio.run(_poll_shard(shard, changes_queue, stop_event))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _wait_unless_stopped(awaitable, stop_event):
+    """
+    Ждёт awaitable, пока не выставлен stop_event; проверка раз в SHARD_STOP_CHECK_SEC.
+    Возвращает результат или None, если ожидание прервано остановкой
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while not stop_event.is_set():
+            done, _ = await asyncio.wait([task], timeout=SHARD_STOP_CHECK_SEC)
+            if done:
+                return task.result()
+        return None
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+
+async def _poll_shard(shard: MonitorShard, changes_queue, stop_event):
+    """
+    Опрашивает склады шарда по кругу так часто, как позволяет его доля лимита,
+    и отправляет координатору изменения слотов и длительность кругов опроса.
+    Все ожидания прерываются stop_event, чтобы процесс завершался сам, а не по terminate()
+    """
+    api_service = WildberriesApiService(shard.seller)
+    rate_limit = api_service.rate_limit_state(ACCEPTANCE_COEFFICIENTS_URL)
+    scheduler = AdaptivePollingScheduler()
+    # Без запаса на всплеск: доля лимита соблюдается на любом отрезке времени
+    bucket = TokenBucket(shard.requests_per_minute / 60, 1)
+    batches = [shard.warehouse_ids[start:start + MONITOR_WAREHOUSES_PER_REQUEST]
+               for start in range(0, len(shard.warehouse_ids), MONITOR_WAREHOUSES_PER_REQUEST)]
+    # Отдельное состояние на пачку: сбой одной пачки не выглядит исчезновением слотов других
+    trackers = [CoefficientsChangeTracker() for _ in batches]
+    polled = set()
+    cycle_sec = len(batches) * 60 / shard.requests_per_minute
+    logging.info(f"Шард {shard.index}: складов {len(shard.warehouse_ids)}, кабинет {shard.seller.name}, "
+                 f"{shard.requests_per_minute:g} запросов в минуту, полный круг ≈ {cycle_sec:.0f} сек.")
+    try:
+        while not stop_event.is_set():
+            cycle_started = time.monotonic()
+            for index, (batch, tracker) in enumerate(zip(batches, trackers)):
+                await _wait_unless_stopped(bucket.acquire(), stop_event)
+                if stop_event.is_set():
+                    break
+                try:
+                    coefficients = await _wait_unless_stopped(api_service.get_acceptance_coefficients(batch),
+                                                              stop_event)
+                except WildberriesApiError as e:
+                    logging.error(f"Шард {shard.index}: ошибка при опросе складов {batch}: {e}")
+                    coefficients = []
+                finally:
+                    # Если WB попросил подождать, пауза касается всех пачек шарда
+                    bucket.block_for(rate_limit.seconds_until_allowed())
+                # Пустой ответ не считаем исчезновением всех слотов
+                if not coefficients:
+                    continue
+                changes = tracker.update(coefficients)
+                if index not in polled:
+                    # Склады пачки при первом опросе: координатор закроет слоты, исчезнувшие,
+                    # пока воркер был остановлен (его новое состояние о них ничего не знает)
+                    changes_queue.put((SHARD_CHANGES, shard.index, (batch, changes)))
+                elif changes:
+                    changes_queue.put((SHARD_CHANGES, shard.index, (None, changes)))
+                polled.add(index)
+            # Короткий круг (мало складов) не должен опрашивать чаще минимального интервала
+            elapsed = time.monotonic() - cycle_started
+            # Метрики воркера живут в его процессе, поэтому длительность круга передаётся координатору
+            changes_queue.put((SHARD_CYCLE, shard.index, elapsed))
+            await _wait_unless_stopped(asyncio.sleep(max(0.0, scheduler.next_delay(rate_limit, hot=True) - elapsed)),
+                                       stop_event)
+    finally:
+        await api_service.close()
+
+
+class ShardedCoefficientsMonitor:
+    """
+    Класс, отслеживающий все склады WB силами нескольких процессов-воркеров (шардов).
+    Каждый шард опрашивает свою часть складов со своей долей лимита; изменения от всех шардов
+    сходятся сюда, очищаются от повторов и рассылаются подписчикам одним потоком.
+    Интерфейс подписки тот же, что у CoefficientsPollingService
+    """
+
+    def __init__(self, api_registry: WildberriesApiRegistry, history: CoefficientsHistory = None,
+                 shards: int = MONITOR_SHARDS, warehouse_ids: Optional[List[int]] = MONITOR_WAREHOUSE_IDS):
+        self.api_registry = api_registry
+        self.history = history
+        self.shards = shards
+        self.warehouse_ids = warehouse_ids
+        # spawn: дочерний процесс не наследует запущенный цикл событий и открытые соединения
+        self.__context = multiprocessing.get_context('spawn')
+        self.__changes_queue = self.__context.Queue()
+        self.__stop_event = self.__context.Event()
+        self.__log_queue = self.__context.Queue()
+        self.__log_forwarder = None
+        self.__plan: List[MonitorShard] = []
+        self.__processes: Dict[int, multiprocessing.Process] = {}
+        self.__starter: Optional[asyncio.Task] = None
+        self.__reader: Optional[asyncio.Task] = None
+        self.__supervisor: Optional[asyncio.Task] = None
+        self.__subscribers: Dict[int, CoefficientsSubscriber] = {}
+        self.__restored_chats: Set[int] = set()
+        # Склады, чей первый опрос после запуска координатора уже пришёл
+        self.__synced_warehouses: Set[int] = set()
+        self.__planned_warehouses: Set[int] = set()
+        self.__matcher = CompiledMatcher(())
+        # Последнее известное состояние слотов всех шардов: упакованный ключ слота -> запись
+        self.__slots: Dict[int, AcceptanceCoefficient] = {}
+
+    def subscribe(self, rule: SubscriptionRule, notify: Callable[[int, SlotEvent], Awaitable[None]],
+                  synced: bool = False):
+        """
+        Подписывает чат по его правилу, заменяя предыдущую подписку.
+        synced=True — чат уже видел состояние слотов до перезапуска
+        """
+        chat_id = rule.chat_id
+        self.unsubscribe(chat_id)
+        subscriber = CoefficientsSubscriber(rule, notify)
+        self.__subscribers[chat_id] = subscriber
+        self.__compile()
+        if synced and not self.__initial_sync_done():
+            self.__restored_chats.add(chat_id)
+        else:
+            # Текущее состояние берётся сразу, всё пришедшее позже будет доставлено как изменения
+            events = CompiledMatcher([rule]).events(SlotChange(None, info) for info in self.__slots.values())
+            subscriber.synced = True
+            if events.get(chat_id):
+                asyncio.create_task(self.__deliver(subscriber, events[chat_id]))
+        if self.__starter is None:
+            self.__starter = asyncio.create_task(self.__start())
+
+    def unsubscribe(self, chat_id: int) -> bool:
+        self.__restored_chats.discard(chat_id)
+        if self.__subscribers.pop(chat_id, None) is None:
+            return False
+        self.__compile()
+        return True
+
+    def is_subscribed(self, chat_id: int) -> bool:
+        return chat_id in self.__subscribers
+
+    def subscriber_count(self) -> int:
+        return len(self.__subscribers)
+
+    def poller_count(self) -> int:
+        return sum(1 for process in self.__processes.values() if process.is_alive())
+
+    def __compile(self):
+        self.__matcher = CompiledMatcher(subscriber.rule for subscriber in self.__subscribers.values())
+
+    async def close(self):
+        """Останавливает воркеры и дочитывает уже присланные ими изменения"""
+        for task in (self.__starter, self.__supervisor):
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self.__stop_event.set()
+        await asyncio.to_thread(self.__join_workers)
+        if self.__log_forwarder is not None:
+            # Дописываем журнал остановленных воркеров
+            await asyncio.to_thread(self.__log_forwarder.stop)
+        if self.__reader is not None:
+            # None будит поток, ожидающий очередь
+            self.__changes_queue.put(None)
+            await asyncio.gather(self.__reader, return_exceptions=True)
+        self.__subscribers.clear()
+
+    def __join_workers(self):
+        for process in self.__processes.values():
+            process.join(AFTER_ERROR_RESTART_DELAY_SEC)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+    async def __start(self):
+        while True:
+            try:
+                warehouse_ids = self.warehouse_ids or [warehouse.id for warehouse in
+                                                       await self.api_registry.shared.get_warehouses()]
+                if warehouse_ids:
+                    break
+                logging.error("Список складов WB пуст, шардированный мониторинг не запущен")
+            except WildberriesApiError as e:
+                logging.error(f"Не удалось получить список складов для мониторинга: {e}")
+            await asyncio.sleep(AFTER_ERROR_RESTART_DELAY_SEC)
+
+        sellers = [self.api_registry.get(name).seller for name in self.api_registry.names()]
+        self.__plan = plan_shards(warehouse_ids, sellers, self.shards)
+        self.__planned_warehouses = set(warehouse_ids)
+        self.__reader = asyncio.create_task(self.__read_changes())
+        self.__log_forwarder = start_log_forwarding(self.__log_queue)
+        for shard in self.__plan:
+            self.__spawn(shard)
+        logging.info(f"Мониторинг {len(warehouse_ids)} складов запущен в {len(self.__plan)} процессах")
+        self.__supervisor = asyncio.create_task(self.__supervise())
+
+    def __spawn(self, shard: MonitorShard):
+        process = self.__context.Process(target=run_shard_worker, name=f"coefficients-shard-{shard.index}",
+                                         args=(shard, self.__changes_queue, self.__stop_event, self.__log_queue),
+                                         daemon=True)
+        process.start()
+        self.__processes[shard.index] = process
+
+    async def __supervise(self):
+        while True:
+            await asyncio.sleep(MONITOR_WORKER_CHECK_SEC)
+            for shard in self.__plan:
+                process = self.__processes[shard.index]
+                if not process.is_alive():
+                    logging.error(f"Воркер шарда {shard.index} завершился с кодом {process.exitcode}, перезапускаем")
+                    self.__spawn(shard)
+
+    async def __read_changes(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await loop.run_in_executor(None, self.__changes_queue.get)
+            if item is None:
+                return
+            kind, _, payload = item
+            if kind == SHARD_CYCLE:
+                POLL_CYCLE_DURATION.observe(payload, mode="shard")
+                continue
+            first_poll_warehouses, changes = payload
+            try:
+                vanished = self.__vanished(first_poll_warehouses, changes) if first_poll_warehouses else []
+                changes = self.__deduplicate(changes) + vanished
+                first_seen = []
+                initial = bool(first_poll_warehouses) and self.__start_initial_sync(first_poll_warehouses)
+                if initial:
+                    # Слоты, впервые увиденные после запуска бота, — не новость для чатов, видевших их до перезапуска.
+                    # После перезапуска воркера всё новое — обычные появления: они уже сверены с общим состоянием
+                    first_seen = [change for change in changes if change.previous is None]
+                    changes = [change for change in changes if change.previous is not None]
+                if changes and self.history:
+                    self.history.record(changes)
+                await self.__fan_out(changes, include_restored=True)
+                await self.__fan_out(first_seen, include_restored=False)
+                if initial and self.__initial_sync_done():
+                    # Первичная синхронизация завершена — дальше восстановленные чаты получают всё, как остальные
+                    self.__restored_chats.clear()
+            except Exception as e:
+                logging.exception(f"Ошибка при рассылке изменений шардов: {e}")
+
+    def __start_initial_sync(self, warehouse_ids: List[int]) -> bool:
+        """
+        Отмечает первый опрос пачки складов. True — это первичная синхронизация после запуска бота,
+        а не перезапуск воркера
+        """
+        initial = not self.__synced_warehouses.issuperset(warehouse_ids)
+        self.__synced_warehouses.update(warehouse_ids)
+        return initial
+
+    def __initial_sync_done(self) -> bool:
+        return bool(self.__planned_warehouses) and self.__synced_warehouses >= self.__planned_warehouses
+
+    def __deduplicate(self, changes: List[SlotChange]) -> List[SlotChange]:
+        """
+        Сверяет изменения шарда с общим состоянием: повторы (например, после перезапуска воркера)
+        отбрасываются, а previous берётся из общего состояния
+        """
+        unique = []
+        for change in changes:
+            info = change.current or change.previous
+            key = pack_slot_key(info.warehouse_id, info.date_start, info.box_type_id)
+            known = self.__slots.get(key)
+            current = change.current
+            if current is None:
+                if known is not None:
+                    del self.__slots[key]
+                    unique.append(SlotChange(known, None))
+            elif (known is None or known.coefficient != current.coefficient
+                  or known.allow_unload != current.allow_unload):
+                self.__slots[key] = current
+                unique.append(SlotChange(known, current))
+        return unique
+
+    def __vanished(self, warehouse_ids: List[int], changes: List[SlotChange]) -> List[SlotChange]:
+        """
+        Первый опрос пачки после (пере)запуска воркера содержит все её текущие слоты.
+        Известные слоты этих складов, которых в нём нет, исчезли, пока воркер не работал
+        """
+        warehouses = set(warehouse_ids)
+        present = {pack_slot_key(change.current.warehouse_id, change.current.date_start, change.current.box_type_id)
+                   for change in changes if change.current is not None}
+        vanished = [key for key, known in self.__slots.items()
+                    if known.warehouse_id in warehouses and key not in present]
+        return [SlotChange(self.__slots.pop(key), None) for key in vanished]
+
+    async def __fan_out(self, changes: List[SlotChange], include_restored: bool):
+        if not changes:
+            return
+        events = self.__matcher.events(changes)
+        deliveries = [self.__deliver(self.__subscribers[chat_id], chat_events)
+                      for chat_id, chat_events in events.items()
+                      if chat_id in self.__subscribers and (include_restored or chat_id not in self.__restored_chats)]
+        await asyncio.gather(*deliveries)
+
+    @staticmethod
+    async def __deliver(subscriber: CoefficientsSubscriber, events: list):
+        for event in events:
+            try:
+                await subscriber.notify(subscriber.chat_id, event)
+            except Exception as e:
+                logging.error(f"Не удалось отправить уведомление в чат {subscriber.chat_id}: {e}")
@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from config import BOOKING_RETRY_DELAY_SEC
+from slot_browser_booker import BookingCancelled, SlotBrowserBooker
+
+
+class BookingJob:
+    """
+    Задача бронирования одной поставки.
+    detected_at — момент обнаружения слота (time.monotonic) для автобронирования
+    """
+
+    def __init__(self, supply_id: str, target_dates: List[str], on_result: Callable[[str], Awaitable[None]],
+                 detected_at: Optional[float] = None, max_attempts: Optional[int] = None):
+        self.supply_id = supply_id
+        self.target_dates = target_dates
+        self.on_result = on_result
+        self.detected_at = detected_at
+        self.max_attempts = max_attempts
+        self.cancel_event = threading.Event()
+        self.attempts = 0
+        self.task = None
+
+
+class SlotBookingService:
+    """
+    Класс, отвечающий за бронирование слотов вне цикла asyncio: у каждой поставки одна задача,
+    а попытки всех поставок по очереди выполняются в одном рабочем потоке и одном «тёплом» браузере.
+    Второй экземпляр Chrome на том же профиле (CHROME_PROFILE_PATH) не запускается, поэтому браузер общий;
+    единственный поток также гарантирует, что закрытие браузера завершится раньше следующего запуска.
+    В режиме автобронирования браузер держится открытым заранее,
+    чтобы от обнаружения слота до клика проходило как можно меньше времени
+    """
+
+    def __init__(self, retry_delay_sec: float = BOOKING_RETRY_DELAY_SEC):
+        self.retry_delay_sec = retry_delay_sec
+        self.__executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slot-booker")
+        self.__jobs: Dict[str, BookingJob] = {}
+        self.__booker = SlotBrowserBooker()
+        self.__auto_booking: Dict[int, str] = {}
+
+    def start(self, supply_id: str, target_dates: List[str], on_result: Callable[[str], Awaitable[None]],
+              detected_at: Optional[float] = None, max_attempts: Optional[int] = None) -> bool:
+        """Запускает бронирование поставки. False, если для неё уже идёт бронирование"""
+        if supply_id in self.__jobs:
+            return False
+        job = BookingJob(supply_id, target_dates, on_result, detected_at, max_attempts)
+        job.task = asyncio.create_task(self.__run(job))
+        self.__jobs[supply_id] = job
+        return True
+
+    def cancel(self, supply_id: str = None) -> List[str]:
+        """Отменяет бронирование поставки (или все, если supply_id не указан)"""
+        supply_ids = [supply_id] if supply_id else list(self.__jobs)
+        cancelled = []
+        for job_supply_id in supply_ids:
+            job = self.__jobs.get(job_supply_id)
+            if job is None:
+                continue
+            job.cancel_event.set()
+            job.task.cancel()
+            cancelled.append(job_supply_id)
+        return cancelled
+
+    def active_jobs(self) -> List[BookingJob]:
+        return list(self.__jobs.values())
+
+    def arm_auto_booking(self, chat_id: int, supply_id: str):
+        """Включает автобронирование поставки для чата и заранее прогревает браузер"""
+        self.disarm_auto_booking(chat_id)
+        self.__auto_booking[chat_id] = supply_id
+        asyncio.get_running_loop().run_in_executor(self.__executor, self.__booker.warm_up)
+
+    def disarm_auto_booking(self, chat_id: int) -> Optional[str]:
+        supply_id = self.__auto_booking.pop(chat_id, None)
+        if supply_id is not None:
+            self.__release_browser()
+        return supply_id
+
+    def auto_booking_supply(self, chat_id: int) -> Optional[str]:
+        return self.__auto_booking.get(chat_id)
+
+    async def close(self):
+        jobs = list(self.__jobs.values())
+        self.cancel()
+        await asyncio.gather(*(job.task for job in jobs), return_exceptions=True)
+        self.__auto_booking.clear()
+        await asyncio.gather(asyncio.get_running_loop().run_in_executor(self.__executor, self.__booker.close),
+                             return_exceptions=True)
+        self.__executor.shutdown(wait=False)
+
+    def __release_browser(self):
+        """Закрывает браузер, если он больше не нужен ни одной задаче и ни одному автобронированию"""
+        if self.__jobs or self.__auto_booking:
+            return
+        # Закрытие встаёт в очередь того же потока — следующий запуск браузера начнётся только после него
+        asyncio.get_running_loop().run_in_executor(self.__executor, self.__booker.close)
+
+    @staticmethod
+    def __timed_book(booker: SlotBrowserBooker, job: BookingJob):
+        # Выполняется в рабочем потоке: фиксируем момент фактического начала попытки
+        started_at = time.monotonic()
+        return started_at, booker.book(job.supply_id, job.target_dates, job.cancel_event)
+
+    async def __run(self, job: BookingJob):
+        loop = asyncio.get_running_loop()
+        attempt = None
+        try:
+            while not job.cancel_event.is_set():
+                job.attempts += 1
+                attempt = loop.run_in_executor(self.__executor, self.__timed_book, self.__booker, job)
+                started_at, success = await attempt
+                latency = self.__format_latency(job, started_at)
+                if success:
+                    if job.detected_at is not None:
+                        # Поставка забронирована — автобронирование по ней больше не нужно
+                        for chat_id in [c for c, armed in self.__auto_booking.items() if armed == job.supply_id]:
+                            del self.__auto_booking[chat_id]
+                    await job.on_result(f"✅ Слот для поставки {job.supply_id} успешно забронирован! "
+                                        f"Попыток: {job.attempts}{latency}")
+                    return
+                if job.max_attempts and job.attempts >= job.max_attempts:
+                    await job.on_result(f"❌ Не удалось забронировать слот для поставки {job.supply_id}{latency}")
+                    return
+                await asyncio.sleep(self.retry_delay_sec)  # интервал между попытками
+        except (asyncio.CancelledError, BookingCancelled):
+            logging.info(f"Бронирование поставки {job.supply_id} отменено")
+        except Exception as e:
+            logging.exception(f"Ошибка бронирования поставки {job.supply_id}: {e}")
+            await job.on_result(f"❌ Бронирование поставки {job.supply_id} остановлено из-за ошибки: {e}")
+        finally:
+            self.__jobs.pop(job.supply_id, None)
+            # Браузер закрываем только после того, как текущая попытка увидит отмену и завершится
+            if attempt is not None and not attempt.done():
+                await asyncio.wait([attempt])
+            self.__release_browser()
+
+    @staticmethod
+    def __format_latency(job: BookingJob, started_at: float) -> str:
+        if job.detected_at is None:
+            return ""
+        to_start_ms = (started_at - job.detected_at) * 1000
+        to_result_sec = time.monotonic() - job.detected_at
+        logging.info(f"Автобронирование {job.supply_id}: до начала попытки {to_start_ms:.0f} мс, "
+                     f"до результата {to_result_sec:.1f} с")
+        return (f"\n⏱ От обнаружения слота до начала попытки: {to_start_ms:.0f} мс, "
+                f"до результата: {to_result_sec:.1f} с")
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+from config import HOT_SLOT_MAX_COEFFICIENT, PREDICTION_WINDOW_DAYS, PREDICTION_REFIT_INTERVAL_SEC
+from config import PREDICTION_MIN_OBSERVED_WEEKS
+from services.CoefficientsHistory import CoefficientsHistory
+
+HOURS_PER_WEEK = 7 * 24
+# 1 января 1970 года — четверг
+_EPOCH_WEEKDAY = 3
+# Априорное распределение Beta(_PRIOR_HITS, _PRIOR_WEIGHT - _PRIOR_HITS): без наблюдений вероятность 5 %.
+# Слабое, чтобы при окне в несколько недель час без открытий оценивался ниже PREDICTION_LOW_PROBABILITY
+# (3 недели без открытий — 2 %), а не застревал около 1 / (недель + 2), как при сглаживании Лапласа
+_PRIOR_HITS = 0.1
+_PRIOR_WEIGHT = 2.0
+
+
+def hour_of_week(local_ts: np.ndarray) -> np.ndarray:
+    """Номер часа недели (понедельник 00:00 — 0) для массива местных unix-времён"""
+    weekday = (local_ts // 86400 + _EPOCH_WEEKDAY) % 7
+    return weekday * 24 + (local_ts // 3600) % 24
+
+
+def fit_opening_probabilities(ts: np.ndarray, slot: np.ndarray, coefficient: np.ndarray,
+                              max_coefficient: float, utc_offset_sec: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    По истории изменений слотов одного склада оценивает для каждого часа недели
+    вероятность, что за этот час откроется слот с коэффициентом 0..max_coefficient.
+    Возвращает (вероятности, число наблюдённых часов), оба массива длиной HOURS_PER_WEEK
+    """
+    if len(ts) == 0:
+        return np.zeros(HOURS_PER_WEEK), np.zeros(HOURS_PER_WEEK, dtype=np.int64)
+    ts = np.asarray(ts, dtype=np.int64) + utc_offset_sec
+    slot = np.asarray(slot, dtype=np.int64)
+    coefficient = np.asarray(coefficient, dtype=np.float32)
+
+    # Группируем изменения по слотам, внутри слота сохраняется порядок по времени
+    order = np.argsort(slot, kind='stable')
+    slot, coefficient, ts = slot[order], coefficient[order], ts[order]
+    available = (coefficient >= 0) & (coefficient <= max_coefficient)
+    was_available = np.zeros_like(available)
+    was_available[1:] = available[:-1] & (slot[1:] == slot[:-1])
+    opening_hours = np.unique(ts[available & ~was_available] // 3600)
+
+    hits = np.bincount(hour_of_week(opening_hours * 3600), minlength=HOURS_PER_WEEK)
+    # Наблюдёнными считаем все часы между первым и последним изменением в истории
+    observed_hours = np.arange(ts.min() // 3600, ts.max() // 3600 + 1)
+    observed = np.bincount(hour_of_week(observed_hours * 3600), minlength=HOURS_PER_WEEK)
+    # Сглаживание слабым априорным распределением: редкие наблюдения не дают вероятностей 0 и 1
+    return (hits + _PRIOR_HITS) / (observed + _PRIOR_WEIGHT), observed
+
+
+class SlotOpeningPredictor:
+    """
+    Класс, оценивающий по истории коэффициентов вероятность открытия подходящего слота
+    на складе в текущий час недели. Модель периодически переобучается в фоновом потоке,
+    опрос использует её, чтобы чаще опрашивать в «горячие» часы и реже — в остальные
+    """
+
+    def __init__(self, history: CoefficientsHistory, max_coefficient: float = HOT_SLOT_MAX_COEFFICIENT,
+                 window_days: int = PREDICTION_WINDOW_DAYS, refit_interval_sec: float = PREDICTION_REFIT_INTERVAL_SEC):
+        self.history = history
+        self.max_coefficient = max_coefficient
+        self.window_days = window_days
+        self.refit_interval_sec = refit_interval_sec
+        self.__probabilities: Dict[int, np.ndarray] = {}
+        self.__observed: Dict[int, np.ndarray] = {}
+        self.__fitted_at: Dict[int, float] = {}
+
+    async def maybe_refit(self, warehouse_ids: Iterable[int]):
+        """Переобучает модель для складов, по которым она устарела"""
+        now = time.monotonic()
+        for warehouse_id in warehouse_ids:
+            fitted_at = self.__fitted_at.get(warehouse_id)
+            if fitted_at is None or now - fitted_at >= self.refit_interval_sec:
+                # Отмечаем заранее, чтобы параллельные опросы не обучали одно и то же
+                self.__fitted_at[warehouse_id] = now
+                await self.refit(warehouse_id)
+
+    async def refit(self, warehouse_id: int):
+        since = int(time.time()) - self.window_days * 24 * 60 * 60
+        ts, slot, coefficient = await self.history.column_arrays(warehouse_id, since)
+        probabilities, observed = await asyncio.to_thread(
+            fit_opening_probabilities, ts, slot, coefficient, self.max_coefficient, time.localtime().tm_gmtoff)
+        self.__probabilities[warehouse_id] = probabilities
+        self.__observed[warehouse_id] = observed
+        logging.info(f"Модель открытия слотов склада {warehouse_id} обновлена по {len(ts)} изменениям")
+
+    def probability(self, warehouse_ids: Iterable[int], at: Optional[float] = None) -> Optional[float]:
+        """
+        Наибольшая по складам вероятность открытия слота в час недели момента at.
+        None — истории пока слишком мало, чтобы ей доверять
+        """
+        local_ts = int(at if at is not None else time.time()) + time.localtime().tm_gmtoff
+        bucket = int(hour_of_week(np.int64(local_ts)))
+        result = None
+        for warehouse_id in warehouse_ids:
+            observed = self.__observed.get(warehouse_id)
+            if observed is None or observed[bucket] < PREDICTION_MIN_OBSERVED_WEEKS:
+                continue
+            probability = float(self.__probabilities[warehouse_id][bucket])
+            result = probability if result is None else max(result, probability)
+        return result
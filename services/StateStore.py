@@ -0,0 +1,204 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config import STATE_DB_PATH, STATE_FLUSH_INTERVAL_SEC
+from services.CoefficientsChangeTracker import pack_slot_key
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS subscriptions (
+    chat_id INTEGER PRIMARY KEY,
+    warehouse_ids TEXT NOT NULL,
+    filters TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS slot_state (
+    warehouses_key TEXT NOT NULL,
+    slot_key INTEGER NOT NULL,
+    coefficient REAL NOT NULL,
+    allow_unload INTEGER NOT NULL,
+    warehouse_name TEXT,
+    box_type_name TEXT,
+    PRIMARY KEY (warehouses_key, slot_key)
+);
+CREATE TABLE IF NOT EXISTS chat_sellers (
+    chat_id INTEGER PRIMARY KEY,
+    seller_name TEXT NOT NULL
+);
+"""
+
+
+def warehouses_key_to_str(warehouse_ids: Iterable[int]) -> str:
+    return ",".join(map(str, sorted(warehouse_ids)))
+
+
+class StoredSubscription:
+    """
+    Подписка чата, сохранённая в базе
+    """
+    __slots__ = ('chat_id', 'warehouse_ids', 'filters')
+
+    def __init__(self, chat_id: int, warehouse_ids: List[int], filters: dict):
+        self.chat_id = chat_id
+        self.warehouse_ids = warehouse_ids
+        self.filters = filters
+
+
+class StateStore:
+    """
+    Класс, хранящий подписки чатов, выбранные чатами кабинеты и последнее известное состояние слотов в SQLite.
+    Запись отложенная (write-behind): изменения копятся в памяти и пачкой сбрасываются
+    на диск в фоновом потоке, поэтому цикл опроса никогда не ждёт диск
+    """
+
+    def __init__(self, db_path: str = STATE_DB_PATH, flush_interval_sec: float = STATE_FLUSH_INTERVAL_SEC):
+        self.db_path = db_path
+        self.flush_interval_sec = flush_interval_sec
+        # None в значении означает удаление записи
+        self.__pending_subscriptions: Dict[int, Optional[Tuple[str, str]]] = {}
+        self.__pending_slots: Dict[Tuple[str, int], Optional[tuple]] = {}
+        self.__pending_chat_sellers: Dict[int, str] = {}
+        self.__flusher: Optional[asyncio.Task] = None
+        self.__initialized = False
+
+    async def load_subscriptions(self) -> List[StoredSubscription]:
+        rows = await asyncio.to_thread(self.__query, "SELECT chat_id, warehouse_ids, filters FROM subscriptions")
+        return [StoredSubscription(chat_id, json.loads(warehouse_ids), json.loads(filters))
+                for chat_id, warehouse_ids, filters in rows]
+
+    async def load_chat_sellers(self) -> Dict[int, str]:
+        """Кабинеты, выбранные чатами командой /seller"""
+        return dict(await asyncio.to_thread(self.__query, "SELECT chat_id, seller_name FROM chat_sellers"))
+
+    async def load_slot_state(self, warehouse_ids: Iterable[int]) -> List[tuple]:
+        """
+        Строки (slot_key, coefficient, allow_unload, warehouse_name, box_type_name) для набора складов.
+        Учитываются и ещё не сброшенные на диск изменения: иначе опрос, перезапущенный сразу после
+        отписки, восстановил бы строки, которые вот-вот удалит отложенная запись
+        """
+        warehouses_key = warehouses_key_to_str(warehouse_ids)
+        pending = [(slot_key, row) for (key, slot_key), row in self.__pending_slots.items() if key == warehouses_key]
+        # Ожидающее удаление набора: на диске для него уже ничего нет
+        if (warehouses_key, None) in self.__pending_slots:
+            rows = {}
+        else:
+            rows = {row[0]: row[1:] for row in await asyncio.to_thread(
+                self.__query,
+                "SELECT slot_key, coefficient, allow_unload, warehouse_name, box_type_name "
+                "FROM slot_state WHERE warehouses_key = ?",
+                (warehouses_key,))}
+        for slot_key, row in pending:
+            if slot_key is None:
+                continue
+            if row is None:
+                rows.pop(slot_key, None)
+            else:
+                rows[slot_key] = row
+        return [(slot_key, *row) for slot_key, row in rows.items()]
+
+    def save_subscription(self, chat_id: int, warehouse_ids: Iterable[int], filters: dict):
+        self.__pending_subscriptions[chat_id] = (json.dumps(sorted(warehouse_ids)), json.dumps(filters, ensure_ascii=False))
+        self.__schedule_flush()
+
+    def delete_subscription(self, chat_id: int):
+        self.__pending_subscriptions[chat_id] = None
+        self.__schedule_flush()
+
+    def save_chat_seller(self, chat_id: int, seller_name: str):
+        self.__pending_chat_sellers[chat_id] = seller_name
+        self.__schedule_flush()
+
+    def save_slot_changes(self, warehouse_ids: Iterable[int], changes: Iterable):
+        """Запоминает изменения слотов (SlotChange из CoefficientsChangeTracker)"""
+        warehouses_key = warehouses_key_to_str(warehouse_ids)
+        for change in changes:
+            info = change.current or change.previous
+            slot_key = pack_slot_key(info.warehouse_id, info.date_start, info.box_type_id)
+            if change.current is None:
+                self.__pending_slots[(warehouses_key, slot_key)] = None
+            else:
+                self.__pending_slots[(warehouses_key, slot_key)] = (
+                    info.coefficient, int(info.allow_unload), info.warehouse_name or None, info.box_type_name or None)
+        self.__schedule_flush()
+
+    def delete_slot_state(self, warehouse_ids: Iterable[int]):
+        """Удаляет состояние набора складов, на который больше никто не подписан"""
+        warehouses_key = warehouses_key_to_str(warehouse_ids)
+        for key in [key for key in self.__pending_slots if key[0] == warehouses_key]:
+            del self.__pending_slots[key]
+        self.__pending_slots[(warehouses_key, None)] = None
+        self.__schedule_flush()
+
+    async def close(self):
+        """Останавливает фоновую запись и сбрасывает всё накопленное"""
+        if self.__flusher is not None:
+            self.__flusher.cancel()
+            await asyncio.gather(self.__flusher, return_exceptions=True)
+            self.__flusher = None
+        await self.flush()
+
+    async def flush(self):
+        subscriptions, self.__pending_subscriptions = self.__pending_subscriptions, {}
+        slots, self.__pending_slots = self.__pending_slots, {}
+        chat_sellers, self.__pending_chat_sellers = self.__pending_chat_sellers, {}
+        if not subscriptions and not slots and not chat_sellers:
+            return
+        try:
+            await asyncio.to_thread(self.__write, subscriptions, slots, chat_sellers)
+        except sqlite3.Error as e:
+            logging.error(f"Не удалось сохранить состояние в {self.db_path}: {e}")
+
+    def __schedule_flush(self):
+        if self.__flusher is None or self.__flusher.done():
+            self.__flusher = asyncio.create_task(self.__delayed_flush())
+
+    async def __delayed_flush(self):
+        await asyncio.sleep(self.flush_interval_sec)
+        await self.flush()
+
+    def __connect(self) -> sqlite3.Connection:
+        if not self.__initialized:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(self.db_path)
+        if not self.__initialized:
+            connection.executescript(_SCHEMA)
+            self.__initialized = True
+        return connection
+
+    def __query(self, sql: str, params: tuple = ()) -> list:
+        connection = self.__connect()
+        try:
+            return connection.execute(sql, params).fetchall()
+        finally:
+            connection.close()
+
+    def __write(self, subscriptions: dict, slots: dict, chat_sellers: dict):
+        connection = self.__connect()
+        try:
+            with connection:
+                for chat_id, row in subscriptions.items():
+                    if row is None:
+                        connection.execute("DELETE FROM subscriptions WHERE chat_id = ?", (chat_id,))
+                    else:
+                        connection.execute(
+                            "INSERT OR REPLACE INTO subscriptions (chat_id, warehouse_ids, filters) VALUES (?, ?, ?)",
+                            (chat_id, *row))
+                for (warehouses_key, slot_key), row in slots.items():
+                    if slot_key is None:
+                        connection.execute("DELETE FROM slot_state WHERE warehouses_key = ?", (warehouses_key,))
+                    elif row is None:
+                        connection.execute("DELETE FROM slot_state WHERE warehouses_key = ? AND slot_key = ?",
+                                           (warehouses_key, slot_key))
+                    else:
+                        connection.execute(
+                            "INSERT OR REPLACE INTO slot_state (warehouses_key, slot_key, coefficient, allow_unload, "
+                            "warehouse_name, box_type_name) VALUES (?, ?, ?, ?, ?, ?)",
+                            (warehouses_key, slot_key, *row))
+                connection.executemany("INSERT OR REPLACE INTO chat_sellers (chat_id, seller_name) VALUES (?, ?)",
+                                       chat_sellers.items())
+        finally:
+            connection.close()
@@ -0,0 +1,169 @@
+import time
+from datetime import date
+from typing import Dict, FrozenSet, Iterable, List, Optional
+
+from config import TARGET_WAREHOUSE_ID, MIN_NEED_COEFFICIENT, MAX_NEED_COEFFICIENT, NEED_BOX_TYPE_ID
+from services.CoefficientsChangeTracker import SlotChange, SlotEvent, slot_event_for
+from services.WildberriesModels import AcceptanceCoefficient
+
+_YES = {"1", "yes", "true", "да"}
+_NO = {"0", "no", "false", "нет"}
+_ANY = {"*", "any", "любая"}
+_RULE_KEYS = {"warehouses", "склады", "coef", "коэф", "box", "короба", "dates", "даты", "unload", "разгрузка"}
+
+
+class SubscriptionRule:
+    """
+    Фильтр чата по слотам приёмки: склады, диапазон коэффициентов (включительно),
+    типы поставки (boxTypeID), окно дат и признак разрешённой разгрузки.
+    Пустые box_type_ids, date_from/date_to и allow_unload=None означают «любые»
+    """
+    __slots__ = ('chat_id', 'warehouse_ids', 'min_coefficient', 'max_coefficient',
+                 'box_type_ids', 'date_from', 'date_to', 'allow_unload')
+
+    def __init__(self, chat_id: int, warehouse_ids: Iterable[int],
+                 min_coefficient: float = MIN_NEED_COEFFICIENT, max_coefficient: float = MAX_NEED_COEFFICIENT,
+                 box_type_ids: Iterable[int] = (NEED_BOX_TYPE_ID,), date_from: Optional[str] = None,
+                 date_to: Optional[str] = None, allow_unload: Optional[bool] = None):
+        self.chat_id = chat_id
+        self.warehouse_ids: FrozenSet[int] = frozenset(warehouse_ids)
+        self.min_coefficient = float(min_coefficient)
+        self.max_coefficient = float(max_coefficient)
+        self.box_type_ids: FrozenSet[int] = frozenset(box_type_ids)
+        # Даты храним строками ISO: сравнение строк совпадает с хронологическим
+        self.date_from = date_from
+        self.date_to = date_to
+        self.allow_unload = allow_unload
+
+    @classmethod
+    def default(cls, chat_id: int = 0) -> 'SubscriptionRule':
+        """Правило по умолчанию из config.py"""
+        return cls(chat_id, TARGET_WAREHOUSE_ID)
+
+    @classmethod
+    def from_filters(cls, chat_id: int, warehouse_ids: Iterable[int], filters: dict) -> 'SubscriptionRule':
+        """Правило из сохранённого в StateStore словаря; отсутствующие поля берутся по умолчанию"""
+        rule = cls(chat_id, warehouse_ids)
+        rule.min_coefficient = float(filters.get('min_coefficient', rule.min_coefficient))
+        rule.max_coefficient = float(filters.get('max_coefficient', rule.max_coefficient))
+        rule.box_type_ids = frozenset(filters.get('box_type_ids', rule.box_type_ids))
+        rule.date_from = filters.get('date_from')
+        rule.date_to = filters.get('date_to')
+        rule.allow_unload = filters.get('allow_unload')
+        return rule
+
+    def to_filters(self) -> dict:
+        return {
+            'min_coefficient': self.min_coefficient,
+            'max_coefficient': self.max_coefficient,
+            'box_type_ids': sorted(self.box_type_ids),
+            'date_from': self.date_from,
+            'date_to': self.date_to,
+            'allow_unload': self.allow_unload,
+        }
+
+    def matches(self, info: AcceptanceCoefficient) -> bool:
+        """Подходит ли слот под правило (без проверки склада — её делает индекс)"""
+        if not self.min_coefficient <= info.coefficient <= self.max_coefficient:
+            return False
+        if self.box_type_ids and info.box_type_id not in self.box_type_ids:
+            return False
+        day = info.date_start[:10]
+        if (self.date_from and day < self.date_from) or (self.date_to and day > self.date_to):
+            return False
+        if self.allow_unload is not None and info.allow_unload != self.allow_unload:
+            return False
+        return True
+
+    def describe(self) -> str:
+        coefficient = f"{self.min_coefficient:g}–{self.max_coefficient:g}"
+        box_types = ", ".join(map(str, sorted(self.box_type_ids))) or "любые"
+        dates = f"{self.date_from or '…'} — {self.date_to or '…'}" if self.date_from or self.date_to else "любые"
+        unload = {None: "не важно", True: "только разрешённая", False: "только запрещённая"}[self.allow_unload]
+        return (
+            f"• Склады: {', '.join(map(str, sorted(self.warehouse_ids)))}\n"
+            f"• Коэффициент: {coefficient}\n"
+            f"• Типы поставки (boxTypeID): {box_types}\n"
+            f"• Даты: {dates}\n"
+            f"• Разгрузка: {unload}"
+        )
+
+
+def parse_rule_args(chat_id: int, args: str, base: SubscriptionRule) -> SubscriptionRule:
+    """
+    Разбирает аргументы команды вида
+    warehouses=206348,158311 coef=0-3 box=2,5 dates=2025-06-13..2025-06-20 unload=да
+    Не указанные параметры берутся из base. При ошибке выбрасывает ValueError с текстом для пользователя
+    """
+    rule = SubscriptionRule.from_filters(chat_id, base.warehouse_ids, base.to_filters())
+    for token in args.split():
+        if "=" not in token:
+            raise ValueError(f"Непонятный параметр «{token}», ожидается ключ=значение")
+        key, value = token.split("=", 1)
+        key = key.lower()
+        if key not in _RULE_KEYS:
+            raise ValueError(f"Неизвестный параметр «{key}»")
+        try:
+            if key in ("warehouses", "склады"):
+                rule.warehouse_ids = frozenset(int(part) for part in value.split(",") if part)
+                if not rule.warehouse_ids:
+                    raise ValueError()
+            elif key in ("coef", "коэф"):
+                # «0-3» — диапазон, «3» — только верхняя граница. Минус в начале границы — знак:
+                # «-1-3» — от -1 (приёмка недоступна) до 3
+                separator = value.find("-", 1)
+                if separator > 0:
+                    rule.min_coefficient = float(value[:separator])
+                    rule.max_coefficient = float(value[separator + 1:])
+                else:
+                    rule.max_coefficient = float(value)
+            elif key in ("box", "короба"):
+                rule.box_type_ids = frozenset() if value in ("*", "any") else frozenset(
+                    int(part) for part in value.split(",") if part)
+            elif key in ("dates", "даты"):
+                date_from, _, date_to = value.partition("..")
+                rule.date_from = date.fromisoformat(date_from).isoformat() if date_from else None
+                rule.date_to = date.fromisoformat(date_to).isoformat() if date_to else None
+            elif key in ("unload", "разгрузка"):
+                answer = value.lower()
+                if answer in _YES:
+                    rule.allow_unload = True
+                elif answer in _NO:
+                    rule.allow_unload = False
+                elif answer in _ANY:
+                    rule.allow_unload = None
+                else:
+                    raise ValueError()
+        except ValueError:
+            # Текст исключения Python («could not convert string to float…») пользователю не показываем
+            raise ValueError(f"Некорректное значение «{value}» для «{key}»") from None
+    if rule.min_coefficient > rule.max_coefficient:
+        raise ValueError("Минимальный коэффициент больше максимального")
+    return rule
+
+
+class CompiledMatcher:
+    """
+    Правила всех подписчиков, разложенные в индекс по warehouse_id.
+    Каждое изменение проверяется только по правилам своего склада, все чаты — за один проход
+    """
+
+    def __init__(self, rules: Iterable[SubscriptionRule]):
+        self.__by_warehouse: Dict[int, List[SubscriptionRule]] = {}
+        for rule in rules:
+            for warehouse_id in rule.warehouse_ids:
+                self.__by_warehouse.setdefault(warehouse_id, []).append(rule)
+
+    def events(self, changes: Iterable[SlotChange]) -> Dict[int, List[SlotEvent]]:
+        """События по каждому чату: chat_id -> список событий"""
+        events: Dict[int, List[SlotEvent]] = {}
+        detected_at = time.monotonic()
+        for change in changes:
+            info = change.current or change.previous
+            for rule in self.__by_warehouse.get(info.warehouse_id, ()):
+                was_matching = change.previous is not None and rule.matches(change.previous)
+                is_matching = change.current is not None and rule.matches(change.current)
+                event = slot_event_for(change, was_matching, is_matching, detected_at)
+                if event is not None:
+                    events.setdefault(rule.chat_id, []).append(event)
+        return events
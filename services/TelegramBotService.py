@@ -1,5 +1,6 @@
 from telegram import Bot
 from config import CHAT_IDs, TELEGRAM_TOKEN1
+from services.TelegramMessageQueue import TelegramMessageQueue
 
 
 class TelegramBotService:
@@ -9,7 +10,8 @@ class TelegramBotService:
 
     def __init__(self):
         self.bot = Bot(token=TELEGRAM_TOKEN1)
+        self.message_queue = TelegramMessageQueue(self.bot.send_message)
 
     async def send_message(self, text):
         for chat_id in CHAT_IDs:
-            await self.bot.send_message(chat_id=chat_id, text=text)
+            self.message_queue.enqueue(chat_id, text)
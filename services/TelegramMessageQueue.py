@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from config import TELEGRAM_GLOBAL_RATE_PER_SEC, TELEGRAM_CHAT_RATE_PER_SEC, TELEGRAM_SEND_MAX_ATTEMPTS
+from modules.metrics_module import SLOT_ALERT_LATENCY
+from modules.rate_limit_module import TokenBucket
+
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+COALESCED_MESSAGES_SEPARATOR = "\n\n"
+
+
+class TelegramMessageQueue:
+    """
+    Класс, отвечающий за исходящие уведомления в Telegram: соблюдает глобальный
+    лимит и лимит на чат, доставляет в разные чаты параллельно, склеивает
+    накопившиеся для одного чата сообщения в одно и учитывает retry_after
+    """
+
+    def __init__(self, send: Callable[[int, str], Awaitable]):
+        self.__send = send
+        self.__global_bucket = TokenBucket(TELEGRAM_GLOBAL_RATE_PER_SEC)
+        self.__chat_buckets: Dict[int, TokenBucket] = {}
+        # Сообщение и момент обнаружения события (time.monotonic), о котором оно сообщает
+        self.__pending: Dict[int, Deque[Tuple[str, Optional[float]]]] = {}
+        self.__workers: Dict[int, asyncio.Task] = {}
+
+    def enqueue(self, chat_id: int, text: str, detected_at: Optional[float] = None):
+        """
+        Ставит сообщение в очередь; отправка произойдёт в фоне.
+        detected_at — когда обнаружено событие, для метрики задержки доставки
+        """
+        self.__pending.setdefault(chat_id, deque()).append((text, detected_at))
+        if chat_id not in self.__workers:
+            self.__workers[chat_id] = asyncio.create_task(self.__chat_worker(chat_id))
+
+    def pending_count(self) -> int:
+        return sum(len(pending) for pending in self.__pending.values())
+
+    async def close(self, timeout: float = 5.0):
+        """Дожидается отправки оставшихся сообщений, но не дольше timeout секунд"""
+        workers = list(self.__workers.values())
+        if workers:
+            _, still_running = await asyncio.wait(workers, timeout=timeout)
+            for worker in still_running:
+                worker.cancel()
+            await asyncio.gather(*still_running, return_exceptions=True)
+
+    async def __chat_worker(self, chat_id: int):
+        pending = self.__pending[chat_id]
+        bucket = self.__chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.__chat_buckets[chat_id] = TokenBucket(TELEGRAM_CHAT_RATE_PER_SEC)
+        try:
+            while pending:
+                await bucket.acquire()
+                await self.__global_bucket.acquire()
+                # Пока ждали лимита, могли накопиться ещё сообщения — отправим их одним
+                batch = self.__take_batch(pending)
+                text = COALESCED_MESSAGES_SEPARATOR.join(text for text, _ in batch)
+                if await self.__deliver(chat_id, text, bucket):
+                    delivered_at = time.monotonic()
+                    for _, detected_at in batch:
+                        if detected_at is not None:
+                            SLOT_ALERT_LATENCY.observe(delivered_at - detected_at)
+        finally:
+            self.__workers.pop(chat_id, None)
+            if not pending:
+                self.__pending.pop(chat_id, None)
+
+    @staticmethod
+    def __take_batch(pending: Deque[Tuple[str, Optional[float]]]) -> List[Tuple[str, Optional[float]]]:
+        batch = [pending.popleft()]
+        length = len(batch[0][0])
+        while pending and length + len(COALESCED_MESSAGES_SEPARATOR) + len(pending[0][0]) <= TELEGRAM_MAX_MESSAGE_LENGTH:
+            item = pending.popleft()
+            length += len(COALESCED_MESSAGES_SEPARATOR) + len(item[0])
+            batch.append(item)
+        return batch
+
+    async def __deliver(self, chat_id: int, text: str, bucket: TokenBucket) -> bool:
+        for attempt in range(1, TELEGRAM_SEND_MAX_ATTEMPTS + 1):
+            try:
+                await self.__send(chat_id, text)
+                return True
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                retry_after = getattr(e, 'retry_after', None)
+                if hasattr(retry_after, 'total_seconds'):
+                    retry_after = retry_after.total_seconds()
+                if attempt == TELEGRAM_SEND_MAX_ATTEMPTS:
+                    logging.error(f"Не удалось отправить сообщение в чат {chat_id}: {e}")
+                    return False
+                delay = float(retry_after) if retry_after else float(attempt)
+                logging.warning(f"Отправка в чат {chat_id} отложена на {delay} сек.: {e}")
+                bucket.block_for(delay)
+                await asyncio.sleep(delay)
@@ -0,0 +1,59 @@
+from typing import Optional
+
+
+class WildberriesApiError(Exception):
+    """
+    Базовая ошибка обращения к API Wildberries
+    """
+
+    def __init__(self, message: str, url: str = '', status: Optional[int] = None, body: str = ''):
+        super().__init__(message)
+        self.url = url
+        self.status = status
+        self.body = body
+
+
+class WildberriesBadRequestError(WildberriesApiError):
+    """400 — неправильный запрос"""
+
+
+class WildberriesUnauthorizedError(WildberriesApiError):
+    """401 — пользователь не авторизован"""
+
+
+class WildberriesForbiddenError(WildberriesApiError):
+    """403 — доступ запрещён; WB может вернуть подробности в теле ответа"""
+
+    def __init__(self, message: str, url: str = '', status: Optional[int] = None, body: str = '',
+                 title: Optional[str] = None, detail: Optional[str] = None,
+                 request_id: Optional[str] = None, origin: Optional[str] = None):
+        super().__init__(message, url, status, body)
+        self.title = title
+        self.detail = detail
+        self.request_id = request_id
+        self.origin = origin
+
+
+class WildberriesRateLimitError(WildberriesApiError):
+    """429 — слишком много запросов"""
+
+    def __init__(self, message: str, url: str = '', status: Optional[int] = None, body: str = '',
+                 retry_after: Optional[float] = None):
+        super().__init__(message, url, status, body)
+        self.retry_after = retry_after
+
+
+class WildberriesServerError(WildberriesApiError):
+    """5xx — ошибка на стороне WB"""
+
+
+class WildberriesConnectionError(WildberriesApiError):
+    """Не удалось соединиться с хостом или истёк таймаут"""
+
+
+class WildberriesCircuitOpenError(WildberriesApiError):
+    """Хост признан недоступным, запросы к нему временно не отправляются"""
+
+    def __init__(self, message: str, url: str = '', retry_in: float = 0.0):
+        super().__init__(message, url)
+        self.retry_in = retry_in
@@ -0,0 +1,63 @@
+from typing import Dict, Iterable, List, Optional
+
+from config import ADMIN_CHAT_IDS
+from services.SellerAccount import SellerAccount, load_seller_accounts
+from services.WildberriesApiService import WildberriesApiService
+
+
+class WildberriesApiRegistry:
+    """
+    Класс, хранящий по экземпляру WildberriesApiService на каждый кабинет продавца:
+    у каждого свои токены, пулы соединений и лимиты запросов.
+    Общие для всех продавцов данные (склады, коэффициенты приёмки) запрашиваются
+    один раз через первый кабинет — shared.
+    Чат получает доступ только к кабинетам, за которыми закреплён; администраторы — ко всем
+    """
+
+    def __init__(self, sellers: Optional[List[SellerAccount]] = None, admin_chat_ids: Iterable[int] = ADMIN_CHAT_IDS):
+        sellers = sellers or load_seller_accounts()
+        self.admin_chat_ids = frozenset(int(chat_id) for chat_id in admin_chat_ids if chat_id)
+        self.shared = WildberriesApiService(sellers[0])
+        self.__services: Dict[str, WildberriesApiService] = {sellers[0].name: self.shared}
+        for seller in sellers[1:]:
+            self.__services[seller.name] = WildberriesApiService(seller, shared=self.shared)
+        self.__chat_sellers: Dict[int, str] = {}
+
+    def names(self) -> List[str]:
+        return list(self.__services)
+
+    def get(self, name: str) -> Optional[WildberriesApiService]:
+        return self.__services.get(name)
+
+    def allowed_names(self, chat_id: int) -> List[str]:
+        """Кабинеты, доступные чату: все — администраторам и при единственном кабинете, иначе закреплённые"""
+        if chat_id in self.admin_chat_ids or len(self.__services) == 1:
+            return self.names()
+        return [name for name, service in self.__services.items() if chat_id in service.seller.chat_ids]
+
+    def for_chat(self, chat_id: int) -> Optional[WildberriesApiService]:
+        """
+        Кабинет чата: выбранный командой, закреплённый в config.SELLERS или первый доступный.
+        None — чату не доступен ни один кабинет
+        """
+        allowed = self.allowed_names(chat_id)
+        name = self.__chat_sellers.get(chat_id)
+        if name in allowed:
+            return self.__services[name]
+        return self.__services[allowed[0]] if allowed else None
+
+    def select(self, chat_id: int, name: str) -> bool:
+        """Переключает чат на кабинет; False — кабинета нет или он чату не доступен"""
+        if name not in self.allowed_names(chat_id):
+            return False
+        self.__chat_sellers[chat_id] = name
+        return True
+
+    def restore_selections(self, chat_sellers: Dict[int, str]):
+        """Восстанавливает выбор кабинетов из StateStore; недоступные кабинеты пропускаются"""
+        for chat_id, name in chat_sellers.items():
+            self.select(chat_id, name)
+
+    async def close(self):
+        for service in self.__services.values():
+            await service.close()
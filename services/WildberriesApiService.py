@@ -1,186 +1,331 @@
-import requests
 import logging
 import aiohttp
 import asyncio
 import json
-from config import SUPPLY_WB_API_KEY, TARGET_WAREHOUSE_ID, ANALYTICS_WB_API_KEY, PROMOTION_WB_API_KEY
-from config import MIN_NEED_COEFFICIENT, MAX_NEED_COEFFICIENT, NEED_BOX_TYPE_ID
+import os
+from config import WAREHOUSES_CACHE_TTL_SEC, REFERENCE_CACHE_PATH
+from config import WB_REQUEST_MAX_RETRIES, WB_RETRY_BASE_DELAY_SEC, WB_RETRY_MAX_DELAY_SEC
+from config import CIRCUIT_BREAKER_FAILURE_THRESHOLD, CIRCUIT_BREAKER_RECOVERY_SEC
+from config import SALES_FUNNEL_REQUESTS_PER_MINUTE, SALES_FUNNEL_BURST, SALES_FUNNEL_CONCURRENCY
+from config import SALES_FUNNEL_NM_IDS_PER_REQUEST, SALES_FUNNEL_DEFAULT_DAYS
+from config import REPORTS_REQUESTS_PER_MINUTE, REPORT_DOWNLOAD_CHUNK_SIZE
+from config import HTTP_CONNECT_TIMEOUT_SEC, HTTP_READ_TIMEOUT_SEC
+from config import RESPONSE_CACHE_TTL_SEC, ACCEPTANCE_COEFFICIENTS_BATCH_WINDOW_SEC, WB_MAX_URL_LENGTH
+from config import ACCEPTANCE_COEFFICIENTS_REQUESTS_PER_MINUTE
 import uuid
+import random
+import time
+from collections import deque
+from datetime import date, datetime, timedelta
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set
+from urllib.parse import urlsplit
+from modules.rate_limit_module import RateLimitState, TokenBucket
+from modules.batching_module import RequestBatcher
+from modules.cache_module import AsyncTtlCache
+from modules.json_module import loads as json_loads
+from modules.circuit_breaker_module import CIRCUIT_HALF_OPEN, CircuitBreaker
+from modules.metrics_module import WB_REQUEST_DURATION, WB_REQUESTS, WB_RATE_LIMITED, WB_REQUEST_ERRORS
+from services.WildberriesApiErrors import WildberriesApiError, WildberriesBadRequestError, WildberriesUnauthorizedError
+from services.WildberriesApiErrors import WildberriesForbiddenError, WildberriesRateLimitError, WildberriesServerError
+from services.WildberriesApiErrors import WildberriesConnectionError, WildberriesCircuitOpenError
+from services.HttpSessionPool import HttpSessionPool
+from services.SellerAccount import SellerAccount, load_seller_accounts
+from services.SubscriptionRules import SubscriptionRule
+from services.WildberriesModels import AcceptanceCoefficient, Advert, Warehouse
+
+# Статусы запросов пишутся в отдельный логгер: он прореживается (config.LOG_SAMPLE_EVERY)
+http_logger = logging.getLogger('wb.http')
+
+ACCEPTANCE_COEFFICIENTS_URL = "https://supplies-api.wildberries.ru/api/v1/acceptance/coefficients"
+SALES_FUNNEL_URL = "https://seller-analytics-api.wildberries.ru/api/v2/nm-report/detail"
+NM_REPORT_DOWNLOADS_URL = "https://seller-analytics-api.wildberries.ru/api/v2/nm-report/downloads"
+
 
 class WildberriesApiService:
     """
-    Класс, отвечающий за взаимодействие с API Wildberries
+    Класс, отвечающий за взаимодействие с API Wildberries от имени одного кабинета продавца.
+    shared — сервис другого кабинета, через который запрашиваются общие для всех продавцов данные
     """
 
-    async def get_acceptance_coefficients(self, warehouse_ids: list = None):
-        """Получение коэффициентов приёмки для складов"""
+    def __init__(self, seller: Optional[SellerAccount] = None, shared: Optional['WildberriesApiService'] = None):
+        self.seller = seller or load_seller_accounts()[0]
+        self.shared = shared
+        self.http_pool = HttpSessionPool()
+        self.__rate_limits: Dict[str, RateLimitState] = {}
+        self.__circuit_breakers: Dict[str, CircuitBreaker] = {}
+        self.reference_cache = AsyncTtlCache(WAREHOUSES_CACHE_TTL_SEC,
+                                             persist_path=REFERENCE_CACHE_PATH if shared is None else None)
+        # Короткоживущий кэш ответов: одновременные одинаковые запросы разделяют один вызов WB
+        self.response_cache = AsyncTtlCache(min(RESPONSE_CACHE_TTL_SEC.values()))
+        self.__indexed_warehouses = None
+        self.__warehouses: List[Warehouse] = []
+        self.__warehouses_by_id: Dict[int, Warehouse] = {}
+        self.__sales_funnel_bucket = TokenBucket(SALES_FUNNEL_REQUESTS_PER_MINUTE / 60, SALES_FUNNEL_BURST)
+        self.__reports_bucket = TokenBucket(REPORTS_REQUESTS_PER_MINUTE / 60, REPORTS_REQUESTS_PER_MINUTE)
+        # Лимит коэффициентов приёмки — на токен: все опросы кабинета берут запросы из одного ведра, без всплесков
+        self.__coefficients_bucket = TokenBucket(ACCEPTANCE_COEFFICIENTS_REQUESTS_PER_MINUTE / 60, 1)
+        # Страницы воронки, запрошенные сверх нужного: завершаются в фоне
+        self.__detached_requests: Set[asyncio.Task] = set()
+        # Склады всех вызывающих за короткое окно запрашиваются вместе; длина URL ограничена
+        self.__coefficients_batcher = RequestBatcher(
+            self.__fetch_acceptance_coefficients, ACCEPTANCE_COEFFICIENTS_BATCH_WINDOW_SEC,
+            WB_MAX_URL_LENGTH - len(f"{ACCEPTANCE_COEFFICIENTS_URL}?warehouseIDs="),
+            key_cost=lambda warehouse_id: len(str(warehouse_id)) + 1)
+
+    def rate_limit_state(self, url: str) -> RateLimitState:
+        """Состояние лимитов хоста по последним ответам"""
+        host = urlsplit(url).netloc
+        state = self.__rate_limits.get(host)
+        if state is None:
+            state = self.__rate_limits[host] = RateLimitState()
+        return state
+
+    def circuit_breaker(self, url: str) -> CircuitBreaker:
+        """Предохранитель хоста"""
+        host = urlsplit(url).netloc
+        breaker = self.__circuit_breakers.get(host)
+        if breaker is None:
+            breaker = self.__circuit_breakers[host] = CircuitBreaker(
+                CIRCUIT_BREAKER_FAILURE_THRESHOLD, CIRCUIT_BREAKER_RECOVERY_SEC)
+        return breaker
+
+    async def __request(self, method: str, url: str, idempotent: bool = True,
+                        consume: Optional[Callable[[aiohttp.ClientResponse], Awaitable[Any]]] = None,
+                        endpoint: Optional[str] = None, **kwargs):
+        """
+        Единая точка выполнения HTTP-запросов ко всем API Wildberries.
+        Возвращает разобранный JSON (или результат consume для успешного ответа),
+        при ошибке выбрасывает WildberriesApiError.
+        429, 5xx и сетевые ошибки повторяются с экспоненциальной задержкой
+        (для неидемпотентных запросов — только 429, когда WB точно не выполнил запрос).
+        endpoint — имя метода в метриках, по умолчанию путь URL
+        """
+        breaker = self.circuit_breaker(url)
+        rate_limit = self.rate_limit_state(url)
+        endpoint = endpoint or urlsplit(url).path
+        # Общий ID для всех попыток одного запроса — чтобы в журнале связать повторы
+        request_id = uuid.uuid4().hex[:12]
+
+        for attempt in range(WB_REQUEST_MAX_RETRIES + 1):
+            if not breaker.allow_request():
+                WB_REQUEST_ERRORS.inc(endpoint=endpoint, reason="circuit_open")
+                raise WildberriesCircuitOpenError(
+                    f"Хост {urlsplit(url).netloc} временно недоступен", url, retry_in=breaker.retry_in())
+            # В состоянии HALF_OPEN предохранитель пропускает только пробный запрос — этот
+            probe = breaker.state == CIRCUIT_HALF_OPEN
+
+            session = self.http_pool.get_session(url)
+            started_at = time.monotonic()
+            try:
+                async with session.request(method, url, **kwargs) as response:
+                    WB_REQUESTS.inc(endpoint=endpoint, status=str(response.status))
+                    rate_limit.record_response(response.status, response.headers)
+                    http_logger.info(f"API status: {response.status} ({method} {url})", extra={
+                        'request_id': request_id, 'endpoint': endpoint, 'status': response.status,
+                        'attempt': attempt + 1, 'latency_ms': round((time.monotonic() - started_at) * 1000, 1)})
+                    if response.status < 400:
+                        breaker.record_success()
+                        if consume is not None:
+                            return await consume(response)
+                        # JSON разбирается прямо из байтов, без декодирования в строку
+                        body = await response.read()
+                        try:
+                            return json_loads(body) if body.strip() else None
+                        except ValueError as e:
+                            WB_REQUEST_ERRORS.inc(endpoint=endpoint, reason="invalid_json")
+                            raise WildberriesApiError(f"Некорректный JSON в ответе: {e}", url, response.status)
+                    error = await self.__error_from_response(url, response)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                WB_REQUESTS.inc(endpoint=endpoint, status="error")
+                WB_REQUEST_ERRORS.inc(endpoint=endpoint, reason="connection")
+                rate_limit.record_failure()
+                error = WildberriesConnectionError(f"Ошибка подключения: {e!r} (запрос {request_id})", url)
+            except BaseException:
+                # Отмена или непредвиденная ошибка не должны оставить предохранитель в HALF_OPEN навсегда
+                if probe:
+                    breaker.release_probe()
+                raise
+            finally:
+                WB_REQUEST_DURATION.observe(time.monotonic() - started_at, endpoint=endpoint)
+
+            if isinstance(error, WildberriesRateLimitError):
+                WB_RATE_LIMITED.inc(endpoint=endpoint)
+            elif isinstance(error, WildberriesServerError):
+                WB_REQUEST_ERRORS.inc(endpoint=endpoint, reason="server")
+            elif not isinstance(error, WildberriesConnectionError):
+                WB_REQUEST_ERRORS.inc(endpoint=endpoint, reason="client")
+
+            if isinstance(error, (WildberriesServerError, WildberriesConnectionError)):
+                breaker.record_failure()
+            else:
+                # Хост ответил осмысленной ошибкой (в том числе 429) — он доступен
+                breaker.record_success()
+                if not isinstance(error, WildberriesRateLimitError):
+                    # Повторять бессмысленно
+                    raise error
+
+            retryable = isinstance(error, WildberriesRateLimitError) or idempotent
+            if not retryable or attempt == WB_REQUEST_MAX_RETRIES:
+                raise error
+
+            delay = min(WB_RETRY_MAX_DELAY_SEC, WB_RETRY_BASE_DELAY_SEC * 2 ** attempt)
+            delay = max(random.uniform(delay / 2, delay), rate_limit.seconds_until_allowed())
+            logging.warning(f"{error}. Повтор через {delay:.1f} сек. ({attempt + 1}/{WB_REQUEST_MAX_RETRIES})")
+            await asyncio.sleep(delay)
+
+    async def __cached_request(self, endpoint: str, method: str, url: str, **kwargs):
+        """
+        __request через кэш ответов: пока запрос выполняется, такие же запросы ждут его результата,
+        после — получают сохранённый ответ в течение RESPONSE_CACHE_TTL_SEC[endpoint]
+        """
+        key = json.dumps([method, url, kwargs.get('params'), kwargs.get('json')], sort_keys=True, default=str)
+        return await self.response_cache.get_or_load(key, lambda: self.__request(method, url, **kwargs),
+                                                     RESPONSE_CACHE_TTL_SEC[endpoint])
+
+    @staticmethod
+    async def __error_from_response(url: str, response: aiohttp.ClientResponse) -> WildberriesApiError:
+        status = response.status
+        body = await response.text()
+        if status == 400:
+            return WildberriesBadRequestError(f"Неправильный запрос: {body}", url, status, body)
+        if status == 401:
+            return WildberriesUnauthorizedError("Пользователь не авторизован", url, status, body)
+        if status == 403:
+            try:
+                details = json.loads(body)
+            except ValueError:
+                details = {}
+            if not isinstance(details, dict):
+                details = {}
+            return WildberriesForbiddenError(
+                f"Доступ запрещен: {body}", url, status, body,
+                title=details.get('title'), detail=details.get('detail'),
+                request_id=details.get('requestId'), origin=details.get('origin'))
+        if status == 429:
+            retry_after = response.headers.get('X-Ratelimit-Retry') or response.headers.get('Retry-After')
+            try:
+                retry_after = float(retry_after) if retry_after is not None else None
+            except ValueError:
+                retry_after = None
+            return WildberriesRateLimitError("Слишком много запросов", url, status, body, retry_after=retry_after)
+        if status >= 500:
+            return WildberriesServerError(f"Ошибка сервера WB: {status} - {body}", url, status, body)
+        return WildberriesApiError(f"Произошла ошибка: {status} - {body}", url, status, body)
+
+    async def get_warehouses(self) -> List[Warehouse]:
+        """Список складов WB; кэшируется на WAREHOUSES_CACHE_TTL_SEC, в том числе на диске"""
+        if self.shared is not None:
+            return await self.shared.get_warehouses()
+
+        async def load():
+            # Пустой список не кэшируем — скорее всего, это сбой на стороне WB
+            return await self.__get_warehouses() or None
+
+        # В кэше хранится ответ WB как есть; модели и индекс перестраиваются только при его обновлении
+        raw_warehouses = await self.reference_cache.get_or_load('warehouses', load) or []
+        if raw_warehouses is not self.__indexed_warehouses:
+            self.__warehouses = [Warehouse.from_api(item) for item in raw_warehouses]
+            self.__warehouses_by_id = {wh.id: wh for wh in self.__warehouses}
+            self.__indexed_warehouses = raw_warehouses
+        return self.__warehouses
+
+    async def get_warehouses_by_id(self) -> Dict[int, Warehouse]:
+        """Индекс складов по ID, перестраивается только при обновлении списка"""
+        if self.shared is not None:
+            return await self.shared.get_warehouses_by_id()
+        await self.get_warehouses()
+        return self.__warehouses_by_id
+
+    async def close(self):
+        """Закрывает пул HTTP-сессий"""
+        await self.__coefficients_batcher.close()
+        await self.http_pool.close()
+
+    async def get_acceptance_coefficients(self, warehouse_ids: list = None) -> List[AcceptanceCoefficient]:
+        """
+        Получение коэффициентов приёмки для складов. Запросы разных вызывающих,
+        пришедшие за ACCEPTANCE_COEFFICIENTS_BATCH_WINDOW_SEC, объединяются в общие запросы к WB
+        """
+        if self.shared is not None:
+            return await self.shared.get_acceptance_coefficients(warehouse_ids)
         # Если warehouse_ids пустой или None - возвращаем пустой список
         if not warehouse_ids:
             return []
 
-        url = "https://supplies-api.wildberries.ru/api/v1/acceptance/coefficients"
-        params = {'warehouseIDs': ','.join(map(str, warehouse_ids))}  # Всегда список
+        by_warehouse = await self.__coefficients_batcher.get(warehouse_ids)
+        coefficients = [info for warehouse_id in warehouse_ids for info in by_warehouse[warehouse_id]]
+        if not coefficients:
+            logging.warning(f"Получен пустой ответ от API коэффициентов для складов {warehouse_ids}")
+        return coefficients
+
+    async def __fetch_acceptance_coefficients(self, warehouse_ids: List[int]) -> Dict[int, List[AcceptanceCoefficient]]:
+        """Один запрос к WB за пачкой складов; ответ раскладывается по складам"""
+        params = {'warehouseIDs': ','.join(map(str, warehouse_ids))}
         headers = {
-            "Authorization": f"Bearer {SUPPLY_WB_API_KEY}",
+            "Authorization": f"Bearer {self.seller.supply_api_key}",
             "Content-Type": "application/json"
         }
-
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, params=params, headers=headers) as response:
-                    logging.info(f"API status: {response.status}")
-
-                    if response.status != 200:
-                        error_text = await response.text()
-                        logging.error(f"API error: {response.status}, body: {error_text}")
-                        return []
-
-                    data = await response.json()
-
-                    if not data:
-                        logging.warning("Получен пустой ответ от API коэффициентов")
-                        return []
-
-                    formatted_data = []
-                    for item in data:
-                        formatted_data.append({
-                            'warehouse_id': item.get('warehouseId'),
-                            'warehouse_name': item.get('warehouseName'),
-                            'coefficient': str(item.get('coefficient', 'N/A')),
-                            'date_start': item.get('dateStart', 'N/A'),
-                            'box_type_name': item.get('boxTypeName', 'Не указан'),
-                            'allow_unload': item.get('allowUnload', False)
-                        })
-
-                    return formatted_data
-
-        except aiohttp.ClientError as e:
-            logging.error(f"Ошибка подключения: {str(e)}")
-            return []
-        except Exception as e:
-            logging.exception(f"Неожиданная ошибка: {str(e)}")
-            return []
-
-    async def run_periodic_coefficients_check(self, bot, chat_id, warehouse_ids):
-        TARGET_WAREHOUSE_ID = 206348
-        while True:
-            try:
-                coefficients = await self.get_acceptance_coefficients(warehouse_ids)
-                if coefficients:
-                    for info in coefficients:
-                        # Проверяем условия и преобразуем коэффициент в число
-                        if (info['warehouse_id'] == TARGET_WAREHOUSE_ID and
-                                float(info['coefficient']) <= 3.0 and
-                                "Короба" in info['box_type_name']):
-                            # Форматируем дату для лучшей читаемости
-                            date_start = info['date_start'].replace('T', ' ').replace('Z', '')
-
-                            message = (
-                                f"Склад: {info['warehouse_name']}\n"
-                                f"ID: {info['warehouse_id']}, "
-                                f"Коэффициент: {info['coefficient']}, "
-                                f"Дата начала: {date_start}, "
-                                f"Тип поставки: {info['box_type_name']}\n"
-                                "Дополнительная информация: https://seller.wildberries.ru/supplies-management/all-supplies"
-                            )
-                            await bot.send_message(chat_id, message)
-                            logging.info(f"Отправлено сообщение: {message}")
-                await asyncio.sleep(12)
-            except Exception as e:
-                logging.exception(f"Ошибка в периодической проверке: {str(e)}")
-                await asyncio.sleep(30)
-
-
-
-
-    async def check_target_warehouse_with_low_coefficients(self):
-        warehouses = self.__get_warehouses()
+        await self.__coefficients_bucket.acquire()
+        data = await self.__request("GET", ACCEPTANCE_COEFFICIENTS_URL, params=params, headers=headers)
+
+        by_warehouse: Dict[int, List[AcceptanceCoefficient]] = {warehouse_id: [] for warehouse_id in warehouse_ids}
+        for item in data or []:
+            info = AcceptanceCoefficient.from_api(item)
+            if info.warehouse_id in by_warehouse:
+                by_warehouse[info.warehouse_id].append(info)
+        return by_warehouse
+
+    async def check_target_warehouse_with_low_coefficients(
+            self, rule: SubscriptionRule = None) -> List[AcceptanceCoefficient]:
+        """Разовая проверка складов из правила (по умолчанию — из config.py)"""
+        if self.shared is not None:
+            return await self.shared.check_target_warehouse_with_low_coefficients(rule)
+        rule = rule or SubscriptionRule.default()
+        warehouses_by_id = await self.get_warehouses_by_id()
         low_coefficient_info = []
 
-        warehouse = next((wh for wh in warehouses if wh['ID'] == TARGET_WAREHOUSE_ID), None)
-
-        if warehouse:
-            warehouse_id = warehouse['ID']
-            warehouse_name = warehouse['name']
-            logging.info(f"Проверяем склад: {warehouse_name} с ID: {warehouse_id}")
-
-            coefficients = self.__get_acceptance_coefficients(warehouse_id)
-
-            for coefficient_info in coefficients:
-                coefficient = coefficient_info.get("coefficient", 0)
-                box_type_id = coefficient_info.get("boxTypeID", None)
-                box_type_name = coefficient_info.get("boxTypeName", "")
-
-                if (MAX_NEED_COEFFICIENT >= coefficient >= MIN_NEED_COEFFICIENT) and (
-                        box_type_id == NEED_BOX_TYPE_ID) and (
-                        "QR-поставка" not in box_type_name):
-                    date_start = coefficient_info.get("date", "Не указана")
-                    low_coefficient_info.append({
-                        "warehouse_id": warehouse_id,
-                        "warehouse_name": warehouse_name,
-                        "date_start": date_start,
-                        "coefficient": coefficient,
-                        "box_type_name": box_type_name,
-                    })
-                    logging.warning(f"Низкий коэффициент найден: {coefficient}")
+        target_warehouses = [warehouses_by_id[wh_id] for wh_id in sorted(rule.warehouse_ids) if wh_id in warehouses_by_id]
+        for warehouse in target_warehouses:
+            logging.info(f"Проверяем склад: {warehouse.name} с ID: {warehouse.id}")
+        # Коэффициенты по всем целевым складам приходят общим запросом
+        coefficients = await self.get_acceptance_coefficients([warehouse.id for warehouse in target_warehouses])
+
+        for info in coefficients:
+            if rule.matches(info) and "QR-поставка" not in info.box_type_name:
+                low_coefficient_info.append(info)
+                logging.warning(f"Низкий коэффициент найден: {info.coefficient}")
         return low_coefficient_info
-    @staticmethod
-    async def get_hidden_products():
+
+    async def get_hidden_products(self):
         url = 'https://seller-analytics-api.wildberries.ru/api/v1/analytics/banned-products/shadowed'
         headers = {
-            'Authorization': ANALYTICS_WB_API_KEY,
+            'Authorization': self.seller.analytics_api_key,
         }
         params = {
             'sort': 'your_sort_value',
             'order': 'asc'
         }
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, params=params) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    hidden_products = data.get("data", [])
-                    if hidden_products:
-                        message = "Список скрытых товаров:\n"
-                        for product in hidden_products:
-                            message += f"ID: {product.get('id')}, Название: {product.get('name')}\n"
-                        return message
-                    else:
-                        return "Скрытых товаров не найдено."
-                else:
-                    error_message = await response.text()
-                    logging.error(f"Ошибка при получении данных: {response.status}, {error_message}")
-                    return f"Ошибка при получении данных: {response.status}, {error_message}"
-
-    @staticmethod
-    def __get_warehouses():
-        url = "https://supplies-api.wildberries.ru/api/v1/warehouses"
-        headers = {
-            'Authorization': f'Bearer {SUPPLY_WB_API_KEY}'
-        }
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            return response.json()
+        data = await self.__cached_request('hidden_products', "GET", url, headers=headers, params=params)
+        hidden_products = (data or {}).get("data", [])
+        if hidden_products:
+            message = "Список скрытых товаров:\n"
+            for product in hidden_products:
+                message += f"ID: {product.get('id')}, Название: {product.get('name')}\n"
+            return message
         else:
-            logging.error("Ошибка при получении списка складов:")
-            return []
+            return "Скрытых товаров не найдено."
 
-    @staticmethod
-    def __get_acceptance_coefficients(warehouse_id):
-        url = f"https://supplies-api.wildberries.ru/api/v1/acceptance/coefficients?warehouseIDs={warehouse_id}"
+    async def __get_warehouses(self):
+        url = "https://supplies-api.wildberries.ru/api/v1/warehouses"
         headers = {
-            'Authorization': f'Bearer {SUPPLY_WB_API_KEY}'
+            'Authorization': f'Bearer {self.seller.supply_api_key}'
         }
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            logging.error(f"Ошибка при получении коэффициентов для склада {warehouse_id}: {response.status_code}")
-            return []
+        return await self.__request("GET", url, headers=headers) or []
 
     async def getting_product_search_queries(self):
         headers = {
-            'Authorization': f'Bearer {ANALYTICS_WB_API_KEY}',
+            'Authorization': f'Bearer {self.seller.analytics_api_key}',
             'Content-Type': 'application/json'
         }
 
@@ -203,34 +348,12 @@ class WildberriesApiService:
 
         url = "https://seller-analytics-api.wildberries.ru/api/v2/search-report/product/search-texts"
 
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers=headers, json=data) as response:
-                    if response.status == 200:
-                        return await response.json()
-                    elif response.status == 400:
-                        return f"Неправильный запрос: {await response.text()}"
-                    elif response.status == 401:
-                        return "Пользователь не авторизован"
-                    elif response.status == 403:
-                        error_response = await response.json()
-                        if 'title' in error_response and 'detail' in error_response and 'requestId' in error_response and 'origin' in error_response:
-                            return f"Доступ запрещен. Заголовок ошибки: {error_response['title']}, Детали ошибки: {error_response['detail']}, Уникальный ID запроса: {error_response['requestId']}, ID внутреннего сервиса WB: {error_response['origin']}"
-                        else:
-                            return f"Доступ запрещен: {await response.text()}"
-                    elif response.status == 429:
-                        return "Слишком много запросов"
-                    else:
-                        return f"Произошла ошибка: {response.status} - {await response.text()}"
-
-        except Exception as e:
-            logging.error(f"Ошибка при получении данных: {e}")
-            return f"Ошибка при получении данных: {e}"
+        return await self.__cached_request('product_search_queries', "POST", url, headers=headers, json=data)
 
 #Статистика по ключевым фразам
     async def get_keyword_stats(self):
         headers = {
-            'Authorization': f'Bearer {PROMOTION_WB_API_KEY}'
+            'Authorization': f'Bearer {self.seller.promotion_api_key}'
         }
         params = {  # Параметры запроса передаются через params, а не json
             'advert_id': 132681,
@@ -239,140 +362,202 @@ class WildberriesApiService:
         }
         url = 'https://advert-api.wildberries.ru/adv/v0/stats/keywords'
 
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=headers, params=params) as response:  # Используем GET
-                    if response.status == 200:
-                        return await response.json()
-                    elif response.status == 400:
-                        return f"Неправильный запрос: {await response.text()}"
-                    elif response.status == 401:
-                        return "Пользователь не авторизован"
-                    elif response.status == 403:
-                        error_response = await response.json()
-                        if 'title' in error_response and 'detail' in error_response and 'requestId' in error_response and 'origin' in error_response:
-                            return f"Доступ запрещен. Заголовок ошибки: {error_response['title']}, Детали ошибки: {error_response['detail']}, Уникальный ID запроса: {error_response['requestId']}, ID внутреннего сервиса WB: {error_response['origin']}"
-                        else:
-                            return f"Доступ запрещен: {await response.text()}"
-                    elif response.status == 429:
-                        return "Слишком много запросов"
-                    else:
-                        return f"Произошла ошибка: {response.status} - {await response.text()}"
-        except Exception as e:
-            logging.error(f"Ошибка при получении данных: {e}")
-            return f"Ошибка при получении данных: {e}"
+        return await self.__cached_request('keyword_stats', "GET", url, headers=headers, params=params)
 
 #Статистика карточек товаров за период
-    async def get_sales_funnel(self):
+    async def get_sales_funnel(self, nm_ids: Optional[List[int]] = None, begin: Optional[datetime] = None,
+                               end: Optional[datetime] = None, page: int = 1) -> dict:
+        """Одна страница воронки продаж: {'page', 'isNextPage', 'cards'}. Пустой nm_ids — все карточки продавца"""
+        # Лимит эндпоинта общий для всех страниц, поэтому ждём токен до отправки запроса
+        await self.__sales_funnel_bucket.acquire()
+        return await self.__post_sales_funnel_page(nm_ids, begin, end, page)
+
+    async def __post_sales_funnel_page(self, nm_ids: Optional[List[int]], begin: Optional[datetime],
+                                       end: Optional[datetime], page: int) -> dict:
         headers = {
-            'Authorization': f'Bearer {ANALYTICS_WB_API_KEY}',
+            'Authorization': f'Bearer {self.seller.analytics_api_key}',
             'Content-Type': 'application/json'
         }
 
+        end = end or datetime.now()
+        begin = begin or end - timedelta(days=SALES_FUNNEL_DEFAULT_DAYS)
         data = {
             'brandNames': [],
             'objectIDs': [],
             'tagIDs': [],
-            'nmIDs': [310364796],
+            'nmIDs': list(nm_ids or []),
             'timezone': '',
             'period': {
-                'begin': '2025-03-01 00:00:00',
-                'end': '2025-03-10 23:59:59'
+                'begin': begin.strftime('%Y-%m-%d %H:%M:%S'),
+                'end': end.strftime('%Y-%m-%d %H:%M:%S')
             },
             'orderBy': {
                 'field': 'openCard',
                 'mode': 'asc'
             },
-            'page': 1
+            'page': page
         }
 
-        url = 'https://seller-analytics-api.wildberries.ru/api/v2/nm-report/detail'
+        response = await self.__request("POST", SALES_FUNNEL_URL, headers=headers, json=data)
+        return (response or {}).get('data') or {}
+
+    async def iter_sales_funnel(self, nm_ids: Optional[List[int]] = None, begin: Optional[datetime] = None,
+                                end: Optional[datetime] = None,
+                                concurrency: int = SALES_FUNNEL_CONCURRENCY) -> AsyncIterator[dict]:
+        """
+        Карточки воронки продаж по одной, со всех страниц и для любого числа артикулов.
+        Артикулы делятся на пачки по SALES_FUNNEL_NM_IDS_PER_REQUEST, в памяти одновременно
+        не больше concurrency страниц
+        """
+        nm_ids = list(nm_ids or [])
+        end = end or datetime.now()
+        begin = begin or end - timedelta(days=SALES_FUNNEL_DEFAULT_DAYS)
+        batches = [nm_ids[i:i + SALES_FUNNEL_NM_IDS_PER_REQUEST]
+                   for i in range(0, len(nm_ids), SALES_FUNNEL_NM_IDS_PER_REQUEST)] or [[]]
+        for batch in batches:
+            async for card in self.__iter_sales_funnel_pages(batch, begin, end, concurrency):
+                yield card
+
+    async def __iter_sales_funnel_pages(self, nm_ids: List[int], begin: datetime, end: datetime,
+                                        concurrency: int) -> AsyncIterator[dict]:
+        pending = deque()
+        # Задачи страниц, чей запрос уже отправлен (токен лимита получен)
+        sent = set()
+
+        async def fetch_page(page: int) -> dict:
+            await self.__sales_funnel_bucket.acquire()
+            sent.add(asyncio.current_task())
+            return await self.__post_sales_funnel_page(nm_ids, begin, end, page)
+
+        def drop_pending():
+            # Ещё не отправленные запросы отменяются — лимит не тратится; отправленные не прерываются,
+            # а завершаются в фоне: отмена посреди запроса ничего не экономит
+            for task in pending:
+                if task in sent:
+                    self.__detach(task)
+                else:
+                    task.cancel()
+            pending.clear()
 
+        next_page = 1
+        has_next_page = True
+        # Первая страница запрашивается одна: чаще всего она же и последняя, а лимит метода — 3 запроса в минуту
+        window = 1
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers=headers, json=data) as response:
-                    if response.status == 200:
-                        return await response.json()
-                    elif response.status == 400:
-                        return f"Неправильный запрос: {await response.text()}"
-                    elif response.status == 401:
-                        return "Пользователь не авторизован"
-                    elif response.status == 403:
-                        return "Доступ запрещен"
-                    elif response.status == 429:
-                        return "Слишком много запросов"
-                    else:
-                        return f"Произошла ошибка: {response.status} - {await response.text()}"
-
-        except Exception as e:
-            logging.error(f"Ошибка при получении данных: {e}")
-            return f"Ошибка при получении данных: {e}"
-    async def create_report(self):
+            while has_next_page or pending:
+                # Следующие страницы уже запрошены, пока потребитель разбирает текущую
+                while has_next_page and len(pending) < window:
+                    pending.append(asyncio.create_task(fetch_page(next_page)))
+                    next_page += 1
+
+                data = await pending.popleft()
+                cards = data.get('cards') or []
+                for card in cards:
+                    yield card
+
+                if has_next_page and not (data.get('isNextPage') and cards):
+                    # Страница последняя — запрошенные сверх неё не нужны
+                    has_next_page = False
+                    drop_pending()
+                else:
+                    window = concurrency
+        finally:
+            drop_pending()
+
+    def __detach(self, task: asyncio.Task):
+        """Оставляет запрос завершаться в фоне, не дожидаясь его; результат отбрасывается"""
+        # Ссылка нужна, чтобы задачу не собрал сборщик мусора до завершения
+        self.__detached_requests.add(task)
+        task.add_done_callback(self.__forget_detached)
+
+    def __forget_detached(self, task: asyncio.Task):
+        self.__detached_requests.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.info(f"Фоновый запрос завершился ошибкой: {task.exception()}")
+
+    async def create_report(self, nm_ids: Optional[List[int]] = None, start_date: Optional[date] = None,
+                            end_date: Optional[date] = None, name: str = 'My_First_Report') -> str:
+        """Заказывает отчёт DETAIL_HISTORY_REPORT и возвращает его ID"""
         headers = {
-            'Authorization': f'Bearer {ANALYTICS_WB_API_KEY}',
+            'Authorization': f'Bearer {self.seller.analytics_api_key}',
             'Content-Type': 'application/json'
         }
+        end_date = end_date or date.today()
+        start_date = start_date or end_date - timedelta(days=SALES_FUNNEL_DEFAULT_DAYS)
         report_id = str(uuid.uuid4())
         data = {
             'id': report_id,
             'reportType': 'DETAIL_HISTORY_REPORT',
-            'userReportName': 'My_First_Report',
+            'userReportName': name,
 
             'params': {
-                'nmIDs': [310364796],
+                'nmIDs': list(nm_ids or []),
                 'subjectIds': [],
                 'brandNames': [],
                 'tagIds': [],
-                'startDate': '2025-03-01',
-                'endDate': '2025-03-27',
+                'startDate': start_date.isoformat(),
+                'endDate': end_date.isoformat(),
                 'timezone': 'Europe/Moscow',
                 'aggregationLevel': 'day',
                 'skipDeletedNm': False
             }
         }
 
-        url = 'https://seller-analytics-api.wildberries.ru/api/v2/nm-report/downloads'
-
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers=headers, json=data) as response:
-                    if response.status == 200:
-                        return await response.json()
-                    elif response.status == 400:
-                        return f"Неправильный запрос: {await response.text()}"
-                    elif response.status == 401:
-                        return "Пользователь не авторизован"
-                    elif response.status == 403:
-                        return "Доступ запрещен"
-                    elif response.status == 429:
-                        return "Слишком много запросов"
-                    else:
-                        return f"Произошла ошибка: {response.status} - {await response.text()}"
-
-        except Exception as e:
-            logging.error(f"Ошибка при получении данных: {e}")
-            return f"Ошибка при получении данных: {e}"
+        await self.__reports_bucket.acquire()
+        await self.__request("POST", NM_REPORT_DOWNLOADS_URL, idempotent=False, headers=headers, json=data)
+        return report_id
+
+    async def get_report_status(self, report_id: str) -> Optional[dict]:
+        """Состояние отчёта: {'id', 'status', 'name', 'size', ...}; None, если WB его не знает"""
+        headers = {'Authorization': f'Bearer {self.seller.analytics_api_key}'}
+        await self.__reports_bucket.acquire()
+        response = await self.__request("GET", NM_REPORT_DOWNLOADS_URL, headers=headers,
+                                        params={'filter[downloadIds]': report_id})
+        for report in (response or {}).get('data') or []:
+            if report.get('id') == report_id:
+                return report
+        return None
+
+    async def download_report(self, report_id: str, path: str) -> int:
+        """Скачивает архив отчёта в файл частями, не держа ответ в памяти. Возвращает размер в байтах"""
+        headers = {'Authorization': f'Bearer {self.seller.analytics_api_key}'}
+        url = f"{NM_REPORT_DOWNLOADS_URL}/file/{report_id}"
+
+        async def save(response: aiohttp.ClientResponse) -> int:
+            # При повторе после обрыва файл перезаписывается с начала.
+            # Диск может быть медленным, поэтому открытие, запись и закрытие идут в рабочем потоке
+            size = 0
+            file = await asyncio.to_thread(open, path, 'wb')
+            try:
+                async for chunk in response.content.iter_chunked(REPORT_DOWNLOAD_CHUNK_SIZE):
+                    await asyncio.to_thread(file.write, chunk)
+                    size += len(chunk)
+            finally:
+                await asyncio.to_thread(file.close)
+            return size
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        await self.__reports_bucket.acquire()
+        # ID отчёта в пути не попадает в метрики, иначе у каждого отчёта был бы свой ряд
+        endpoint = f"{urlsplit(NM_REPORT_DOWNLOADS_URL).path}/file"
+        return await self.__request("GET", url, consume=save, endpoint=endpoint, headers=headers,
+                                    timeout=aiohttp.ClientTimeout(total=None, sock_connect=HTTP_CONNECT_TIMEOUT_SEC,
+                                                                  sock_read=HTTP_READ_TIMEOUT_SEC))
 
     async def get_adverts(self):
         url = "https://advert-api.wildberries.ru/adv/v0/adverts"
         headers = {
-            "Authorization": f"Bearer {PROMOTION_WB_API_KEY}"
+            "Authorization": f"Bearer {self.seller.promotion_api_key}"
         }
 
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=headers) as response:
-                    if response.status == 200:
-                        adverts = await response.json() or []  # Если API вернул None, делаем пустой список
-
-                        if not adverts:  # Проверяем, есть ли кампании
-                            return "У вас нет активных рекламных кампаний."
-
-                        # Формируем строку со списком кампаний
-                        adverts_list = "\n".join(f"📢 {adv['name']} (ID: {adv['id']})" for adv in adverts)
-                        return f"Кампании:\n{adverts_list}"
-
-                    else:
-                        return f"Ошибка {response.status}: {await response.text()}"
-        except Exception as e:
-            return f"Ошибка: {e}"
\ No newline at end of file
+        raw_adverts = await self.__cached_request('adverts', "GET", url, headers=headers) or []  # Если API вернул None, делаем пустой список
+        adverts = [Advert.from_api(item) for item in raw_adverts]
+
+        if not adverts:  # Проверяем, есть ли кампании
+            return "У вас нет активных рекламных кампаний."
+
+        # Формируем строку со списком кампаний
+        adverts_list = "\n".join(f"📢 {adv.name} (ID: {adv.id})" for adv in adverts)
+        return f"Кампании:\n{adverts_list}"
@@ -0,0 +1,77 @@
+from typing import Optional
+
+
+def _to_float(value, default: float) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class AcceptanceCoefficient:
+    """
+    Коэффициент приёмки одного слота: склад, дата, тип поставки.
+    coefficient всегда число; -1 — приёмка недоступна
+    """
+    __slots__ = ('warehouse_id', 'warehouse_name', 'coefficient', 'date_start', 'box_type_id', 'box_type_name',
+                 'allow_unload')
+
+    def __init__(self, warehouse_id: int, warehouse_name: str, coefficient: float, date_start: str,
+                 box_type_id: Optional[int], box_type_name: str, allow_unload: bool):
+        self.warehouse_id = warehouse_id
+        self.warehouse_name = warehouse_name
+        self.coefficient = coefficient
+        self.date_start = date_start
+        self.box_type_id = box_type_id
+        self.box_type_name = box_type_name
+        self.allow_unload = allow_unload
+
+    @classmethod
+    def from_api(cls, item: dict) -> 'AcceptanceCoefficient':
+        return cls(
+            item.get('warehouseID', item.get('warehouseId')),
+            item.get('warehouseName', ''),
+            _to_float(item.get('coefficient'), -1.0),
+            item.get('date') or item.get('dateStart') or '',
+            item.get('boxTypeID'),
+            item.get('boxTypeName') or 'Не указан',
+            bool(item.get('allowUnload', False)),
+        )
+
+    def replace(self, **changes) -> 'AcceptanceCoefficient':
+        """Копия с изменёнными полями"""
+        values = {name: getattr(self, name) for name in self.__slots__}
+        values.update(changes)
+        return AcceptanceCoefficient(**values)
+
+
+class Warehouse:
+    """Склад WB из справочника /api/v1/warehouses"""
+    __slots__ = ('id', 'name', 'address', 'work_time', 'accepts_qr')
+
+    def __init__(self, id: int, name: str, address: str = '', work_time: str = '', accepts_qr: bool = False):
+        self.id = id
+        self.name = name
+        self.address = address
+        self.work_time = work_time
+        self.accepts_qr = accepts_qr
+
+    @classmethod
+    def from_api(cls, item: dict) -> 'Warehouse':
+        return cls(item['ID'], item.get('name', ''), item.get('address', ''), item.get('workTime', ''),
+                   bool(item.get('acceptsQR', False)))
+
+
+class Advert:
+    """Рекламная кампания"""
+    __slots__ = ('id', 'name', 'status', 'type')
+
+    def __init__(self, id: int, name: str, status: Optional[int] = None, type: Optional[int] = None):
+        self.id = id
+        self.name = name
+        self.status = status
+        self.type = type
+
+    @classmethod
+    def from_api(cls, item: dict) -> 'Advert':
+        return cls(item.get('id', item.get('advertId')), item.get('name', ''), item.get('status'), item.get('type'))
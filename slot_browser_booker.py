@@ -3,97 +3,194 @@ from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-import time
 import json
+import logging
+import os
+import threading
+from typing import List, Optional
 
-SUPPLY_ID = "39434885"
-TARGET_DATES = ["13", "14", "15"]  # Дни месяца июня 2025
+from config import BOOKING_SUPPLY_ID, BOOKING_TARGET_DATES, CHROME_PROFILE_PATH
+from modules.booking_calendar_module import calendar_day_xpath
 
-def book_slot_via_browser(cookies_path="cookies.txt"):
-    chrome_options = Options()
-    chrome_options.headless = False  # Отключаем headless для отладки
-    chrome_options.add_argument("--disable-gpu")
-    chrome_options.add_argument("--no-sandbox")
-    chrome_options.add_argument("--disable-dev-shm-usage")
-
-    # ✅ Используем профиль Chrome, где уже авторизован аккаунт Gmail/WB
-    profile_path = "C:/Users/Acer/AppData/Local/Google/Chrome/User Data"
-    chrome_options.add_argument(f"--user-data-dir={profile_path}")
-    chrome_options.add_argument("--profile-directory=Default")  # Профиль по умолчанию
-
-    driver = webdriver.Chrome(options=chrome_options)
-
-    print("📂 Запущен профиль Chrome. Загружаем Google для проверки...")
-    driver.get("https://google.com")
-
-    # Закрыть все лишние вкладки, оставить одну
-    if len(driver.window_handles) > 1:
-        for handle in driver.window_handles[1:]:
-            driver.switch_to.window(handle)
-            driver.close()
-        driver.switch_to.window(driver.window_handles[0])
-    input("🔍 Убедись, что нужный аккаунт авторизован. Нажми Enter для продолжения...")
+SELLER_URL = "https://seller.wildberries.ru"
+SUPPLIES_URL = f"{SELLER_URL}/supplies-management/all-supplies"
 
-    try:
-        print("🔐 Открываем страницу Wildberries")
-        driver.get(f"https://seller.wildberries.ru/supplies-management/all-supplies/supply-detail?preorderId={SUPPLY_ID}&supplyId")
-        print("🌐 Переход на страницу Wildberries поставок")
-        input("⏸ Проверь, действительно ли открылся список поставок. Нажми Enter для продолжения...")
-        time.sleep(3)
-
-        # Проверка авторизации
-        if "login" in driver.current_url or "signin" in driver.current_url:
-            print("❌ Не авторизован. Проверь профиль Chrome")
-            return False
 
-        print("🔍 Переход к управлению поставками")
-        driver.get("https://seller.wildberries.ru/supplies-management/all-supplies")
-        wait = WebDriverWait(driver, 15)
-        time.sleep(5)
+class BookingCancelled(Exception):
+    """Бронирование отменено пользователем"""
 
-        # Клик по кнопке "Запланировать поставку"
-        plan_button = wait.until(EC.element_to_be_clickable((By.XPATH, "//button[contains(text(), 'Запланировать поставку')]")))
-        plan_button.click()
-        time.sleep(2)
 
-        print("📅 Нажимаем 'Запланировать поставку'")
-        book_btn = wait.until(EC.element_to_be_clickable((By.XPATH, "//button[contains(., 'Запланировать поставку')]")))
-        book_btn.click()
-        time.sleep(3)
+class SlotBrowserBooker:
+    """
+    Класс, бронирующий слот поставки через браузер.
+    Chrome запускается один раз и переиспользуется между попытками, пока не вызван close().
+    Все методы блокирующие — вызывать их нужно из рабочего потока, а не из цикла asyncio
+    """
 
-        print("🔄 Поиск доступных слотов на 13–15 июня")
-        calendar_buttons = []
-        for day in TARGET_DATES:
-            try:
-                button = driver.find_element(By.XPATH, f"//button[contains(text(), '{day}') and not(@disabled)]")
-                calendar_buttons.append(button)
-            except Exception as e:
-                print(f"⚠️ Не удалось найти кнопку на {day} июня: {e}")
-                continue
+    def __init__(self, cookies_path: str = "cookies.txt", profile_path: str = CHROME_PROFILE_PATH):
+        self.cookies_path = cookies_path
+        self.profile_path = profile_path
+        self.__driver: Optional[webdriver.Chrome] = None
+        # Один браузер не может обслуживать два потока одновременно
+        self.__lock = threading.Lock()
 
-        for button in calendar_buttons:
+    def warm_up(self):
+        """Заранее запускает браузер с cookies и открывает страницу поставок"""
+        with self.__lock:
             try:
-                print(f"👉 Пробуем выбрать дату: {button.text}")
-                driver.execute_script("arguments[0].scrollIntoView(true);", button)
-                time.sleep(0.5)
-                button.click()
-                time.sleep(1)
-
-                choose_btn = driver.find_element(By.XPATH, "//button[contains(., 'Выбрать')]")
-                choose_btn.click()
-                time.sleep(1)
+                self.__ensure_driver().get(SUPPLIES_URL)
+            except Exception as e:
+                logging.error(f"Не удалось подготовить браузер: {e}")
+                self.__close()
+
+    def book(self, supply_id: str = BOOKING_SUPPLY_ID, target_dates: List[str] = BOOKING_TARGET_DATES,
+             cancel_event: Optional[threading.Event] = None) -> bool:
+        """Одна попытка бронирования. Возвращает True, если слот забронирован"""
+        with self.__lock:
+            return self.__book(supply_id, target_dates, cancel_event or threading.Event())
+
+    def __book(self, supply_id: str, target_dates: List[str], cancel_event: threading.Event) -> bool:
+
+        def pause(seconds: float):
+            # Ожидание, которое прерывается отменой
+            if cancel_event.wait(seconds):
+                raise BookingCancelled()
+
+        driver = self.__ensure_driver()
+        try:
+            logging.info("🔐 Открываем страницу Wildberries")
+            driver.get(f"{SUPPLIES_URL}/supply-detail?preorderId={supply_id}&supplyId")
+            pause(3)
+
+            # Проверка авторизации
+            if "login" in driver.current_url or "signin" in driver.current_url:
+                logging.error("❌ Не авторизован. Проверь профиль Chrome")
+                return False
+
+            logging.info("🔍 Переход к управлению поставками")
+            driver.get(SUPPLIES_URL)
+            wait = WebDriverWait(driver, 15)
+            pause(5)
+
+            # Клик по кнопке "Запланировать поставку"
+            plan_button = wait.until(EC.element_to_be_clickable((By.XPATH, "//button[contains(text(), 'Запланировать поставку')]")))
+            plan_button.click()
+            pause(2)
+
+            logging.info("📅 Нажимаем 'Запланировать поставку'")
+            book_btn = wait.until(EC.element_to_be_clickable((By.XPATH, "//button[contains(., 'Запланировать поставку')]")))
+            book_btn.click()
+            pause(3)
+
+            logging.info(f"🔄 Поиск доступных слотов на даты: {', '.join(target_dates)}")
+            calendar_buttons = []
+            for day in target_dates:
+                try:
+                    button = driver.find_element(By.XPATH, calendar_day_xpath(day))
+                    calendar_buttons.append(button)
+                except Exception as e:
+                    logging.warning(f"⚠️ Не удалось найти кнопку на {day}: {e}")
+                    continue
+
+            for button in calendar_buttons:
+                try:
+                    logging.info(f"👉 Пробуем выбрать дату: {button.text}")
+                    driver.execute_script("arguments[0].scrollIntoView(true);", button)
+                    pause(0.5)
+                    button.click()
+                    pause(1)
+
+                    choose_btn = driver.find_element(By.XPATH, "//button[contains(., 'Выбрать')]")
+                    choose_btn.click()
+                    pause(1)
+
+                    confirm_btn = driver.find_element(By.XPATH, "//button[contains(., 'Запланировать')]")
+                    confirm_btn.click()
+
+                    logging.info(f"✅ Слот успешно забронирован на дату {button.text}.")
+                    return True
+                except BookingCancelled:
+                    raise
+                except Exception as e:
+                    logging.warning(f"⚠️ Не удалось выбрать слот: {e}")
+                    continue
+
+            logging.info("❌ Не удалось забронировать слот на указанные даты.")
+            return False
+        except BookingCancelled:
+            raise
+        except Exception as e:
+            # Браузер мог «умереть» — следующая попытка запустит новый
+            logging.error(f"Ошибка браузера при бронировании: {e}")
+            self.__close()
+            return False
 
-                confirm_btn = driver.find_element(By.XPATH, "//button[contains(., 'Запланировать')]")
-                confirm_btn.click()
+    def close(self):
+        """Закрывает браузер"""
+        with self.__lock:
+            self.__close()
 
-                print(f"✅ Слот успешно забронирован на дату {button.text} июня.")
-                return True
+    def __close(self):
+        if self.__driver is not None:
+            try:
+                self.__driver.quit()
             except Exception as e:
-                print(f"⚠️ Не удалось выбрать слот: {e}")
-                continue
+                logging.warning(f"Не удалось корректно закрыть браузер: {e}")
+            self.__driver = None
+
+    def __ensure_driver(self) -> webdriver.Chrome:
+        if self.__driver is not None:
+            return self.__driver
+
+        chrome_options = Options()
+        chrome_options.headless = False  # Отключаем headless для отладки
+        chrome_options.add_argument("--disable-gpu")
+        chrome_options.add_argument("--no-sandbox")
+        chrome_options.add_argument("--disable-dev-shm-usage")
+
+        # ✅ Используем профиль Chrome, где уже авторизован аккаунт Gmail/WB
+        chrome_options.add_argument(f"--user-data-dir={self.profile_path}")
+        chrome_options.add_argument("--profile-directory=Default")  # Профиль по умолчанию
+
+        driver = webdriver.Chrome(options=chrome_options)
+        logging.info("📂 Запущен профиль Chrome")
+
+        # Закрыть все лишние вкладки, оставить одну
+        if len(driver.window_handles) > 1:
+            for handle in driver.window_handles[1:]:
+                driver.switch_to.window(handle)
+                driver.close()
+            driver.switch_to.window(driver.window_handles[0])
+
+        self.__load_cookies(driver)
+        self.__driver = driver
+        return driver
+
+    def __load_cookies(self, driver: webdriver.Chrome):
+        """Подкладывает сохранённую сессию продавца из cookies.txt, чтобы не проходить авторизацию"""
+        if not self.cookies_path or not os.path.exists(self.cookies_path):
+            return
+        try:
+            with open(self.cookies_path, encoding='utf-8') as file:
+                cookies = json.load(file)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Не удалось прочитать cookies из {self.cookies_path}: {e}")
+            return
+
+        # Cookies можно добавить только для домена открытой страницы
+        driver.get(SELLER_URL)
+        for cookie in cookies:
+            try:
+                driver.add_cookie({key: cookie[key] for key in ('name', 'value', 'domain', 'path') if key in cookie})
+            except Exception as e:
+                logging.warning(f"Cookie {cookie.get('name')} не добавлена: {e}")
+        logging.info(f"🍪 Загружено cookies: {len(cookies)}")
 
-        print("❌ Не удалось забронировать слот на указанные даты.")
-        return False
 
+def book_slot_via_browser(cookies_path="cookies.txt"):
+    """Однократная попытка бронирования с отдельным запуском браузера"""
+    booker = SlotBrowserBooker(cookies_path)
+    try:
+        return booker.book()
     finally:
-        driver.quit()
+        booker.close()
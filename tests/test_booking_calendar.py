@@ -0,0 +1,41 @@
+import pytest
+
+from modules.booking_calendar_module import calendar_day_xpath
+
+html = pytest.importorskip("lxml.html")
+
+CALENDAR = """
+<div class="calendar">
+  <div class="month"><span>Октябрь 2026</span>
+    <button>1</button><button>2</button><button disabled>3</button>
+    <button>12</button><button>20</button><button>22</button>
+  </div>
+  <div class="month"><span>ноябрь 2026</span>
+    <button>1</button><button>2</button><button>3</button>
+  </div>
+  <div class="month"><span>Май 2027</span>
+    <button>2</button>
+  </div>
+</div>
+"""
+
+
+def _find(target: str):
+    document = html.fromstring(CALENDAR)
+    return [(button.getparent()[0].text, button.text) for button in document.xpath(calendar_day_xpath(target))]
+
+
+def test_day_is_matched_exactly():
+    assert ('Октябрь 2026', '12') not in _find("2")
+    assert ('Октябрь 2026', '22') not in _find("2")
+    assert ('Октябрь 2026', '20') not in _find("2")
+
+
+def test_full_date_matches_only_its_month():
+    assert _find("2026-10-02") == [('Октябрь 2026', '2')]
+    assert _find("2026-11-02") == [('ноябрь 2026', '2')]
+    assert _find("2027-05-02") == [('Май 2027', '2')]
+
+
+def test_disabled_day_is_skipped():
+    assert _find("2026-10-03") == []
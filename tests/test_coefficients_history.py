@@ -0,0 +1,45 @@
+import asyncio
+
+from services.CoefficientsChangeTracker import SlotChange
+from services.CoefficientsHistory import CoefficientsHistory
+from services.WildberriesModels import AcceptanceCoefficient
+
+
+def _slot(coefficient: float) -> AcceptanceCoefficient:
+    return AcceptanceCoefficient(100, "Коледино", coefficient, "2030-01-10T00:00:00Z", 2, "Короба", True)
+
+
+def test_overlapping_pollers_record_change_once(tmp_path):
+    async def run():
+        history = CoefficientsHistory(str(tmp_path), flush_interval_sec=60)
+        opened = [SlotChange(_slot(-1), _slot(0))]
+        closed = [SlotChange(_slot(0), _slot(-1))]
+        # Два опроса с пересекающимися наборами складов видят одни и те же изменения вперемешку
+        history.record(opened, ts=1000)
+        history.record(opened, ts=1001)
+        history.record(closed, ts=2000)
+        history.record(closed, ts=2001)
+        records = await history.records(100)
+        await history.close()
+        return records
+
+    records = asyncio.run(run())
+    assert [(record.ts, record.coefficient) for record in records] == [(1000, 0), (2000, -1)]
+
+
+def test_openings_follow_new_records(tmp_path):
+    async def run():
+        history = CoefficientsHistory(str(tmp_path), flush_interval_sec=60)
+        history.record([SlotChange(None, _slot(0))], ts=1000)
+        first = await history.openings(100, 1)
+        history.record([SlotChange(_slot(0), _slot(-1))], ts=2000)
+        history.record([SlotChange(_slot(-1), _slot(1))], ts=3000)
+        everything = await history.openings(100, 1)
+        recent = await history.openings(100, 1, since=1500)
+        await history.close()
+        return first, everything, recent
+
+    first, everything, recent = asyncio.run(run())
+    assert [opening.ts for opening in first] == [1000]
+    assert [opening.ts for opening in everything] == [1000, 3000]
+    assert [opening.ts for opening in recent] == [3000]
@@ -0,0 +1,21 @@
+from modules.markdown_module import iter_code_block_messages
+
+
+def test_blocks_are_joined_without_blank_lines():
+    messages = list(iter_code_block_messages(["a\nb", "c"], 4096))
+    assert messages == ["```\na\nb\nc\n```"]
+
+
+def test_messages_respect_limit_and_keep_all_lines():
+    blocks = [f"line {index}\nsecond {index}" for index in range(200)]
+    messages = list(iter_code_block_messages(blocks, 300))
+    assert all(len(message) <= 300 for message in messages)
+    assert "\n\n" not in "".join(messages)
+    lines = [line for message in messages for line in message.split("\n") if line != "```"]
+    assert lines == [line for block in blocks for line in block.split("\n")]
+
+
+def test_long_line_is_split_without_breaking_escapes():
+    messages = list(iter_code_block_messages(["`" * 50], 40))
+    assert all(len(message) <= 40 for message in messages)
+    assert "".join(message[4:-4] for message in messages) == "\\`" * 50
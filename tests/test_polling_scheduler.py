@@ -0,0 +1,15 @@
+from modules.rate_limit_module import RateLimitState
+from services.PollingScheduler import AdaptivePollingScheduler
+
+
+def test_hot_polling_respects_token_limit():
+    scheduler = AdaptivePollingScheduler(base_interval_sec=12, min_interval_sec=1, requests_per_minute=6)
+    assert scheduler.next_delay(RateLimitState(), hot=True) >= 10
+
+
+def test_pollers_share_token_limit():
+    scheduler = AdaptivePollingScheduler(base_interval_sec=12, min_interval_sec=1, max_interval_sec=60,
+                                         requests_per_minute=6)
+    delays = [scheduler.next_delay(RateLimitState(), hot=True, active_pollers=12) for _ in range(20)]
+    # 12 опросов по 6 запросов в минуту на всех: каждый не чаще раза в 2 минуты, даже выше max_interval_sec
+    assert min(delays) >= 120
@@ -0,0 +1,45 @@
+import numpy as np
+
+from config import PREDICTION_HIGH_PROBABILITY, PREDICTION_LOW_PROBABILITY
+from modules.rate_limit_module import RateLimitState
+from services.PollingScheduler import AdaptivePollingScheduler
+from services.SlotOpeningPredictor import fit_opening_probabilities, hour_of_week
+
+WEEK_SEC = 7 * 24 * 3600
+# Понедельник 00:00 UTC
+MONDAY = 4 * 24 * 3600
+
+
+def _weekly_openings(weeks: int, opening_hour: int):
+    """Слот открывается каждую неделю в понедельник в opening_hour и закрывается через час"""
+    ts, slot, coefficient = [], [], []
+    for week in range(weeks):
+        opened_at = MONDAY + week * WEEK_SEC + opening_hour * 3600
+        ts += [opened_at, opened_at + 3600]
+        slot += [1, 1]
+        coefficient += [0, -1]
+    # Последнее изменение в конце окна — чтобы все часы недели были наблюдены
+    ts.append(MONDAY + weeks * WEEK_SEC - 1)
+    slot.append(2)
+    coefficient.append(-1)
+    return np.array(ts), np.array(slot), np.array(coefficient)
+
+
+def test_never_opening_hour_is_cold():
+    probabilities, observed = fit_opening_probabilities(*_weekly_openings(8, 10), max_coefficient=5,
+                                                        utc_offset_sec=0)
+    quiet_hour = int(hour_of_week(np.int64(MONDAY + 3 * 3600)))
+    hot_hour = int(hour_of_week(np.int64(MONDAY + 10 * 3600)))
+    assert observed[quiet_hour] >= 3
+    assert probabilities[quiet_hour] <= PREDICTION_LOW_PROBABILITY
+    assert probabilities[hot_hour] >= PREDICTION_HIGH_PROBABILITY
+
+
+def test_never_opening_hour_slows_polling():
+    probabilities, _ = fit_opening_probabilities(*_weekly_openings(8, 10), max_coefficient=5, utc_offset_sec=0)
+    quiet = float(probabilities[int(hour_of_week(np.int64(MONDAY + 3 * 3600)))])
+    scheduler = AdaptivePollingScheduler(base_interval_sec=12, min_interval_sec=10, max_interval_sec=300,
+                                         requests_per_minute=6)
+    cold_delays = [scheduler.next_delay(RateLimitState(), opening_probability=quiet) for _ in range(20)]
+    normal_delays = [scheduler.next_delay(RateLimitState()) for _ in range(20)]
+    assert min(cold_delays) > max(normal_delays)
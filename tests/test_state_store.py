@@ -0,0 +1,70 @@
+import asyncio
+
+from modules.rate_limit_module import RateLimitState
+from services.CoefficientsPollingService import CoefficientsPollingService
+from services.StateStore import StateStore
+from services.SubscriptionRules import SubscriptionRule
+from services.WildberriesModels import AcceptanceCoefficient
+
+
+class _FakeApiService:
+    def __init__(self, coefficients):
+        self.coefficients = coefficients
+        self.calls = 0
+        self.__rate_limit = RateLimitState()
+
+    def rate_limit_state(self, url):
+        return self.__rate_limit
+
+    async def get_acceptance_coefficients(self, warehouse_ids):
+        self.calls += 1
+        return self.coefficients
+
+
+async def _wait_for_calls(api, calls):
+    while api.calls < calls:
+        await asyncio.sleep(0.01)
+    # Даём опросу разослать уведомления и записать изменения
+    await asyncio.sleep(0.05)
+
+
+def test_resubscribe_does_not_restore_state_pending_delete(tmp_path):
+    db_path = str(tmp_path / "state.db")
+    slot = AcceptanceCoefficient(100, "Коледино", 0.0, "2030-01-10T00:00:00Z", 2, "Короба", True)
+    rule = SubscriptionRule(1, [100], 0, 1, [2])
+
+    async def run_first():
+        store = StateStore(db_path, flush_interval_sec=60)
+        api = _FakeApiService([slot])
+        service = CoefficientsPollingService(api, state_store=store)
+
+        async def notify(chat_id, event):
+            pass
+
+        service.subscribe(rule, notify)
+        await _wait_for_calls(api, 1)
+        await store.flush()
+
+        # Повторная подписка единственного чата перезапускает опрос и удаляет состояние набора
+        service.subscribe(rule, notify)
+        await _wait_for_calls(api, 2)
+        await service.close()
+        await store.close()
+
+    async def run_after_restart():
+        store = StateStore(db_path, flush_interval_sec=60)
+        api = _FakeApiService([slot])
+        service = CoefficientsPollingService(api, state_store=store)
+        events = []
+
+        async def notify(chat_id, event):
+            events.append(event)
+
+        service.subscribe(rule, notify, synced=True)
+        await _wait_for_calls(api, 1)
+        await service.close()
+        await store.close()
+        return events
+
+    asyncio.run(run_first())
+    assert asyncio.run(run_after_restart()) == []
@@ -0,0 +1,44 @@
+import pytest
+
+from services.SubscriptionRules import SubscriptionRule, parse_rule_args
+
+
+def _parse(args: str) -> SubscriptionRule:
+    return parse_rule_args(1, args, SubscriptionRule(1, [100]))
+
+
+def test_invalid_number_gives_russian_message():
+    with pytest.raises(ValueError) as error:
+        _parse("coef=abc")
+    assert str(error.value) == "Некорректное значение «abc» для «coef»"
+
+
+def test_invalid_date_gives_russian_message():
+    with pytest.raises(ValueError, match="Некорректное значение «2025-13-01» для «dates»"):
+        _parse("dates=2025-13-01")
+
+
+def test_unknown_key_is_reported():
+    with pytest.raises(ValueError, match="Неизвестный параметр «foo»"):
+        _parse("foo=1")
+
+
+def test_unknown_unload_value_is_rejected():
+    with pytest.raises(ValueError, match="Некорректное значение «maybe» для «unload»"):
+        _parse("unload=maybe")
+
+
+@pytest.mark.parametrize("value, expected", [("да", True), ("no", False), ("*", None)])
+def test_unload_values(value, expected):
+    assert _parse(f"unload={value}").allow_unload is expected
+
+
+def test_negative_coefficient_range():
+    rule = _parse("coef=-1-3")
+    assert (rule.min_coefficient, rule.max_coefficient) == (-1, 3)
+
+
+def test_coefficient_range_and_upper_bound():
+    rule = _parse("coef=1-4")
+    assert (rule.min_coefficient, rule.max_coefficient) == (1, 4)
+    assert _parse("coef=2").max_coefficient == 2